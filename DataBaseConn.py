@@ -1,23 +1,407 @@
 import os
+import io
+import time
+import contextlib
+import threading
+import itertools
 import sqlite3
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, inspect, event
+from sqlalchemy.engine import Engine
 import urllib.parse
+import esquema
+
+# filas por lote en insert_data_many
+INSERT_BATCH_SIZE = 10000
+
+
+def bulk_load(con, df, table_name, schema=None):
+    """
+    Graba el df en table_name de forma masiva, en una sola transacción.
+    En PostgreSQL usa COPY FROM STDIN con un buffer CSV en memoria y en SQLite un executemany.
+    con puede ser un Engine o una Connection de SQLAlchemy. Con un Engine la transacción se commitea al terminar;
+    con una Connection queda dentro de la transacción de quien llama.
+    Si la tabla no existe la crea con el DDL de esquema.TABLAS o, si no está ahí, con los tipos que infiere pandas, igual que to_sql.
+    Devuelve la cantidad de filas grabadas.
+    """
+    if isinstance(con, Engine):
+        with con.begin() as conn:
+            return bulk_load(conn, df, table_name, schema)
+    if not con.in_transaction():
+        with con.begin():
+            return bulk_load(con, df, table_name, schema)
+
+    if df.empty:
+        return 0
+
+    dialect = con.dialect.name
+    if dialect == 'sqlite':
+        # SQLite no tiene schemas
+        schema = None
+
+    rows = len(df)
+    if not inspect(con).has_table(table_name, schema=schema):
+        if table_name in esquema.TABLAS:
+            # las tablas del proyecto se crean con su DDL (tipos, índices y particiones)
+            esquema.crea_tabla(con, table_name, schema)
+        else:
+            # la creamos con la primera fila para que pandas infiera bien los tipos y cargamos el resto
+            df.iloc[:1].to_sql(name=table_name, con=con, index=False, schema=schema)
+            df = df.iloc[1:]
+            if df.empty:
+                return rows
+    if table_name in esquema.TABLAS:
+        esquema.asegura_particiones(con, table_name, df, schema)
+
+    preparer = con.dialect.identifier_preparer
+    table = preparer.quote(table_name)
+    if schema:
+        table = f"{preparer.quote_schema(schema)}.{table}"
+    columns = ", ".join(preparer.quote(str(c)) for c in df.columns)
+    cursor = con.connection.cursor()
+
+    try:
+        if dialect == 'postgresql':
+            # los NaN/None quedan como campo vacío sin comillas, que COPY interpreta como NULL
+            buffer = io.StringIO()
+            _enteros_como_enteros(df).to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            query = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+            if hasattr(cursor, 'copy_expert'):
+                # psycopg2
+                cursor.copy_expert(query, buffer)
+            else:
+                # psycopg 3
+                with cursor.copy(query) as copy:
+                    copy.write(buffer.getvalue())
+        else:
+            placeholders = ", ".join("?" for _ in df.columns)
+            query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+            cursor.executemany(query, _dataframe_rows(df, datetime_as_text=True))
+    finally:
+        cursor.close()
+
+    return rows
+
+
+def _enteros_como_enteros(df):
+    """
+    Pasa a Int64 las columnas float cuyos valores son todos enteros. Una columna entera con algún NaN llega como
+    float, y to_csv escribe 123.0, que COPY no acepta en una columna BIGINT; como entero sale 123, que también
+    entra en una columna DOUBLE PRECISION
+    """
+    convertir = {}
+    for col in df.columns:
+        if not pd.api.types.is_float_dtype(df[col]):
+            continue
+        valores = df[col].dropna()
+        # hasta 2**53 el float representa exacto al entero
+        if (valores % 1 == 0).all() and (valores.abs() < 2 ** 53).all():
+            convertir[col] = 'Int64'
+    return df.astype(convertir) if convertir else df
+
+
+def _dataframe_rows(df, batch_size=10000, datetime_as_text=False):
+    """
+    Filas del df como tuplas con tipos nativos de Python (None en lugar de NaN).
+    Convierte de a batch_size filas para no duplicar en memoria el df entero.
+    Con datetime_as_text las fechas van como texto, que es como las guarda to_sql en SQLite
+    """
+    datetime_cols = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    for start in range(0, len(df), batch_size):
+        chunk = df.iloc[start:start + batch_size]
+        if datetime_as_text and datetime_cols:
+            chunk = chunk.copy()
+            for col in datetime_cols:
+                chunk[col] = chunk[col].dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+
+def _batches(rows, batch_size):
+    """
+    Agrupa un iterable de filas en listas de a batch_size
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class IngestionUnit:
+    """
+    Unidad de trabajo de una ingesta: junta los DataFrames a grabar (por tabla) y los graba todos juntos,
+    en una sola transacción y con un solo COPY por tabla, al hacer commit. Así no puede quedar grabado
+    un archivo sin sus filas. Se obtiene con DatabaseConnection.ingestion()
+    """
+    def __init__(self, db):
+        self.db = db
+        self.pending = {}
+        self._on_commit = []
+        self._on_rollback = []
+
+    def add(self, df, table_name, schema=None):
+        # las tablas se graban en el orden en que se agregaron por primera vez
+        self.pending.setdefault((table_name, schema), []).append(df)
+
+    def on_commit(self, callback):
+        # callback a ejecutar solo si la transacción se commiteó
+        self._on_commit.append(callback)
+
+    def on_rollback(self, callback):
+        # callback a ejecutar si la transacción no se llegó a commitear
+        self._on_rollback.append(callback)
+
+    def savepoint(self):
+        """
+        Marca el estado actual de la unidad, para descartar con rollback_to lo que se agregue después
+        """
+        return ({key: len(dfs) for key, dfs in self.pending.items()}, len(self._on_commit), len(self._on_rollback))
+
+    def rollback_to(self, mark):
+        """
+        Descarta lo agregado después de savepoint() (DataFrames y callbacks) y corre los callbacks de rollback
+        registrados desde entonces. Lo anterior sigue pendiente
+        """
+        pending, on_commit, on_rollback = mark
+        self.pending = {key: dfs[:pending[key]] for key, dfs in self.pending.items() if pending.get(key)}
+        callbacks = self._on_rollback[on_rollback:]
+        del self._on_commit[on_commit:]
+        del self._on_rollback[on_rollback:]
+        for callback in callbacks:
+            callback()
+
+    def commit(self):
+        """
+        Graba todo lo pendiente en una transacción. Devuelve la cantidad de filas grabadas
+        """
+        rows = 0
+        if self.pending:
+            start = time.perf_counter()
+            with self.db.begin() as conn:
+                for (table_name, schema), dfs in self.pending.items():
+                    rows += bulk_load(conn, pd.concat(dfs, ignore_index=True), table_name, schema)
+            self.db.record_commit(time.perf_counter() - start, rows)
+            self.pending = {}
+
+        # ya está commiteado: a partir de acá no corresponde correr los callbacks de rollback
+        on_commit = self._on_commit
+        self._on_commit, self._on_rollback = [], []
+        for callback in on_commit:
+            callback()
+        return rows
+
+    def rollback(self):
+        self.pending = {}
+        for callback in self._on_rollback:
+            callback()
+        self._on_commit, self._on_rollback = [], []
 
 
 class DatabaseConnection:
-    def __init__(self, db_type, db_name):
+    """
+    Conexión a la base de datos con un pool de conexiones compartido por todo el script.
+    Los parámetros del pool se pueden pasar o tomar de las variables de entorno DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE y DB_STATEMENT_TIMEOUT_MS (en milisegundos, solo PostgreSQL).
+    Con sqlite_wal=True las bases SQLite se abren en modo WAL, con synchronous=NORMAL y busy_timeout.
+    Se puede usar como context manager: conecta al entrar y libera el pool al salir
+    """
+    def __init__(self, db_type, db_name, pool_size=None, max_overflow=None, pool_pre_ping=True, pool_recycle=None,
+                 statement_timeout=None, sqlite_wal=False):
         self.db_name = db_name
         self.conn = None
         self.cursor = None
         self.db_type = db_type
+        self.pool_size = pool_size if pool_size is not None else int(os.environ.get('DB_POOL_SIZE', '5'))
+        self.max_overflow = max_overflow if max_overflow is not None else int(os.environ.get('DB_MAX_OVERFLOW', '5'))
+        self.pool_pre_ping = pool_pre_ping
+        self.pool_recycle = pool_recycle if pool_recycle is not None else int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+        if statement_timeout is None and os.environ.get('DB_STATEMENT_TIMEOUT_MS'):
+            statement_timeout = int(os.environ['DB_STATEMENT_TIMEOUT_MS'])
+        self.statement_timeout = statement_timeout
+        self.sqlite_wal = sqlite_wal
+        self._metrics_lock = threading.Lock()
+        # métricas del pool: conexiones pedidas, conexiones nuevas al servidor y tiempo esperando una conexión
+        self.pool_metrics = {'checkouts': 0, 'connects': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+        # métricas de los commits hechos con ingestion()
+        self.commit_metrics = {'commits': 0, 'rows': 0, 'total_seconds': 0.0, 'last_seconds': None, 'max_seconds': 0.0}
         self.db_url = self.construct_db_url()
         self.engine = self.create_engine()
 
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def create_engine(self):
-        # Create an SQLAlchemy engine using the db_url
-        return create_engine(self.db_url)
+        # Create an SQLAlchemy engine using the db_url, con el pool configurado
+        kwargs = {'pool_pre_ping': self.pool_pre_ping}
+        if self.db_type == "postgresql":
+            kwargs.update(pool_size=self.pool_size, max_overflow=self.max_overflow, pool_recycle=self.pool_recycle)
+            if self.statement_timeout:
+                kwargs['connect_args'] = {'options': f"-c statement_timeout={int(self.statement_timeout)}"}
+        engine = create_engine(self.db_url, **kwargs)
+
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            self._count('connects')
+            if self.db_type == "sqlite" and self.sqlite_wal:
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+                cursor.execute("PRAGMA busy_timeout=5000")
+                cursor.close()
+
+        @event.listens_for(engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            self._count('checkouts')
+
+        return engine
+
+    def _count(self, metric, seconds=None):
+        with self._metrics_lock:
+            if seconds is None:
+                self.pool_metrics[metric] += 1
+            else:
+                self.pool_metrics[metric] += seconds
+                self.pool_metrics['max_wait_seconds'] = max(self.pool_metrics['max_wait_seconds'], seconds)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Conexión del pool (se devuelve al salir). Mide cuánto se esperó para obtenerla
+        """
+        start = time.perf_counter()
+        with self.engine.connect() as conn:
+            self._count('wait_seconds', time.perf_counter() - start)
+            yield conn
+
+    @contextlib.contextmanager
+    def begin(self):
+        """
+        Conexión del pool dentro de una transacción que se commitea al salir (o se deshace si hubo un error)
+        """
+        with self.connection() as conn:
+            with conn.begin():
+                yield conn
+
+    def bulk_load(self, df, table_name, schema=None):
+        # Carga masiva del df (COPY en PostgreSQL, executemany en SQLite). Ver bulk_load
+        with self.begin() as conn:
+            return bulk_load(conn, df, table_name, schema)
+
+    def fund_series(self, codigo, desde=None, hasta=None, columnas=None, tabla='tablaTempFCI'):
+        """
+        Serie diaria de un fondo (codigoCAFCI en las tablas de CAFCI, codBloomberg en diariaFIMA) entre desde y
+        hasta inclusive, como un df indexado por fecha. Va por el índice (fondo, fecha) de esquema.TABLAS.
+        Por defecto trae las columnas numéricas de la tabla
+        """
+        spec = esquema.TABLAS[tabla]
+        condiciones, params = self._rango_fechas(spec, desde, hasta)
+        condiciones.insert(0, f'"{spec.clave}" = :codigo')
+        params['codigo'] = codigo
+        query = (
+            f'SELECT "{spec.fecha}", {self._columnas(spec, columnas)} FROM {self._tabla(tabla)} '
+            f'WHERE {" AND ".join(condiciones)} ORDER BY "{spec.fecha}"'
+        )
+        with self.connection() as conn:
+            return pd.read_sql(text(query), conn, params=params, index_col=spec.fecha, parse_dates=[spec.fecha])
+
+    def fund_panel(self, desde=None, hasta=None, columnas=None, tabla='tablaTempFCI'):
+        """
+        Todas las filas (fondo, fecha, columnas) entre desde y hasta inclusive, ordenadas por fecha.
+        Es lo que lee analitica.Panel para armar la matriz fondos x fechas
+        """
+        spec = esquema.TABLAS[tabla]
+        condiciones, params = self._rango_fechas(spec, desde, hasta)
+        query = (
+            f'SELECT "{spec.clave}", "{spec.fecha}", {self._columnas(spec, columnas)} FROM {self._tabla(tabla)} '
+            f'WHERE {" AND ".join(condiciones)} ORDER BY "{spec.fecha}"'
+        )
+        with self.connection() as conn:
+            return pd.read_sql(text(query), conn, params=params, parse_dates=[spec.fecha])
+
+    def cross_section(self, fecha, columnas=None, tabla='tablaTempFCI'):
+        """
+        Todos los fondos en una fecha, como un df indexado por fondo. Va por el índice de fecha de esquema.TABLAS
+        (y en PostgreSQL solo lee la partición de ese mes)
+        """
+        spec = esquema.TABLAS[tabla]
+        condiciones, params = self._rango_fechas(spec, fecha, fecha)
+        query = (
+            f'SELECT "{spec.clave}", {self._columnas(spec, columnas)} FROM {self._tabla(tabla)} '
+            f'WHERE {" AND ".join(condiciones)} ORDER BY "{spec.clave}"'
+        )
+        with self.connection() as conn:
+            return pd.read_sql(text(query), conn, params=params, index_col=spec.clave)
+
+    def _tabla(self, tabla):
+        return f'public."{tabla}"' if self.db_type == 'postgresql' else f'"{tabla}"'
+
+    @staticmethod
+    def _columnas(spec, columnas):
+        # solo se aceptan columnas de la tabla, así no se puede meter cualquier cosa en la consulta
+        nombres = {c.nombre for c in spec.columnas}
+        if columnas is None:
+            columnas = [c.nombre for c in spec.columnas if c.tipo == 'numero']
+        invalidas = [c for c in columnas if c not in nombres]
+        if invalidas:
+            raise ValueError(f"Columnas que no están en la tabla: {invalidas}")
+        return ", ".join(f'"{c}"' for c in columnas)
+
+    @staticmethod
+    def _rango_fechas(spec, desde, hasta):
+        """
+        Condiciones sobre la columna de fecha para [desde, hasta]. El límite superior es el día siguiente sin incluir,
+        así también funciona con columnas con hora. Los parámetros van del mismo tipo que la columna
+        (date o datetime): en SQLite se comparan como texto
+        """
+        tipo = next(c.tipo for c in spec.columnas if c.nombre == spec.fecha)
+        convierte = (lambda f: f.date()) if tipo == 'fecha' else (lambda f: f.to_pydatetime())
+        condiciones, params = [], {}
+        if desde is not None:
+            condiciones.append(f'"{spec.fecha}" >= :desde')
+            params['desde'] = convierte(pd.Timestamp(desde).normalize())
+        if hasta is not None:
+            condiciones.append(f'"{spec.fecha}" < :hasta')
+            params['hasta'] = convierte(pd.Timestamp(hasta).normalize() + pd.Timedelta(days=1))
+        return condiciones or ['1 = 1'], params
+
+    @contextlib.contextmanager
+    def ingestion(self):
+        """
+        Unidad de trabajo para una corrida de ingesta:
+
+            with db.ingestion() as unit:
+                unit.add(df_mail, 'archivosFIMA', schema='public')
+                unit.add(df_filas, 'diariaFIMA', schema='public')
+
+        Todo lo agregado se graba en una sola transacción al salir del with. Si hay un error no se graba nada
+        """
+        unit = IngestionUnit(self)
+        try:
+            yield unit
+        except BaseException:
+            unit.rollback()
+            raise
+        try:
+            unit.commit()
+        except BaseException:
+            unit.rollback()
+            raise
+
+    def record_commit(self, seconds, rows):
+        with self._metrics_lock:
+            metrics = self.commit_metrics
+            metrics['commits'] += 1
+            metrics['rows'] += rows
+            metrics['total_seconds'] += seconds
+            metrics['last_seconds'] = seconds
+            metrics['max_seconds'] = max(metrics['max_seconds'], seconds)
 
     def connect(self):
         if self.db_type == "sqlite":
@@ -27,14 +411,15 @@ class DatabaseConnection:
             #self.conn = create_engine(self.db_url)
 
     def disconnect(self):
+        # devuelve la conexión al pool. El pool sigue disponible para las próximas consultas
         if self.conn:
-            if self.db_type == "sqlite":
-                self.conn.close()
-            elif self.db_type == "postgresql":
-                if self.conn:
-                    #self.conn.close()
-                    self.conn = None
-                    self.engine.dispose()
+            self.conn.close()
+            self.conn = None
+
+    def close(self):
+        # cierra la conexión y todas las del pool. Llamar al terminar el script
+        self.disconnect()
+        self.engine.dispose()
 
     def construct_db_url(self):
         if self.db_type == "sqlite":
@@ -90,39 +475,69 @@ class DatabaseConnection:
 
         self.execute_query(text(query))
 
-    def insert_data_many(self, table_name, data_list, overwrite=False):
+    def insert_data_many(self, table_name, data_list, overwrite=False, columns=None, batch_size=INSERT_BATCH_SIZE, schema=None):
+        """
+        Inserta muchas filas en table_name en una sola transacción, mandándolas en lotes de batch_size filas.
+        data_list puede ser un DataFrame o un iterable de tuplas; en ese caso hay que pasar columns.
+        Con overwrite=True vacía la tabla antes de insertar (TRUNCATE en PostgreSQL, DELETE en SQLite).
+        En PostgreSQL usa execute_values (un INSERT con muchas filas en VALUES) y en SQLite executemany.
+        Devuelve la cantidad de filas insertadas
+        """
         if not self.conn:
             raise ConnectionError("Database connection is not established.")
-        
-        if self.db_type == 'sqlite':
-            # Convert data list to list of dictionaries if it's a DataFrame
-            if isinstance(data_list, pd.DataFrame):
-                data_list = data_list.to_dict(orient="records")
-            
-            # Determine whether to overwrite the table
-            if overwrite:
-                self.execute_query(f"DELETE FROM {table_name}")
-            
-            # Construct and execute the INSERT query
-            column_names = ", ".join(data_list[0].keys())
-            placeholders = ", ".join(["?" for _ in data_list[0]])
 
-            query = f"INSERT INTO {table_name} ({column_names}) VALUES ({placeholders})"
-            data_to_insert = [tuple(row.values()) for row in data_list]
+        if isinstance(data_list, pd.DataFrame):
+            if columns is None:
+                columns = list(data_list.columns)
+            rows = _dataframe_rows(data_list, batch_size, datetime_as_text=(self.db_type == 'sqlite'))
+        else:
+            if columns is None:
+                raise ValueError("columns is required when data_list is not a DataFrame")
+            rows = data_list
 
-            self.conn.executemany(text(query), data_to_insert)
+        preparer = self.engine.dialect.identifier_preparer
+        table = preparer.quote(table_name)
+        if schema and self.db_type == 'postgresql':
+            table = f"{preparer.quote_schema(schema)}.{table}"
+        column_names = ", ".join(preparer.quote(str(c)) for c in columns)
 
-        elif self.db_type == 'postgresql':
-            if isinstance(data_list, pd.DataFrame):
-                data_list = data_list.to_dict(orient="records")
+        if self.db_type == 'sqlite':
+            cursor = self.conn.cursor()
+            placeholders = ", ".join(["?" for _ in columns])
+            delete_query = f"DELETE FROM {table}"
+        else:
+            # usamos el cursor de la conexión de la DBAPI, dentro de una transacción de SQLAlchemy
+            if not self.conn.in_transaction():
+                self.conn.begin()
+            cursor = self.conn.connection.cursor()
+            placeholders = ", ".join(["%s" for _ in columns])
+            delete_query = f"TRUNCATE TABLE {table}"
+
+        try:
+            execute_values = None
+            if self.db_type == 'postgresql':
+                try:
+                    from psycopg2.extras import execute_values
+                except ImportError:
+                    # con psycopg 3 executemany ya manda las filas en pipeline
+                    pass
 
             if overwrite:
-                self.execute_query(f"DELETE FROM {table_name}")
+                cursor.execute(delete_query)
 
-            column_names = ', '.join(data_list[0].keys())
-            placeholders = ', '.join(['%s' for _ in data_list[0]])
+            inserted = 0
+            for batch in _batches(rows, batch_size):
+                if execute_values is not None:
+                    execute_values(cursor, f"INSERT INTO {table} ({column_names}) VALUES %s", batch, page_size=len(batch))
+                else:
+                    cursor.executemany(f"INSERT INTO {table} ({column_names}) VALUES ({placeholders})", batch)
+                inserted += len(batch)
 
-            query = f"INSERT INTO {table_name} ({column_names}) VALUES ({placeholders})"
-            data_to_insert = [tuple(row.values()) for row in data_list]
-            
-            self.execute_query(query, data_to_insert)# ... (rest of the class remains the same)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        return inserted
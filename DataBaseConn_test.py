@@ -0,0 +1,43 @@
+"""
+Pruebas de DataBaseConn sin servidor: el CSV que bulk_load le pasa a COPY y la carga en una base SQLite temporal.
+
+    python -m pytest DataBaseConn_test.py
+"""
+
+import io
+import pandas as pd
+from DataBaseConn import IngestionUnit, _enteros_como_enteros
+
+
+def test_csv_de_enteros_con_vacios_no_lleva_decimales():
+    df = pd.DataFrame({'entero': [1.0, None, 3.0], 'numero': [1.5, 2.0, None], 'texto': ['a', 'b', 'c']})
+    buffer = io.StringIO()
+    _enteros_como_enteros(df).to_csv(buffer, index=False, header=False)
+    assert buffer.getvalue().splitlines() == ['1,1.5,a', ',2.0,b', '3,,c']
+    # el df de quien llama no se toca
+    assert df['entero'].dtype == 'float64'
+
+
+def test_bulk_load_sqlite(db):
+    df = pd.DataFrame({'a': range(25000), 'b': [None, 'x'] * 12500})
+    assert db.bulk_load(df, 'prueba') == len(df)
+    with db.connection() as conn:
+        leido = pd.read_sql('SELECT * FROM prueba', conn)
+    pd.testing.assert_frame_equal(leido, df)
+
+
+def test_rollback_to_descarta_solo_lo_posterior_al_savepoint():
+    unit = IngestionUnit(None)
+    llamados = []
+    unit.add(pd.DataFrame({'a': [1]}), 'uno')
+    unit.on_commit(lambda: llamados.append('commit 1'))
+    marca = unit.savepoint()
+    unit.add(pd.DataFrame({'a': [2]}), 'uno')
+    unit.add(pd.DataFrame({'a': [3]}), 'dos')
+    unit.on_commit(lambda: llamados.append('commit 2'))
+    unit.on_rollback(lambda: llamados.append('rollback 2'))
+    unit.rollback_to(marca)
+    assert llamados == ['rollback 2']
+    assert list(unit.pending) == [('uno', None)]
+    assert [df['a'].tolist() for df in unit.pending[('uno', None)]] == [[1]]
+    assert unit._on_commit and not unit._on_rollback
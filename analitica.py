@@ -0,0 +1,237 @@
+"""
+Cálculos sobre las series de vcp y patrimonio guardadas: rendimientos diarios, del mes (MTD) y del año (YTD),
+TNA y flujos (la variación del patrimonio que no se explica por el rendimiento).
+
+Las series se cargan en una matriz densa de NumPy fondos x fechas (NaN donde un fondo no informó) y todo se
+calcula por columnas, sin recorrer los fondos. Un Panel guarda el último valor de cada fondo, así cuando se
+carga un día nuevo solo se calculan sus columnas, sin volver a pasar por la historia:
+
+    panel = Panel.desde_db(db)          # toda la historia de tablaTempFCI
+    ...
+    panel.actualiza(db)                 # solo los días posteriores al último del panel
+    panel.frame('ytd')                  # df fondos x fechas
+"""
+
+import numpy as np
+import pandas as pd
+import esquema
+
+METRICAS = ('vcp', 'patrimonio', 'retorno', 'tna', 'mtd', 'ytd', 'flujo')
+DIAS_ANIO = 365
+
+
+def ultimo_valido(m):
+    """
+    Para cada celda, la columna del último valor no NaN hasta esa columna inclusive (-1 si no hay ninguno).
+    En int32, que alcanza para las columnas y mueve la mitad de memoria que int64
+    """
+    idx = np.where(np.isnan(m), np.int32(-1), np.arange(m.shape[1], dtype=np.int32))
+    return np.maximum.accumulate(idx, axis=1)
+
+
+def columnas_de(dias):
+    """
+    Columna de cada día entre los días distintos, ordenados: (columnas, fechas). Si los días ya vienen en orden
+    (fund_panel los devuelve así) alcanza con ver dónde cambian; si no, factorize (hash) en lugar de np.unique (sort)
+    y después se ordenan solo los distintos
+    """
+    enteros = dias.astype('int64')
+    if (enteros[1:] >= enteros[:-1]).all():
+        cambia = enteros[1:] != enteros[:-1]
+        columnas = np.concatenate([[0], np.cumsum(cambia)])
+        return columnas, dias[np.concatenate([[True], cambia])]
+    columnas, fechas = pd.factorize(dias)
+    orden = np.argsort(fechas)
+    return np.argsort(orden)[columnas], np.asarray(fechas)[orden]
+
+
+def toma(m, idx):
+    """
+    m[fila, idx[fila, j]] para cada celda, con idx de ultimo_valido. Donde idx es -1 no hubo ningún valor
+    hasta ahí, así que la columna 0 de esa fila es NaN y sirve de resultado
+    """
+    return np.take_along_axis(m, np.maximum(idx, 0), axis=1)
+
+
+class Panel:
+    """
+    Matrices fondos x fechas con vcp, patrimonio y las métricas calculadas. Las fechas van en orden y solo se
+    pueden agregar fechas posteriores a la última. Las matrices se guardan con capacidad de sobra (crece de a
+    bloques cuando hace falta), así agregar un día no copia toda la historia
+    """
+
+    def __init__(self, tabla='tablaTempFCI'):
+        # tabla de donde salen las series: de ahí se toman las columnas de fondo y fecha
+        self.tabla = tabla
+        self.clave = esquema.TABLAS[tabla].clave
+        self.columna_fecha = esquema.TABLAS[tabla].fecha
+        self.fondos = []
+        self._fila = {}
+        self.fechas = np.empty(0, dtype='datetime64[D]')
+        self._datos = {m: np.full((0, 0), np.nan) for m in METRICAS}
+        # estado de cada fondo al final del panel: último vcp y patrimonio informados, fecha de ese vcp y
+        # los valores base del mes y del año de esa fecha
+        self.ultimo_vcp = np.empty(0)
+        self.ultimo_patrimonio = np.empty(0)
+        self.ultima_fecha = np.empty(0, dtype='datetime64[D]')
+        self.base_mes = np.empty(0)
+        self.base_anio = np.empty(0)
+
+    @classmethod
+    def desde_db(cls, db, desde=None, hasta=None, tabla='tablaTempFCI'):
+        panel = cls(tabla)
+        panel.agrega(db.fund_panel(desde, hasta, ['vcp', 'patrimonio'], tabla))
+        return panel
+
+    def actualiza(self, db):
+        """
+        Agrega los días que están en la base y son posteriores al último del panel
+        """
+        desde = self.fechas[-1] + np.timedelta64(1, 'D') if len(self.fechas) else None
+        return self.agrega(db.fund_panel(desde, None, ['vcp', 'patrimonio'], self.tabla))
+
+    def matriz(self, metrica):
+        return self._datos[metrica][:len(self.fondos), :len(self.fechas)]
+
+    def frame(self, metrica):
+        return pd.DataFrame(self.matriz(metrica), index=pd.Index(self.fondos, name=self.clave),
+                            columns=pd.DatetimeIndex(self.fechas, name='fecha'))
+
+    def agrega(self, df):
+        """
+        Agrega las filas de df (columnas de fondo y fecha de la tabla, vcp y patrimonio, como las devuelve
+        fund_panel o como salen del parseo de un archivo). Todas las fechas tienen que ser posteriores a la
+        última del panel
+        """
+        fecha = self.columna_fecha
+        if df[[self.clave, fecha]].isna().any(axis=None):
+            df = df.dropna(subset=[self.clave, fecha])
+        if df.empty:
+            return self
+        claves = df[self.clave]
+        if pd.api.types.is_float_dtype(claves) and (claves % 1 == 0).all():
+            # los códigos vienen como float cuando la columna tiene NULLs
+            claves = claves.astype('int64')
+        dias = df[fecha]
+        if not pd.api.types.is_datetime64_dtype(dias):
+            # to_datetime sobre una columna que ya es datetime64 no es gratis: busca los valores distintos
+            dias = pd.to_datetime(dias)
+        dias = dias.to_numpy().astype('datetime64[D]')
+        if len(self.fechas) and dias.min() <= self.fechas[-1]:
+            raise ValueError(f"Solo se pueden agregar fechas posteriores a {self.fechas[-1]}")
+
+        # filas de los fondos (agregando los nuevos) y columnas de las fechas del bloque
+        codigos, cual = pd.factorize(claves)
+        filas = self._filas_de(cual.tolist())[codigos]
+        columnas, fechas = columnas_de(dias)
+
+        # el bloque se escribe directamente en las columnas libres de las matrices, sin armarlo aparte y copiarlo
+        n, k = len(self.fondos), len(fechas)
+        inicio = len(self.fechas)
+        self._reserva(n, inicio + k)
+        bloque = {metrica: self._datos[metrica][:n, inicio:inicio + k] for metrica in METRICAS}
+        try:
+            for metrica in ('vcp', 'patrimonio'):
+                bloque[metrica][filas, columnas] = pd.to_numeric(df[metrica], errors='coerce').to_numpy(dtype=float)
+            self._calcula(bloque, fechas)
+        except BaseException:
+            # las columnas libres tienen que quedar en NaN para el próximo bloque
+            for datos in bloque.values():
+                datos[:] = np.nan
+            raise
+        self.fechas = np.concatenate([self.fechas, fechas])
+        return self
+
+    def _filas_de(self, codigos):
+        """
+        Filas de los fondos `codigos` (distintos), agregando al final los que no estaban
+        """
+        nuevos = [codigo for codigo in codigos if codigo not in self._fila]
+        if nuevos:
+            for codigo in nuevos:
+                self._fila[codigo] = len(self.fondos)
+                self.fondos.append(codigo)
+            vacios = np.full(len(nuevos), np.nan)
+            self.ultimo_vcp = np.append(self.ultimo_vcp, vacios)
+            self.ultimo_patrimonio = np.append(self.ultimo_patrimonio, vacios)
+            self.ultima_fecha = np.append(self.ultima_fecha, np.full(len(nuevos), np.datetime64('NaT', 'D')))
+            self.base_mes = np.append(self.base_mes, vacios)
+            self.base_anio = np.append(self.base_anio, vacios)
+        return np.array([self._fila[codigo] for codigo in codigos], dtype=np.intp)
+
+    def _reserva(self, filas, columnas):
+        actual = self._datos['vcp'].shape
+        if filas <= actual[0] and columnas <= actual[1]:
+            return
+        # crece de a un cuarto (y con al menos un trimestre de días hábiles y 64 fondos de sobra, así el día
+        # siguiente a la carga de la historia no copia todo), no al doble: son siete matrices grandes
+        nueva = (max(filas + 64, actual[0] + actual[0] // 4), max(columnas + 64, actual[1] + actual[1] // 4))
+        for metrica in METRICAS:
+            datos = np.full(nueva, np.nan)
+            datos[:actual[0], :actual[1]] = self._datos[metrica]
+            self._datos[metrica] = datos
+
+    def _calcula(self, bloque, fechas):
+        """
+        Métricas de un bloque de columnas (n fondos x k fechas nuevas), a partir del estado de cada fondo al final
+        del panel. bloque tiene las matrices n x k de cada métrica, con vcp y patrimonio cargados: las demás se
+        escriben ahí. Actualiza el estado
+        """
+        vcp, patrimonio = bloque['vcp'], bloque['patrimonio']
+        # columna 0: el último valor de cada fondo antes del bloque
+        ext_vcp = np.hstack([self.ultimo_vcp[:, None], vcp])
+        idx_vcp = ultimo_valido(ext_vcp)
+        relleno = toma(ext_vcp, idx_vcp)
+        previo = idx_vcp[:, :-1]
+        vcp_previo = relleno[:, :-1]
+
+        retorno = np.divide(vcp, vcp_previo, out=bloque['retorno'])
+        retorno -= 1
+        # días desde el vcp anterior: previo - 1 es la columna del bloque; -1 (el vcp anterior es del estado)
+        # y -2 (no hay vcp anterior) toman los NaN del final, y los del estado se completan con su fecha
+        dia = fechas.astype('int64').astype(float)
+        dia_previo = np.concatenate([dia, [np.nan, np.nan]])[previo - 1]
+        ultima_fecha = np.where(np.isnat(self.ultima_fecha), np.nan, self.ultima_fecha.astype('int64'))
+        np.copyto(dia_previo, ultima_fecha[:, None], where=previo == 0)
+        np.subtract(dia, dia_previo, out=dia_previo)
+        tna = np.multiply(retorno, DIAS_ANIO, out=bloque['tna'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tna /= dia_previo
+
+        ext_patrimonio = np.hstack([self.ultimo_patrimonio[:, None], patrimonio])
+        relleno_patrimonio = toma(ext_patrimonio, ultimo_valido(ext_patrimonio))
+        # flujo = patrimonio - patrimonio_previo * (1 + retorno)
+        flujo = np.add(retorno, 1, out=bloque['flujo'])
+        flujo *= relleno_patrimonio[:, :-1]
+        np.subtract(patrimonio, flujo, out=flujo)
+
+        def base(unidad, base_estado):
+            # vcp base de cada celda: el último antes del inicio del mes (o año) de esa fecha
+            periodo = fechas.astype(f'datetime64[{unidad}]')
+            frontera = np.searchsorted(fechas, periodo.astype('datetime64[D]'))
+            resultado = relleno[:, frontera]
+            # las fechas del período que ya venía antes del bloque toman la base del estado (si el último vcp
+            # es de ese mismo período) o el último vcp (si es de antes)
+            primeras = np.flatnonzero(frontera == 0)
+            if len(primeras):
+                mismo_periodo = self.ultima_fecha.astype(f'datetime64[{unidad}]')[:, None] == periodo[None, primeras]
+                resultado[:, primeras] = np.where(mismo_periodo, base_estado[:, None], self.ultimo_vcp[:, None])
+            return resultado
+
+        base_mes = base('M', self.base_mes)
+        base_anio = base('Y', self.base_anio)
+        np.divide(vcp, base_mes, out=bloque['mtd'])
+        bloque['mtd'] -= 1
+        np.divide(vcp, base_anio, out=bloque['ytd'])
+        bloque['ytd'] -= 1
+
+        # estado al final del bloque: solo cambia para los fondos que informaron vcp en el bloque
+        ultimo = idx_vcp[:, -1]
+        informo = ultimo > 0
+        filas = np.arange(len(ultimo))
+        columna = np.maximum(ultimo - 1, 0)
+        self.ultimo_vcp = relleno[:, -1]
+        self.ultima_fecha = np.where(informo, fechas[columna], self.ultima_fecha)
+        self.base_mes = np.where(informo, base_mes[filas, columna], self.base_mes)
+        self.base_anio = np.where(informo, base_anio[filas, columna], self.base_anio)
+        self.ultimo_patrimonio = relleno_patrimonio[:, -1]
@@ -0,0 +1,114 @@
+"""
+Pruebas de analitica.Panel: las métricas contra el mismo cálculo hecho con pandas fila por fila (merge_asof por
+fondo), y el panel armado de a bloques (agrega, actualiza contra una base SQLite) igual al armado de una vez.
+
+    python -m pytest analitica_test.py
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from analitica import Panel, DIAS_ANIO
+from datosSinteticos import series_fondos
+
+FECHAS = pd.bdate_range('2023-12-18', '2024-02-09')
+# bloques para armar el panel de a partes: uno corta en el medio del hueco del fondo 2 y otro en el medio de un mes
+CORTES = [pd.Timestamp('2024-01-03'), pd.Timestamp('2024-01-17')]
+
+
+@pytest.fixture
+def series():
+    df = series_fondos(4, FECHAS, faltantes=0.1, seed=1)
+    # el fondo 2 no informa del 27/12 al 5/1 (cruza el cambio de año) y el 5 empieza el 15/1
+    hueco = (df['codigoCAFCI'] == 2) & df['fecha'].between('2023-12-27', '2024-01-05')
+    nuevo = series_fondos(1, FECHAS[FECHAS >= '2024-01-15'], seed=2).assign(codigoCAFCI=5)
+    return pd.concat([df[~hueco], nuevo]).sort_values('fecha', kind='stable').reset_index(drop=True)
+
+
+def anterior(df, left_on, columnas):
+    """
+    Para cada fila, las columnas de la última fila del mismo fondo con fecha anterior a left_on
+    """
+    izquierda = df.reset_index().sort_values(left_on)
+    derecha = df[['codigoCAFCI', 'fecha'] + columnas].rename(columns={'fecha': 'fechaPrevia'})
+    derecha = derecha.rename(columns={c: f'{c}Previo' for c in columnas}).sort_values('fechaPrevia')
+    unido = pd.merge_asof(izquierda, derecha, left_on=left_on, right_on='fechaPrevia', by='codigoCAFCI',
+                          allow_exact_matches=False)
+    return unido.set_index('index').sort_index()
+
+
+def metricas_pandas(df):
+    df = df.assign(inicioMes=df['fecha'].dt.to_period('M').dt.start_time,
+                   inicioAnio=df['fecha'].dt.to_period('Y').dt.start_time)
+    previo = anterior(df, 'fecha', ['vcp', 'patrimonio'])
+    retorno = df['vcp'] / previo['vcpPrevio'] - 1
+    return pd.DataFrame({
+        'retorno': retorno,
+        'tna': retorno * DIAS_ANIO / (df['fecha'] - previo['fechaPrevia']).dt.days,
+        'mtd': df['vcp'] / anterior(df, 'inicioMes', ['vcp'])['vcpPrevio'] - 1,
+        'ytd': df['vcp'] / anterior(df, 'inicioAnio', ['vcp'])['vcpPrevio'] - 1,
+        'flujo': df['patrimonio'] - previo['patrimonioPrevio'] * (1 + retorno),
+    })
+
+
+def en_filas(panel, metrica, df):
+    # el valor del panel en el (fondo, fecha) de cada fila de df
+    filas = pd.Index(panel.fondos).get_indexer(df['codigoCAFCI'])
+    columnas = pd.DatetimeIndex(panel.fechas).get_indexer(df['fecha'])
+    return panel.matriz(metrica)[filas, columnas]
+
+
+def bloques(df):
+    limites = [FECHAS[0]] + CORTES + [FECHAS[-1] + pd.Timedelta(days=1)]
+    return [df[(df['fecha'] >= desde) & (df['fecha'] < hasta)] for desde, hasta in zip(limites, limites[1:])]
+
+
+def test_metricas_iguales_a_pandas(series):
+    panel = Panel().agrega(series)
+    esperado = metricas_pandas(series)
+    for metrica in ('vcp', 'patrimonio'):
+        np.testing.assert_array_equal(en_filas(panel, metrica, series), series[metrica].to_numpy())
+    for metrica in esperado.columns:
+        np.testing.assert_allclose(en_filas(panel, metrica, series), esperado[metrica].to_numpy(), rtol=1e-12,
+                                   err_msg=metrica)
+    # el fondo que empieza el 15/1 no tiene MTD en enero, y sí en febrero
+    nuevo = series[series['codigoCAFCI'] == 5]
+    enero = (nuevo['fecha'] < '2024-02-01').to_numpy()
+    mtd = en_filas(panel, 'mtd', nuevo)
+    assert np.isnan(mtd[enero]).all() and not np.isnan(mtd[~enero]).any()
+    # lo que no se informó queda NaN
+    assert np.isnan(panel.matriz('vcp')).sum() == panel.matriz('vcp').size - len(series)
+
+
+def test_agregar_de_a_bloques_es_igual_a_todo_junto(series):
+    completo = Panel().agrega(series)
+    panel = Panel()
+    for bloque in bloques(series):
+        panel.agrega(bloque)
+    assert panel.fondos == completo.fondos
+    np.testing.assert_array_equal(panel.fechas, completo.fechas)
+    for metrica in ('vcp', 'patrimonio', 'retorno', 'tna', 'mtd', 'ytd', 'flujo'):
+        np.testing.assert_allclose(panel.matriz(metrica), completo.matriz(metrica), rtol=1e-12, err_msg=metrica)
+
+
+def test_actualiza_desde_la_base(series, db):
+    # la base guarda la fecha como date, como tablaTempFCI
+    primero, *siguientes = bloques(series)
+    db.bulk_load(primero.assign(fecha=primero['fecha'].dt.date), 'tablaTempFCI')
+    panel = Panel.desde_db(db)
+    for bloque in siguientes:
+        db.bulk_load(bloque.assign(fecha=bloque['fecha'].dt.date), 'tablaTempFCI')
+        panel.actualiza(db)
+    # sin días nuevos no cambia nada
+    panel.actualiza(db)
+
+    completo = Panel().agrega(series)
+    np.testing.assert_array_equal(panel.fechas, completo.fechas)
+    for metrica in ('retorno', 'tna', 'mtd', 'ytd', 'flujo'):
+        pd.testing.assert_frame_equal(panel.frame(metrica), completo.frame(metrica), rtol=1e-12)
+
+
+def test_no_acepta_fechas_anteriores_a_la_ultima(series):
+    panel = Panel().agrega(series[series['fecha'] < CORTES[0]])
+    with pytest.raises(ValueError, match='posteriores'):
+        panel.agrega(series[series['fecha'] == CORTES[0] - pd.Timedelta(days=1)])
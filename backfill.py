@@ -0,0 +1,385 @@
+"""
+Recarga en la base de datos un archivo histórico de planillas ya bajadas, sin pasar por la descarga ni por el mail.
+
+    python backfill.py cafci /ruta/planillas_cafci     -> tablaTempFCI (y el estado en archivosCAFCI)
+    python backfill.py fima /ruta/adjuntos_fima        -> diariaFIMA (y archivosFIMA si el mail no estaba)
+
+El parseo (pandas, CPU) corre en un ProcessPoolExecutor con un proceso por núcleo; los resultados vuelven al
+proceso principal, que es el único que escribe, de a lotes de --lote archivos por transacción.
+El estado de cada archivo (ok, fallido o el error) se guarda en un json en el directorio, así si se corta se puede
+volver a correr y sigue desde donde quedó. Los archivos con error se reintentan en la corrida siguiente.
+Aunque no esté el json (por ejemplo sobre el ATTACH_DIR de fimaETL) la recarga no duplica filas: se saltean los
+archivos cuyo ID ya está cargado (procesado_ok en archivosCAFCI, o con filas en diariaFIMA).
+
+Nombres que se reconocen:
+    cafci: ID_nombre.xls (como los guarda scrape en CAFCI_ARCHIVE_DIR), el ID es lo que está antes del primer '_'
+           y tiene que estar en archivosCAFCI; los que no están se reintentan en la corrida siguiente
+    fima:  AAAAMMDD_hash_uuid.xls (fimaETL.store_attachment) o el formato viejo
+           AAAAMMDD_HH-MM-SS_nombre.xls_DD-MM-AAAA (fecha de recepción, nombre original, fecha del asunto)
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+import pandas as pd
+import sqlalchemy
+from DataBaseConn import DatabaseConnection
+
+# formato viejo de los adjuntos de FIMA: fechaRecepcion_nombreOriginal_fechaAsunto
+legacy_name_pattern = re.compile(r'^(\d{8}_\d{2}-\d{2}-\d{2})_(.+\.xlsx?)_(\d{1,2}-\d{1,2}-\d{2,4})$', re.IGNORECASE)
+
+
+def parsea_cafci(ruta):
+    """
+    Corre en los procesos del pool. Devuelve el df de la planilla o None si no tiene un formato conocido
+    """
+    import scrape
+    return scrape.read_excel_cached(ruta)
+
+
+def parsea_fima(ruta, mail_df):
+    """
+    Corre en los procesos del pool. Devuelve las filas para diariaFIMA
+    """
+    import fimaETL
+    with open(ruta, 'rb') as f:
+        return fimaETL.parse_attachment(mail_df, f.read())
+
+
+def fecha_asunto(date_str):
+    # igual que fimaETL.store_attachment: primero con año de 4 dígitos, después de 2
+    try:
+        return datetime.strptime(date_str, '%d-%m-%Y')
+    except ValueError:
+        return datetime.strptime(date_str, '%d-%m-%y')
+
+
+def mail_de_archivo(nombre, ids_conocidos):
+    """
+    Arma el registro de archivosFIMA para un adjunto a partir de su nombre. Si el adjunto ya está en archivosFIMA
+    se usa su id. Devuelve (mail_df, nuevo), con nuevo=True si hay que grabar el registro, o (None, False)
+    si el nombre no tiene un formato conocido
+    """
+    import fimaETL
+
+    match = fimaETL.stored_name_pattern.match(nombre)
+    if match:
+        fecha = datetime.strptime(match.group(1), '%Y%m%d')
+        recepcion = None
+        id = match.group(3)
+    else:
+        match = legacy_name_pattern.match(nombre)
+        if not match:
+            return None, False
+        recepcion = datetime.strptime(match.group(1), '%Y%m%d_%H-%M-%S')
+        fecha = fecha_asunto(match.group(3))
+        id = fimaETL.generate_uuid()
+
+    nuevo = nombre not in ids_conocidos
+    mail_df = pd.DataFrame([{
+        'fechaRecepcion': recepcion,
+        'descripcion': None,
+        'fechaCorrespondeParseada': fecha,
+        'fileName': nombre,
+        'id': ids_conocidos.get(nombre, id),
+    }])
+    return mail_df, nuevo
+
+
+def id_de_archivo(nombre):
+    # ID de archivosCAFCI de una planilla guardada por scrape como ID_nombre.xls
+    return nombre.split('_', 1)[0]
+
+
+def _existe(db, tabla):
+    return sqlalchemy.inspect(db.engine).has_table(tabla, schema='public' if db.db_type == 'postgresql' else None)
+
+
+def archivos_cafci(db):
+    """
+    ID -> procesado_ok de los archivos de archivosCAFCI
+    """
+    if not _existe(db, 'archivosCAFCI'):
+        return {}
+    with db.connection() as conn:
+        result = conn.execute(sqlalchemy.text('SELECT "ID", procesado_ok FROM "archivosCAFCI"'))
+        return {str(ID): procesado_ok for ID, procesado_ok in result}
+
+
+def ids_cargados_fima(db):
+    """
+    ids de archivosFIMA que ya tienen filas en diariaFIMA
+    """
+    if not _existe(db, 'diariaFIMA'):
+        return set()
+    with db.connection() as conn:
+        result = conn.execute(sqlalchemy.text('SELECT DISTINCT "id" FROM "diariaFIMA"'))
+        return {id for id, in result}
+
+
+def mails_conocidos(db):
+    """
+    fileName -> id de los adjuntos que ya están en archivosFIMA
+    """
+    if not _existe(db, 'archivosFIMA'):
+        return {}
+    with db.connection() as conn:
+        result = conn.execute(sqlalchemy.text('SELECT "fileName", "id" FROM "archivosFIMA"'))
+        return {fileName: id for fileName, id in result}
+
+
+class Estado:
+    """
+    Estado por archivo de la recarga, guardado en un json. 'ok' y 'fallido' (formato desconocido) no se vuelven
+    a procesar; cualquier otro valor es un error y se reintenta
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.archivos = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.archivos = json.load(f)
+
+    def pendiente(self, nombre):
+        return self.archivos.get(nombre) not in ('ok', 'fallido')
+
+    def marca(self, nombres, estado):
+        for nombre in nombres:
+            self.archivos[nombre] = estado
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.archivos, f, indent=0, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class Progreso:
+    def __init__(self, total):
+        self.total = total
+        self.hechos = 0
+        self.filas = 0
+        self.errores = 0
+        self.inicio = time.monotonic()
+
+    def avanza(self, archivos, filas, errores=0):
+        self.hechos += archivos
+        self.filas += filas
+        self.errores += errores
+        segundos = time.monotonic() - self.inicio
+        ritmo = self.hechos / segundos if segundos else 0
+        restante = (self.total - self.hechos) / ritmo if ritmo else 0
+        print(f"{self.hechos}/{self.total} archivos ({100 * self.hechos / max(self.total, 1):.1f}%), "
+              f"{self.filas} filas, {self.errores} con error, {ritmo:.1f} archivos/s, faltan ~{restante:.0f}s")
+
+
+class EscritorCAFCI:
+    """
+    Graba los lotes en tablaTempFCI y el estado en archivosCAFCI, con scrape.EstadoArchivos
+    """
+
+    def __init__(self, db):
+        from scrape import EstadoArchivos
+        # el lote lo maneja la recarga: EstadoArchivos solo graba cuando se llama a flush
+        self.estado = EstadoArchivos(db, batch_size=sys.maxsize)
+        self.nombres = {}
+
+    def add(self, nombre, df):
+        ID = id_de_archivo(nombre)
+        self.nombres[ID] = nombre
+        if df is None:
+            self.estado.add_failed(ID)
+        else:
+            self.estado.add_ok(ID, df)
+
+    def flush(self):
+        return self.estado.flush()
+
+    def errores(self):
+        # nombre -> error de los archivos del último lote que no se pudieron grabar por sus datos
+        return {self.nombres[ID]: error for ID, error in self.estado.errores.items()}
+
+    def grabados(self):
+        # nombres de los archivos del último lote cuyo estado quedó grabado, aunque el lote no se haya grabado entero
+        return {self.nombres[ID] for ID in self.estado.grabados}
+
+
+class EscritorFIMA:
+    """
+    Graba los lotes en diariaFIMA (y en archivosFIMA los mails que no estaban) en una unidad de trabajo
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.pendientes = []
+        self._grabados = set()
+
+    def add(self, nombre, df, mail_df=None, nuevo=False):
+        # df None: el archivo no tiene un formato conocido, no hay nada que grabar
+        self.pendientes.append((nombre, df, mail_df if nuevo else None))
+
+    def flush(self):
+        pendientes, self.pendientes = self.pendientes, []
+        self._grabados = set()
+        try:
+            with self.db.ingestion() as unit:
+                for nombre, df, mail_df in pendientes:
+                    if df is None:
+                        continue
+                    if mail_df is not None:
+                        unit.add(mail_df, 'archivosFIMA', schema = 'public')
+                    unit.add(df, 'diariaFIMA', schema = 'public')
+        except Exception as e:
+            print(f"Hubo un error al grabar el lote: {e}")
+            return False
+        self._grabados = {nombre for nombre, df, mail_df in pendientes}
+        return True
+
+    def errores(self):
+        return {}
+
+    def grabados(self):
+        # el lote va en una sola transacción: o se grabó entero o nada
+        return self._grabados
+
+
+def recarga(modo, directorio, db, workers=None, lote=50, state_path=None):
+    """
+    Parsea en paralelo los archivos de directorio y los graba de a lotes. Devuelve el Progreso final
+    """
+    estado = Estado(state_path or os.path.join(directorio, f'.backfill_{modo}.json'))
+    nombres = sorted(
+        nombre for nombre in os.listdir(directorio)
+        # en los nombres viejos de FIMA la extensión queda en el medio
+        if not nombre.startswith('.') and '.xls' in nombre.lower() and estado.pendiente(nombre)
+    )
+    print(f"{len(nombres)} archivos para recargar en {directorio}")
+
+    if modo == 'cafci':
+        escritor = EscritorCAFCI(db)
+        conocidos = archivos_cafci(db)
+        # IDs ya cargados (o mandados a cargar en esta corrida): no se vuelven a grabar
+        cargados = {ID for ID, procesado_ok in conocidos.items() if procesado_ok}
+    else:
+        escritor = EscritorFIMA(db)
+        ids_conocidos = mails_conocidos(db)
+        cargados = ids_cargados_fima(db)
+
+    progreso = Progreso(len(nombres))
+    # nombre -> filas de los archivos del lote (None si no tienen un formato conocido)
+    en_lote = {}
+
+    def cierra_lote():
+        nonlocal en_lote
+        escritor.flush()
+        # el estado va por archivo: si se cortó la conexión a mitad de los reintentos de a uno, los que ya se
+        # grabaron quedan ok
+        grabados, errores = escritor.grabados(), escritor.errores()
+        filas = con_error = 0
+        for nombre, cantidad in en_lote.items():
+            if nombre in errores:
+                # no se pudo grabar por sus datos: queda con el error, para reintentarlo
+                estado.marca([nombre], f"error: {errores[nombre]}")
+                con_error += 1
+            elif nombre in grabados:
+                estado.marca([nombre], 'fallido' if cantidad is None else 'ok')
+                filas += cantidad or 0
+            else:
+                estado.marca([nombre], 'error: no se pudo grabar el lote')
+                con_error += 1
+        progreso.avanza(len(en_lote), filas, con_error)
+        estado.save()
+        en_lote = {}
+
+    max_en_vuelo = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        en_vuelo = {}
+        pendientes = iter(nombres)
+        terminado = False
+        while en_vuelo or not terminado:
+            # mantenemos a los procesos ocupados pero sin acumular más resultados en memoria de los que se graban
+            while not terminado and len(en_vuelo) < max_en_vuelo:
+                nombre = next(pendientes, None)
+                if nombre is None:
+                    terminado = True
+                    break
+                ruta = os.path.join(directorio, nombre)
+                if modo == 'cafci':
+                    ID = id_de_archivo(nombre)
+                    if ID not in conocidos:
+                        # puede aparecer cuando getIDs actualice archivosCAFCI: se reintenta en la próxima corrida
+                        print(f"El ID {ID} de {nombre} no está en archivosCAFCI. No se recarga")
+                        estado.marca([nombre], 'error: ID desconocido')
+                        progreso.avanza(1, 0, 1)
+                        continue
+                else:
+                    mail_df, nuevo = mail_de_archivo(nombre, ids_conocidos)
+                    if mail_df is None:
+                        print(f"No reconozco el nombre {nombre}. No se recarga")
+                        estado.marca([nombre], 'fallido')
+                        progreso.avanza(1, 0)
+                        continue
+                    ID = mail_df['id'].iloc[0]
+
+                if ID in cargados:
+                    print(f"El archivo {nombre} (ID {ID}) ya está cargado. No se recarga")
+                    estado.marca([nombre], 'ok')
+                    progreso.avanza(1, 0)
+                    continue
+                cargados.add(ID)
+                if modo == 'cafci':
+                    en_vuelo[pool.submit(parsea_cafci, ruta)] = (nombre, None, False)
+                else:
+                    en_vuelo[pool.submit(parsea_fima, ruta, mail_df)] = (nombre, mail_df, nuevo)
+
+            if not en_vuelo:
+                continue
+            listos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for future in listos:
+                nombre, mail_df, nuevo = en_vuelo.pop(future)
+                try:
+                    df = future.result()
+                except Exception as e:
+                    print(f"Error parseando {nombre}: {e}")
+                    estado.marca([nombre], f"error: {e}")
+                    progreso.avanza(1, 0, 1)
+                    continue
+                if modo == 'cafci':
+                    escritor.add(nombre, df)
+                else:
+                    escritor.add(nombre, df, mail_df, nuevo)
+                en_lote[nombre] = None if df is None else len(df)
+                if len(en_lote) >= lote:
+                    cierra_lote()
+
+    if en_lote:
+        cierra_lote()
+    estado.save()
+    return progreso
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recarga planillas históricas de CAFCI o FIMA desde un directorio")
+    parser.add_argument('modo', choices=['cafci', 'fima'])
+    parser.add_argument('directorio')
+    parser.add_argument('--workers', type=int, default=None, help="procesos de parseo (por defecto, uno por núcleo)")
+    parser.add_argument('--lote', type=int, default=50, help="archivos por transacción")
+    parser.add_argument('--estado', default=None, help="json con el estado de cada archivo (por defecto en el directorio)")
+    parser.add_argument('--db-type', default='postgresql')
+    parser.add_argument('--db-name', default=os.environ.get('POSTGRES_DB'))
+    args = parser.parse_args()
+
+    print(f"Iniciando recarga de {args.modo} desde {args.directorio} a las {time.ctime()}")
+    with DatabaseConnection(db_type=args.db_type, db_name=args.db_name) as db:
+        progreso = recarga(args.modo, args.directorio, db, args.workers, args.lote, args.estado)
+    print(f"Recarga finalizada a las {time.ctime()}: {progreso.hechos} archivos, {progreso.filas} filas, {progreso.errores} con error")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Pruebas de backfill.recarga de planillas de CAFCI con una base SQLite temporal: seguir después de un corte,
+volver a correr sin duplicar filas y el estado por archivo cuando un lote se graba solo en parte.
+
+    python -m pytest backfill_test.py
+"""
+
+import io
+import json
+import pandas as pd
+import pytest
+import sqlalchemy
+import backfill
+import scrape
+from datosSinteticos import dia, libro_cafci
+
+IDS = [str(ID) for ID in range(1, 7)]
+# filas de cada planilla
+FONDOS = 3
+
+
+class DataError(Exception):
+    pass
+
+
+@pytest.fixture
+def planillas(db, tmp_path, monkeypatch):
+    """
+    Un directorio con las planillas de IDS (como las guarda scrape en CAFCI_ARCHIVE_DIR) y archivosCAFCI con
+    esos IDs sin procesar
+    """
+    monkeypatch.setattr(scrape.cacheParseo, 'PARSE_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(scrape.validacion, 'VALIDACION', False)
+    directorio = tmp_path / 'planillas'
+    directorio.mkdir()
+    for ID in IDS:
+        (directorio / f'{ID}_Planilla.xlsx').write_bytes(libro_cafci(FONDOS, dia(int(ID))))
+    # el 7 es un Excel que no tiene el formato de CAFCI
+    otro = io.BytesIO()
+    pd.DataFrame({'hola': [1, 2]}).to_excel(otro, index=False)
+    (directorio / '7_Otra.xlsx').write_bytes(otro.getvalue())
+    db.bulk_load(pd.DataFrame({'ID': IDS + ['7'], 'descargado': True,
+                               'procesado_ok': pd.array([None] * 7, dtype='boolean')}), 'archivosCAFCI')
+    return directorio
+
+
+def recarga(db, directorio):
+    return backfill.recarga('cafci', str(directorio), db, workers=1, lote=3)
+
+
+def estados(directorio):
+    with open(directorio / '.backfill_cafci.json') as f:
+        return {nombre.split('_', 1)[0]: estado for nombre, estado in json.load(f).items()}
+
+
+def filas_por_ID(db):
+    with db.connection() as conn:
+        if not sqlalchemy.inspect(conn).has_table('tablaTempFCI'):
+            return {}
+        return dict(conn.execute(sqlalchemy.text('SELECT "ID", count(*) FROM "tablaTempFCI" GROUP BY "ID"')).fetchall())
+
+
+def procesados(db):
+    with db.connection() as conn:
+        return dict(conn.execute(sqlalchemy.text('SELECT "ID", procesado_ok FROM "archivosCAFCI"')).fetchall())
+
+
+def test_recarga_y_estado_por_archivo(db, planillas):
+    progreso = recarga(db, planillas)
+    assert filas_por_ID(db) == {ID: FONDOS for ID in IDS}
+    assert estados(planillas) == dict({ID: 'ok' for ID in IDS}, **{'7': 'fallido'})
+    assert procesados(db) == dict({ID: 1 for ID in IDS}, **{'7': 0})
+    assert (progreso.hechos, progreso.filas, progreso.errores) == (7, 6 * FONDOS, 0)
+
+
+def test_volver_a_correr_no_duplica(db, planillas):
+    recarga(db, planillas)
+    # con el json no hay nada pendiente
+    assert recarga(db, planillas).total == 0
+    # sin el json se saltean los IDs que ya están procesados en archivosCAFCI
+    (planillas / '.backfill_cafci.json').unlink()
+    assert recarga(db, planillas).filas == 0
+    assert filas_por_ID(db) == {ID: FONDOS for ID in IDS}
+
+
+def test_sigue_despues_de_un_corte(db, planillas, monkeypatch):
+    flush = backfill.EscritorCAFCI.flush
+    lotes = []
+
+    def se_corta_en_el_segundo_lote(self):
+        lotes.append(len(lotes))
+        if len(lotes) == 2:
+            raise KeyboardInterrupt
+        return flush(self)
+    monkeypatch.setattr(backfill.EscritorCAFCI, 'flush', se_corta_en_el_segundo_lote)
+    with pytest.raises(KeyboardInterrupt):
+        recarga(db, planillas)
+    # quedó grabado el primer lote, y el json lo dice
+    ok = [ID for ID, estado in estados(planillas).items() if estado == 'ok']
+    assert len(ok) == 3 and filas_por_ID(db) == {ID: FONDOS for ID in ok}
+
+    monkeypatch.setattr(backfill.EscritorCAFCI, 'flush', flush)
+    assert recarga(db, planillas).total == 4
+    assert filas_por_ID(db) == {ID: FONDOS for ID in IDS}
+    assert set(estados(planillas).values()) == {'ok', 'fallido'}
+
+
+def test_lote_grabado_en_parte(db, planillas, monkeypatch):
+    # el lote falla por los datos del ID 3, y al grabar de a un archivo se corta la conexión después de dos
+    original = scrape.bulk_load
+    de_a_uno = []
+
+    def bulk_load(conn, df, tabla, schema=None):
+        if tabla == 'tablaTempFCI':
+            ids = set(df['ID'])
+            if len(ids) > 1 and '3' in ids:
+                raise DataError('valor inválido en el archivo 3')
+            if len(ids) == 1:
+                de_a_uno.append(ids.pop())
+                if len(de_a_uno) == 3:
+                    raise sqlalchemy.exc.TimeoutError('se cortó la conexión')
+        return original(conn, df, tabla, schema)
+    monkeypatch.setattr(scrape, 'bulk_load', bulk_load)
+    backfill.recarga('cafci', str(planillas), db, workers=1, lote=7)
+
+    grabados = de_a_uno[:2]
+    assert filas_por_ID(db) == {ID: FONDOS for ID in grabados}
+    estado = estados(planillas)
+    # los que se grabaron de a uno quedan ok aunque el lote no se haya grabado entero; el resto, para reintentar
+    assert {ID for ID, valor in estado.items() if valor == 'ok'} == set(grabados)
+    assert all(valor.startswith('error') for ID, valor in estado.items() if ID not in grabados)
+    assert {ID: procesados(db)[ID] for ID in grabados} == {ID: 1 for ID in grabados}
+
+    monkeypatch.setattr(scrape, 'bulk_load', original)
+    recarga(db, planillas)
+    assert filas_por_ID(db) == {ID: FONDOS for ID in IDS}
+    assert estados(planillas) == dict({ID: 'ok' for ID in IDS}, **{'7': 'fallido'})
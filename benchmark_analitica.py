@@ -0,0 +1,89 @@
+"""
+Mide analitica.Panel sobre series sintéticas con la forma de tablaTempFCI (un vcp y un patrimonio por fondo y día
+hábil, con algunos días sin informar): armar el panel con toda la historia y agregar un día nuevo con actualiza,
+y compara las métricas contra el mismo cálculo con pandas por fondo (groupby), que es lo que se hacía antes.
+
+Uso:
+    python benchmark_analitica.py --fondos 3000 --anios 10
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from analitica import Panel
+from datosSinteticos import series_fondos
+
+
+class Tabla:
+    # lo que Panel usa de DatabaseConnection: fund_panel sobre un df en memoria
+
+    def __init__(self, df):
+        self.df = df
+
+    def fund_panel(self, desde=None, hasta=None, columnas=None, tabla='tablaTempFCI'):
+        df = self.df
+        if desde is not None:
+            df = df[df['fecha'] >= pd.Timestamp(desde)]
+        return df
+
+
+def metricas_pandas(df):
+    """
+    retorno, mtd e ytd con groupby por fondo, como los calculaba un consumidor antes de analitica
+    """
+    df = df.sort_values(['codigoCAFCI', 'fecha'])
+    fondo = df.groupby('codigoCAFCI')['vcp']
+    retorno = fondo.pct_change()
+    previo = fondo.shift()
+    mes = df['fecha'].dt.to_period('M')
+    anio = df['fecha'].dt.year
+    # base: el último vcp del fondo antes del período (NaN si el fondo empezó en ese período)
+    base_mes = previo.where(mes != df.groupby('codigoCAFCI')['fecha'].shift().dt.to_period('M'))
+    base_mes = base_mes.groupby([df['codigoCAFCI'], mes]).transform('first')
+    base_anio = previo.where(anio != df.groupby('codigoCAFCI')['fecha'].shift().dt.year)
+    base_anio = base_anio.groupby([df['codigoCAFCI'], anio]).transform('first')
+    return retorno, df['vcp'] / base_mes - 1, df['vcp'] / base_anio - 1
+
+
+def mide(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        resultado = funcion()
+    return (time.perf_counter() - inicio) / repeticiones, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de analitica.Panel")
+    parser.add_argument('--fondos', type=int, default=3000)
+    parser.add_argument('--anios', type=int, default=10)
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    fechas = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=args.anios * 261)
+    df = series_fondos(args.fondos, fechas)
+    historia, ultimo = df[df['fecha'] < fechas[-1]], df[df['fecha'] == fechas[-1]]
+    print(f"{args.fondos} fondos x {len(fechas)} días: {len(df)} filas")
+
+    segundos, panel = mide(lambda: Panel().agrega(historia), args.repeticiones)
+    print(f"Panel con toda la historia:        {segundos:8.3f} s")
+
+    def agrega_un_dia():
+        copia = Panel().agrega(historia)
+        inicio = time.perf_counter()
+        copia.actualiza(Tabla(ultimo))
+        return time.perf_counter() - inicio
+    segundos = sum(agrega_un_dia() for _ in range(args.repeticiones)) / args.repeticiones
+    print(f"actualiza con un día nuevo:        {segundos * 1000:8.1f} ms")
+
+    segundos, (retorno, mtd, ytd) = mide(lambda: metricas_pandas(historia), 1)
+    print(f"pandas con groupby por fondo:      {segundos:8.3f} s")
+    ordenado = historia.sort_values(['codigoCAFCI', 'fecha'])
+    filas = pd.Index(panel.fondos).get_indexer(ordenado['codigoCAFCI'])
+    columnas = pd.DatetimeIndex(panel.fechas).get_indexer(ordenado['fecha'])
+    for nombre, esperado in (('retorno', retorno), ('mtd', mtd), ('ytd', ytd)):
+        np.testing.assert_allclose(panel.matriz(nombre)[filas, columnas], esperado.to_numpy(), rtol=1e-9)
+
+
+if __name__ == "__main__":
+    main()
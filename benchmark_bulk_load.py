@@ -0,0 +1,74 @@
+"""
+Compara las filas por segundo de DataBaseConn.bulk_load (COPY en PostgreSQL, executemany en SQLite) con
+DataFrame.to_sql(if_exists='append'), que es como se grababan antes tablaTempFCI y diariaFIMA.
+Cada método carga los mismos archivos sintéticos, de a uno por transacción, en su propia tabla.
+
+Uso:
+    python benchmark_bulk_load.py --sqlite /tmp/bench.db --archivos 20 --fondos 3000
+    python benchmark_bulk_load.py --postgres bench_fondos     (una base vacía, no la de producción)
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from DataBaseConn import DatabaseConnection, bulk_load
+from benchmark_series import datos_sinteticos
+
+
+def archivos_sinteticos(fondos, archivos):
+    """
+    Un df por día hábil, con todas las columnas de tablaTempFCI y algunos enteros vacíos (como llegan de tipar)
+    """
+    fechas = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=archivos)
+    df = datos_sinteticos(fondos, fechas)
+    rng = np.random.default_rng(1)
+    df['codigoCNV'] = pd.array(df['codigoCNV'], dtype='Int64')
+    df.loc[rng.random(len(df)) < 0.1, 'codigoCNV'] = pd.NA
+    return [dia for _, dia in df.groupby('ID')]
+
+
+def corre(db, fondos, archivos):
+    lotes = archivos_sinteticos(fondos, archivos)
+    filas = sum(len(lote) for lote in lotes)
+    schema = 'public' if db.db_type == 'postgresql' else None
+    metodos = {
+        'to_sql': lambda conn, df, tabla: df.to_sql(tabla, conn, if_exists='append', index=False, schema=schema),
+        'bulk_load': lambda conn, df, tabla: bulk_load(conn, df, tabla, schema),
+    }
+    with db.begin() as conn:
+        for nombre in metodos:
+            if sqlalchemy.inspect(conn).has_table(f'bench_{nombre}', schema=schema):
+                raise SystemExit(f"La base ya tiene bench_{nombre}: el benchmark necesita una base vacía")
+
+    for nombre, carga in metodos.items():
+        tabla = f'bench_{nombre}'
+        inicio = time.perf_counter()
+        for lote in lotes:
+            with db.begin() as conn:
+                carga(conn, lote, tabla)
+        segundos = time.perf_counter() - inicio
+        print(f"{nombre:10} {filas} filas en {segundos:7.2f}s   {filas / segundos:10.0f} filas/s")
+
+    with db.begin() as conn:
+        for nombre in metodos:
+            conn.execute(sqlalchemy.text(f'DROP TABLE "bench_{nombre}"'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de bulk_load contra to_sql")
+    destino = parser.add_mutually_exclusive_group(required=True)
+    destino.add_argument('--sqlite', help="archivo SQLite (se crea)")
+    destino.add_argument('--postgres', help="nombre de una base PostgreSQL vacía")
+    parser.add_argument('--archivos', type=int, default=20)
+    parser.add_argument('--fondos', type=int, default=3000)
+    args = parser.parse_args()
+
+    db_type, db_name = ('sqlite', args.sqlite) if args.sqlite else ('postgresql', args.postgres)
+    with DatabaseConnection(db_type=db_type, db_name=db_name) as db:
+        corre(db, args.fondos, args.archivos)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compara los motores de lectura de Excel (ver lectorExcel.py) sobre un conjunto de archivos reales de CAFCI y FIMA.
+Cada motor corre en un proceso aparte para poder medir el pico de memoria (RSS) de cada uno.
+
+Uso:
+    python benchmark_excel.py --cafci /ruta/planillas_cafci --fima /ruta/adjuntos_fima --engines default calamine
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def corre_motor(tipo, archivos):
+    """
+    Se ejecuta en el proceso hijo: parsea todos los archivos con el parser del ETL correspondiente
+    (el motor ya viene fijado en EXCEL_ENGINE) e imprime el resultado en JSON
+    """
+    import resource
+
+    if tipo == 'cafci':
+        from scrape import read_excel_file
+        parsea = read_excel_file
+    else:
+        # parse_workbook y no parse_attachment: este necesita el registro del mail y pasa por la cache de parseo,
+        # que no tiene que entrar en la medición
+        from fimaETL import parse_workbook
+
+        def parsea(archivo):
+            with open(archivo, 'rb') as f:
+                return parse_workbook(f.read())
+
+    inicio = time.perf_counter()
+    filas = errores = 0
+    for archivo in archivos:
+        try:
+            df = parsea(archivo)
+            filas += 0 if df is None else len(df)
+        except Exception as e:
+            errores += 1
+            print(f"Error leyendo {archivo}: {e}", file=sys.stderr)
+    segundos = time.perf_counter() - inicio
+
+    # ru_maxrss viene en KB en Linux y en bytes en macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024
+    print(json.dumps({'segundos': segundos, 'filas': filas, 'errores': errores, 'rss_mb': maxrss / 1024}))
+
+
+def lista_archivos(directorio):
+    return sorted(
+        os.path.join(directorio, nombre)
+        for nombre in os.listdir(directorio)
+        if nombre.lower().endswith(('.xls', '.xlsx'))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de motores de lectura de Excel")
+    parser.add_argument('--cafci', help="directorio con planillas de CAFCI")
+    parser.add_argument('--fima', help="directorio con adjuntos de FIMA")
+    parser.add_argument('--engines', nargs='+', default=['default', 'calamine'])
+    parser.add_argument('--hijo', nargs=2, metavar=('TIPO', 'LISTA'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        tipo, lista = args.hijo
+        with open(lista) as f:
+            corre_motor(tipo, f.read().split('\n'))
+        return
+
+    corpus = [(tipo, directorio) for tipo, directorio in (('cafci', args.cafci), ('fima', args.fima)) if directorio]
+    if not corpus:
+        parser.error("hay que indicar --cafci y/o --fima")
+
+    print(f"{'corpus':8} {'motor':10} {'archivos':>8} {'filas':>9} {'errores':>7} {'segundos':>9} {'pico MB':>8}")
+    for tipo, directorio in corpus:
+        archivos = lista_archivos(directorio)
+        lista = os.path.join(directorio, '.benchmark_archivos')
+        with open(lista, 'w') as f:
+            f.write('\n'.join(archivos))
+        try:
+            for engine in args.engines:
+                env = dict(os.environ, EXCEL_ENGINE=engine)
+                salida = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--hijo', tipo, lista],
+                    env=env, capture_output=True, text=True,
+                )
+                if salida.returncode != 0:
+                    print(f"{tipo:8} {engine:10} falló: {salida.stderr.strip().splitlines()[-1:]}")
+                    continue
+                r = json.loads(salida.stdout.strip().splitlines()[-1])
+                print(f"{tipo:8} {engine:10} {len(archivos):>8} {r['filas']:>9} {r['errores']:>7} {r['segundos']:>9.2f} {r['rss_mb']:>8.1f}")
+        finally:
+            os.remove(lista)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compara fechas.parseaFecha contra la versión anterior (la hora separada y convertida fila por fila con
+to_timedelta) y contra pd.to_datetime con formato (%b), que es lo que se usaba con setlocale, sobre textos en
+inglés para que no dependa del locale. Los textos tienen la forma de la lista de la CNV: cinco archivos por día,
+la fecha del archivo sin hora y la de recepción con hora.
+
+Uso:
+    python benchmark_fechas.py --filas 50000
+"""
+
+import argparse
+import datetime
+import time
+import numpy as np
+import pandas as pd
+import fechas
+
+MESES = ['ene', 'feb', 'mar', 'abr', 'may', 'jun', 'jul', 'ago', 'sep', 'oct', 'nov', 'dic']
+MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+
+
+def textos(filas, meses, con_hora):
+    hoy = datetime.date.today()
+    resultado = []
+    for i in range(filas):
+        fecha = hoy - datetime.timedelta(days=i // 5)
+        texto = f"{fecha.day} {meses[fecha.month - 1]} {fecha.year}"
+        resultado.append(f"{texto} 18:{i % 60:02d}" if con_hora else texto)
+    return pd.Series(resultado)
+
+
+def parseaFechaAntes(serie, errors='raise'):
+    """
+    fechas.parseaFecha como estaba antes: la fecha factorizada y la hora aparte, con to_timedelta por fila
+    """
+    serie = pd.Series(serie, dtype=object).str.strip()
+    partes = serie.str.rpartition(' ').reindex(columns=[0, 1, 2]).astype(object)
+    con_hora = partes[2].str.contains(':', regex=False).fillna(False).astype(bool)
+    hora = pd.to_timedelta(partes[2].where(con_hora) + ':00', errors='coerce')
+    codigos, unicos = pd.factorize(partes[0].where(con_hora, serie))
+    dias = np.append(fechas._parseaDias(unicos), np.datetime64('NaT', 'ns'))[codigos]
+    fechasAntes = pd.Series(dias, index=serie.index, dtype='datetime64[ns]') + hora.fillna(pd.Timedelta(0))
+    invalidas = serie.notna() & (fechasAntes.isna() | (con_hora & hora.isna()))
+    if invalidas.any() and errors == 'raise':
+        raise ValueError(f"No se pudo interpretar la fecha '{serie[invalidas].iloc[0]}'")
+    return fechasAntes
+
+
+def mide(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        resultado = funcion()
+    return 1000 * (time.perf_counter() - inicio) / repeticiones, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del parseo de las fechas de la lista de la CNV")
+    parser.add_argument('--filas', type=int, default=50000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.filas} filas, ms por serie")
+    for con_hora, formato in ((False, '%d %b %Y'), (True, '%d %b %Y %H:%M')):
+        espaniol = textos(args.filas, MESES, con_hora)
+        ingles = textos(args.filas, MONTHS, con_hora)
+        strptime, esperado = mide(lambda: pd.to_datetime(ingles, format=formato), args.repeticiones)
+        antes, df_antes = mide(lambda: parseaFechaAntes(espaniol), args.repeticiones)
+        ahora, df = mide(lambda: fechas.parseaFecha(espaniol), args.repeticiones)
+        pd.testing.assert_series_equal(df, esperado.astype('datetime64[ns]'), check_names=False)
+        pd.testing.assert_series_equal(df, df_antes)
+        print(f"{'con hora' if con_hora else 'sin hora'} ({espaniol.nunique()} textos distintos):  "
+              f"to_datetime con formato {strptime:7.1f}   antes {antes:7.1f}   parseaFecha {ahora:7.1f}   "
+              f"({strptime / ahora:.1f}x / {antes / ahora:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
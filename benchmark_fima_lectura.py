@@ -0,0 +1,79 @@
+"""
+Compara la lectura de una planilla de FIMA como se hacía antes (cuatro pd.read_excel del archivo: la tabla y las
+celdas K2, H2 y H3) con la de ahora (un solo libro abierto con lectorExcel.abrir, de donde salen la tabla y el
+encabezado). Usa los adjuntos de un directorio o, si no se pasa, una planilla sintética con la forma de la de FIMA.
+
+Uso:
+    python benchmark_fima_lectura.py --fima /ruta/adjuntos_fima
+    python benchmark_fima_lectura.py --fondos 600
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import pandas as pd
+from datosSinteticos import libro_fima
+import lectorExcel
+from fimaETL import celda
+
+
+def lee_antes(ruta):
+    diaria = pd.read_excel(ruta, skiprows=4, usecols="A:K")
+    date_value1 = pd.read_excel(ruta, usecols="K", nrows=2, header=None).iloc[1, 0]
+    date_value2 = pd.read_excel(ruta, usecols="H", nrows=2, header=None).iloc[1, 0]
+    date_value3 = pd.read_excel(ruta, usecols="H", nrows=3, header=None).iloc[1, 0]
+    return diaria, next((val for val in [date_value1, date_value2, date_value3] if pd.notna(val)), None)
+
+
+def lee_ahora(ruta, engine):
+    with lectorExcel.abrir(ruta, engine=engine) as workbook:
+        diaria = workbook.parse(skiprows=4, usecols="A:K")
+        encabezado = workbook.parse(header=None, nrows=3)
+    valores = [celda(encabezado, 1, 10), celda(encabezado, 1, 7), celda(encabezado, 2, 7)]
+    return diaria, next((val for val in valores if pd.notna(val)), None)
+
+
+def mide(funcion, archivos, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for archivo in archivos:
+            funcion(archivo)
+    return 1000 * (time.perf_counter() - inicio) / (repeticiones * len(archivos))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la lectura de las planillas de FIMA")
+    parser.add_argument('--fima', help="directorio con adjuntos de FIMA (.xls/.xlsx)")
+    parser.add_argument('--fondos', type=int, default=600, help="filas de la planilla sintética")
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        if args.fima:
+            archivos = sorted(
+                os.path.join(args.fima, nombre) for nombre in os.listdir(args.fima)
+                if nombre.lower().endswith(('.xls', '.xlsx'))
+            )
+        else:
+            archivos = [os.path.join(directorio, 'fima.xlsx')]
+            with open(archivos[0], 'wb') as f:
+                f.write(libro_fima(args.fondos))
+
+        # mismo resultado de las dos formas
+        for archivo in archivos:
+            diaria_antes, fecha_antes = lee_antes(archivo)
+            diaria, fecha = lee_ahora(archivo, 'default')
+            pd.testing.assert_frame_equal(diaria, diaria_antes)
+            assert fecha == fecha_antes or (pd.isna(fecha) and pd.isna(fecha_antes)), archivo
+
+        print(f"{len(archivos)} archivos, ms por archivo")
+        antes = mide(lee_antes, archivos, args.repeticiones)
+        print(f"cuatro read_excel:            {antes:8.1f}")
+        for engine in ['default'] + [m for m in lectorExcel.motores('auto') if m is not None]:
+            ahora = mide(lambda archivo: lee_ahora(archivo, engine), archivos, args.repeticiones)
+            print(f"un libro ({engine:9}):        {ahora:8.1f}   ({antes / ahora:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Mide las filas por segundo de DatabaseConnection.insert_data_many sobre filas sintéticas de fondos, con un DataFrame
+y con un iterable de tuplas, para varios tamaños de lote, y las compara con DataFrame.to_sql(if_exists='append'),
+que es lo que usaban los ETL mientras insert_data_many no funcionaba.
+
+Uso:
+    python benchmark_insert.py --sqlite /tmp/bench.db --filas 200000
+    python benchmark_insert.py --postgres bench_fondos     (una base vacía, no la de producción)
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from DataBaseConn import DatabaseConnection
+
+TABLA = 'bench_insert'
+COLUMNAS = ['codigoCAFCI', 'fecha', 'fondo', 'vcp', 'patrimonio']
+
+
+def filas_sinteticas(filas, seed=0):
+    rng = np.random.default_rng(seed)
+    fondos = 3000
+    fechas = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=-(-filas // fondos))
+    df = pd.DataFrame({
+        'codigoCAFCI': np.tile(np.arange(1, fondos + 1), len(fechas))[:filas],
+        'fecha': np.repeat(fechas.strftime('%Y-%m-%d'), fondos)[:filas],
+    })
+    df['fondo'] = 'Fondo ' + df['codigoCAFCI'].astype(str)
+    df['vcp'] = rng.random(filas) * 1000
+    df['patrimonio'] = rng.random(filas) * 1e9
+    return df
+
+
+def corre(db, filas, lotes):
+    df = filas_sinteticas(filas)
+    with db.begin() as conn:
+        if sqlalchemy.inspect(conn).has_table(TABLA, schema='public' if db.db_type == 'postgresql' else None):
+            raise SystemExit(f"La base ya tiene {TABLA}: el benchmark necesita una base vacía")
+        conn.execute(sqlalchemy.text(
+            f'CREATE TABLE "{TABLA}" ("codigoCAFCI" BIGINT, fecha TEXT, fondo TEXT, vcp DOUBLE PRECISION, patrimonio DOUBLE PRECISION)'
+        ))
+
+    def informa(titulo, funcion):
+        # cada medición arranca con la tabla vacía
+        with db.begin() as conn:
+            conn.execute(sqlalchemy.text(f'DELETE FROM "{TABLA}"'))
+        inicio = time.perf_counter()
+        funcion()
+        segundos = time.perf_counter() - inicio
+        with db.connection() as conn:
+            grabadas = conn.execute(sqlalchemy.text(f'SELECT count(*) FROM "{TABLA}"')).scalar()
+        assert grabadas == filas, f"{titulo}: se grabaron {grabadas} de {filas} filas"
+        print(f"{titulo:38} {segundos:7.2f}s   {filas / segundos:10.0f} filas/s")
+
+    schema = 'public' if db.db_type == 'postgresql' else None
+    informa('to_sql', lambda: _to_sql(db, df, schema))
+    tuplas = list(df.itertuples(index=False, name=None))
+    db.connect()
+    try:
+        for lote in lotes:
+            informa(f'insert_data_many df, lote {lote}', lambda: db.insert_data_many(TABLA, df, batch_size=lote, schema=schema))
+            informa(f'insert_data_many tuplas, lote {lote}',
+                    lambda: db.insert_data_many(TABLA, iter(tuplas), columns=COLUMNAS, batch_size=lote, schema=schema))
+    finally:
+        db.disconnect()
+
+    with db.begin() as conn:
+        conn.execute(sqlalchemy.text(f'DROP TABLE "{TABLA}"'))
+
+
+def _to_sql(db, df, schema):
+    with db.begin() as conn:
+        df.to_sql(TABLA, conn, if_exists='append', index=False, schema=schema)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de insert_data_many")
+    destino = parser.add_mutually_exclusive_group(required=True)
+    destino.add_argument('--sqlite', help="archivo SQLite (se crea)")
+    destino.add_argument('--postgres', help="nombre de una base PostgreSQL vacía")
+    parser.add_argument('--filas', type=int, default=200000)
+    parser.add_argument('--lotes', type=int, nargs='+', default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    db_type, db_name = ('sqlite', args.sqlite) if args.sqlite else ('postgresql', args.postgres)
+    with DatabaseConnection(db_type=db_type, db_name=db_name) as db:
+        corre(db, args.filas, args.lotes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Compara el parseo de las planillas diarias de CAFCI con el esquema tipado (scrape.read_excel_file) contra el de
+antes (read_excel con inferencia, object en casi todas las columnas y solo fecha y vcp convertidas): tiempo por
+archivo y memoria del DataFrame resultante. Usa las planillas de un directorio o una planilla sintética de 46
+columnas con la forma de la de CAFCI.
+
+Uso:
+    python benchmark_parseo_cafci.py --cafci /ruta/planillas_cafci
+    python benchmark_parseo_cafci.py --fondos 3000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import pandas as pd
+from datosSinteticos import libro_cafci
+import esquema
+from scrape import read_excel_file
+
+
+def lee_antes(ruta):
+    """
+    read_excel_file como estaba antes del esquema (solo el formato de 46 columnas)
+    """
+    df = pd.read_excel(ruta, skiprows=9)
+    if df.shape[1] != 46:
+        return None
+    df.columns = [c.nombre for c in esquema.CAFCI_COLUMNAS]
+    df = df.dropna(subset=["clasMoneda"])
+    # por nombre y no con iloc, que en pandas 3 no deja poner fechas en una columna de texto
+    df['fecha'] = pd.to_datetime(df['fecha'], format='%d/%m/%y').dt.date
+    df['vcp'] = pd.to_numeric(df['vcp'], errors='coerce')
+    return df
+
+
+def mide(funcion, archivos, repeticiones):
+    inicio = time.perf_counter()
+    memoria = filas = 0
+    for _ in range(repeticiones):
+        for archivo in archivos:
+            df = funcion(archivo)
+            if df is not None:
+                memoria += df.memory_usage(deep=True).sum()
+                filas += len(df)
+    veces = repeticiones * len(archivos)
+    return 1000 * (time.perf_counter() - inicio) / veces, memoria / veces / 2 ** 20, filas // repeticiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del parseo de las planillas de CAFCI")
+    parser.add_argument('--cafci', help="directorio con planillas de CAFCI (.xls/.xlsx)")
+    parser.add_argument('--fondos', type=int, default=3000, help="filas de la planilla sintética")
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        if args.cafci:
+            archivos = sorted(
+                os.path.join(args.cafci, nombre) for nombre in os.listdir(args.cafci)
+                if nombre.lower().endswith(('.xls', '.xlsx'))
+            )
+        else:
+            archivos = [os.path.join(directorio, 'cafci.xlsx')]
+            with open(archivos[0], 'wb') as f:
+                f.write(libro_cafci(args.fondos))
+
+        print(f"{len(archivos)} archivos; por archivo:")
+        for titulo, funcion in [('antes (inferencia)', lee_antes), ('esquema tipado', read_excel_file)]:
+            ms, mb, filas = mide(funcion, archivos, args.repeticiones)
+            print(f"{titulo:20} {ms:8.1f} ms   {mb:7.2f} MB en memoria   ({filas} filas)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Mide las lecturas de DatabaseConnection.fund_series y cross_section sobre una tablaTempFCI sintética de varios años,
+con los índices de esquema.TABLAS y sin ellos.
+
+Uso:
+    python benchmark_series.py --sqlite /tmp/bench.db --anios 3 --fondos 1000
+    python benchmark_series.py --postgres bench_fondos     (una base vacía, no la de producción)
+"""
+
+import argparse
+import random
+import time
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from DataBaseConn import DatabaseConnection
+import esquema
+
+TABLA = 'tablaTempFCI'
+
+
+def datos_sinteticos(fondos, fechas, seed=0):
+    """
+    Una fila por fondo y día hábil, con todas las columnas de tablaTempFCI
+    """
+    rng = np.random.default_rng(seed)
+    n = fondos * len(fechas)
+    df = pd.DataFrame({
+        'codigoCAFCI': np.tile(np.arange(1, fondos + 1), len(fechas)),
+        'fecha': np.repeat(fechas.date, fondos),
+    })
+    for columna in esquema.TABLAS[TABLA].columnas:
+        if columna.nombre in df.columns:
+            continue
+        if columna.tipo == 'numero':
+            df[columna.nombre] = rng.random(n) * 1000
+        elif columna.tipo == 'entero':
+            df[columna.nombre] = rng.integers(0, 100, n)
+        else:
+            df[columna.nombre] = 'x'
+    df['fondo'] = 'Fondo ' + df['codigoCAFCI'].astype(str)
+    df['ID'] = df['fecha'].astype(str)
+    return df
+
+
+def mide(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return 1000 * (time.perf_counter() - inicio) / repeticiones
+
+
+def corre(db, fondos, anios, repeticiones):
+    fechas = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=anios * 261)
+    with db.begin() as conn:
+        if sqlalchemy.inspect(conn).has_table(TABLA, schema='public' if db.db_type == 'postgresql' else None):
+            raise SystemExit(f"La base ya tiene {TABLA}: el benchmark necesita una base vacía")
+
+    df = datos_sinteticos(fondos, fechas)
+    inicio = time.perf_counter()
+    # de a un mes por transacción, como llegarían los archivos
+    for _, mes in df.groupby(pd.to_datetime(df['fecha']).dt.to_period('M')):
+        db.bulk_load(mes, TABLA, schema='public')
+    print(f"{len(df)} filas cargadas en {time.perf_counter() - inicio:.1f}s")
+
+    codigos = random.Random(1).sample(range(1, fondos + 1), repeticiones)
+    dias = random.Random(2).sample(list(fechas), repeticiones)
+
+    def ronda(titulo):
+        it_codigos, it_dias = iter(codigos), iter(dias)
+        serie = mide(lambda: db.fund_series(next(it_codigos), columnas=['vcp']), repeticiones)
+        corte = mide(lambda: db.cross_section(next(it_dias), columnas=['vcp', 'patrimonio']), repeticiones)
+        print(f"{titulo:12} serie de un fondo: {serie:8.2f} ms   corte de un día: {corte:8.2f} ms")
+
+    ronda('con índices')
+    with db.begin() as conn:
+        for columnas in esquema.TABLAS[TABLA].indices:
+            nombre = f"{TABLA}_{'_'.join(columnas)}_idx"
+            conn.execute(sqlalchemy.text(f'DROP INDEX IF EXISTS "{nombre}"'))
+    ronda('sin índices')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de lecturas de series de fondos")
+    destino = parser.add_mutually_exclusive_group(required=True)
+    destino.add_argument('--sqlite', help="archivo SQLite (se crea)")
+    destino.add_argument('--postgres', help="nombre de una base PostgreSQL vacía")
+    parser.add_argument('--anios', type=int, default=3)
+    parser.add_argument('--fondos', type=int, default=1000)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+
+    db_type, db_name = ('sqlite', args.sqlite) if args.sqlite else ('postgresql', args.postgres)
+    with DatabaseConnection(db_type=db_type, db_name=db_name) as db:
+        corre(db, args.fondos, args.anios, args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Compara la extracción de la tabla de la CNV con lxml (tablaCNV.extraeTabla) contra la versión anterior con
+BeautifulSoup, sobre una página guardada o sobre una página sintética con la lista completa expandida.
+También mide la columna fechaCorrespondeParseada con .str contra el apply por fila de antes (.str no es más rápido:
+se usa porque una descripción sin " al" queda vacía en lugar de cortar el parseo).
+El pico de memoria de cada extracción se mide con tracemalloc, que ve solo lo que se reserva desde Python: el árbol
+de libxml2 que arma lxml no entra en la cuenta, los objetos de BeautifulSoup sí.
+
+Uso:
+    python benchmark_tablaCNV.py --filas 20000
+    python benchmark_tablaCNV.py --html /ruta/CuotaPartes.html     (driver.page_source guardado)
+"""
+
+import argparse
+import datetime
+import time
+import tracemalloc
+import pandas as pd
+from tablaCNV import extraeTabla, parseaFechas
+
+MESES = ['ene', 'feb', 'mar', 'abr', 'may', 'jun', 'jul', 'ago', 'sep', 'oct', 'nov', 'dic']
+
+
+def pagina_sintetica(filas):
+    """
+    Página con la forma de la de la CNV: una fila por archivo, de más nuevo a más viejo
+    """
+    hoy = datetime.date.today()
+    html = ['<html><body><table><thead><tr><th>Fecha</th><th>Recepción</th><th>Descripción</th><th>ID</th></tr></thead><tbody>']
+    for i in range(filas):
+        fecha = hoy - datetime.timedelta(days=i // 5)
+        texto = f"{fecha.day} {MESES[fecha.month - 1]} {fecha.year}"
+        html.append(
+            f'<tr><td><a href="/SitioWeb/FondosComunesInversion/Descarga/{900000 - i}">{texto}</a></td>'
+            f'<td>{texto} 18:{i % 60:02d}</td><td>Planilla diaria de cuotapartes al {texto}</td><td>{900000 - i}</td></tr>'
+        )
+    html.append('</tbody></table><span class="btn btn-leer-mas">VER MÁS</span></body></html>')
+    return ''.join(html)
+
+
+def extraeTablaBeautifulSoup(page_source):
+    """
+    extraeTabla como estaba antes de pasarla a lxml
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page_source, 'lxml')
+    table = soup.find('table')
+    if table is None:
+        return None
+
+    rows = table.find_all('tr')[1:]
+    fechas_documento, fechas_recepcion, descripciones, ids, hrefs = [], [], [], [], []
+    for row in rows:
+        cells = row.find_all('td')
+        if len(cells) == 4:
+            a_tag = cells[0].find('a')
+            if a_tag:
+                fechas_documento.append(a_tag.text.strip())
+                hrefs.append(a_tag['href'].strip())
+            else:
+                fechas_documento.append(cells[0].text.strip())
+                hrefs.append(None)
+            fechas_recepcion.append(cells[1].text.strip())
+            descripciones.append(cells[2].text.strip())
+            ids.append(cells[3].text.strip())
+
+    return pd.DataFrame({
+        'fechaCorresponde': fechas_documento, 'fechaRecepcion': fechas_recepcion, 'descripcion': descripciones,
+        'ID': ids, 'href': hrefs, 'descargado': False
+    })
+
+
+def mide(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        resultado = funcion()
+    return 1000 * (time.perf_counter() - inicio) / repeticiones, resultado
+
+
+def pico(funcion):
+    """
+    Pico de memoria de una llamada a funcion, en MB, según tracemalloc
+    """
+    tracemalloc.start()
+    try:
+        funcion()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la extracción de la tabla de la CNV")
+    parser.add_argument('--html', help="página guardada; si no se pasa se arma una sintética")
+    parser.add_argument('--filas', type=int, default=20000, help="filas de la página sintética")
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.html:
+        with open(args.html, encoding='utf-8') as f:
+            pagina = f.read()
+    else:
+        pagina = pagina_sintetica(args.filas)
+
+    antes, df_antes = mide(lambda: extraeTablaBeautifulSoup(pagina), args.repeticiones)
+    ahora, df = mide(lambda: extraeTabla(pagina), args.repeticiones)
+    pd.testing.assert_frame_equal(df, df_antes)
+    print(f"{len(df)} filas")
+    print(f"extraeTabla      BeautifulSoup: {antes:9.1f} ms   lxml: {ahora:9.1f} ms   ({antes / ahora:.1f}x)")
+    antes, ahora = pico(lambda: extraeTablaBeautifulSoup(pagina)), pico(lambda: extraeTabla(pagina))
+    print(f"pico de memoria  BeautifulSoup: {antes:9.1f} MB   lxml: {ahora:9.1f} MB   ({antes / ahora:.1f}x)")
+
+    antes, _ = mide(lambda: df['descripcion'].apply(lambda x: x.split(" al")[1].strip()), args.repeticiones)
+    ahora, _ = mide(lambda: df['descripcion'].str.split(" al").str[1].str.strip(), args.repeticiones)
+    print(f"descripción      apply:         {antes:9.1f} ms   .str: {ahora:9.1f} ms   ({antes / ahora:.1f}x)")
+
+    total, _ = mide(lambda: parseaFechas(extraeTabla(pagina)), args.repeticiones)
+    print(f"extraeTabla + parseaFechas:     {total:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Cache en disco de las planillas ya parseadas. Cada entrada es el df tipado que devuelve el parser, guardado
+con la clave sha256(contenido del archivo) + nombre y versión del parser, así un reintento (o volver a cargar
+el mismo archivo) va directo a la carga sin volver a pasar por read_excel.
+
+Con pyarrow instalado se guarda en formato Arrow IPC sin comprimir y se lee con memory map; si no, con pickle.
+Cuando la carpeta pasa de PARSE_CACHE_MAX_MB se borran las entradas usadas hace más tiempo.
+"""
+
+import hashlib
+import os
+import pandas as pd
+
+PARSE_CACHE_DIR = os.environ.get('PARSE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'fondos_parseados'))
+# con 0 no se usa la cache
+PARSE_CACHE_MAX_MB = float(os.environ.get('PARSE_CACHE_MAX_MB', '512'))
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    EXTENSION = '.arrow'
+except ImportError:
+    pyarrow = None
+    EXTENSION = '.pkl'
+
+
+def hash_contenido(origen):
+    """
+    sha256 del archivo (ruta) o de los bytes recibidos
+    """
+    if isinstance(origen, (bytes, bytearray)):
+        return hashlib.sha256(origen).hexdigest()
+    digest = hashlib.sha256()
+    with open(origen, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+
+def ruta_entrada(parser, version, digest, extension=EXTENSION):
+    return os.path.join(PARSE_CACHE_DIR, f"{parser}-v{version}-{digest}{extension}")
+
+
+def leer(ruta):
+    if ruta.endswith('.arrow'):
+        return pyarrow.feather.read_table(ruta, memory_map=True).to_pandas()
+    return pd.read_pickle(ruta)
+
+
+def guardar(df, ruta):
+    """
+    Graba el df en la cache (a un temporal que después se renombra). Si Arrow no puede representar
+    alguna columna (por ejemplo texto mezclado con números) se graba con pickle
+    """
+    os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+    if ruta.endswith('.arrow'):
+        try:
+            tmp = ruta + '.tmp'
+            pyarrow.feather.write_feather(df, tmp, compression='uncompressed')
+            os.replace(tmp, ruta)
+            return ruta
+        except (pyarrow.ArrowException, TypeError, ValueError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            ruta = ruta[:-len('.arrow')] + '.pkl'
+    tmp = ruta + '.tmp'
+    df.to_pickle(tmp)
+    os.replace(tmp, ruta)
+    return ruta
+
+
+def buscar(parser, version, digest):
+    """
+    Devuelve el df cacheado para ese contenido y parser, o None si no está (o no se pudo leer)
+    """
+    for extension in ('.arrow', '.pkl') if pyarrow is not None else ('.pkl',):
+        ruta = ruta_entrada(parser, version, digest, extension)
+        if os.path.exists(ruta):
+            try:
+                df = leer(ruta)
+            except Exception as e:
+                print(f"No se pudo leer {ruta} de la cache ({e}). Se vuelve a parsear.")
+                os.remove(ruta)
+                continue
+            # actualizamos la fecha de modificación: es la que usa el desalojo para saber qué se usó último
+            os.utime(ruta)
+            return df
+    return None
+
+
+def desalojar(max_mb=None):
+    """
+    Borra las entradas menos usadas hasta que la carpeta quede por debajo del máximo
+    """
+    max_bytes = (PARSE_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024
+    entradas = []
+    for nombre in os.listdir(PARSE_CACHE_DIR):
+        if nombre.endswith(('.arrow', '.pkl')):
+            st = os.stat(os.path.join(PARSE_CACHE_DIR, nombre))
+            entradas.append((st.st_mtime, st.st_size, nombre))
+    total = sum(size for _, size, _ in entradas)
+    for _, size, nombre in sorted(entradas):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(PARSE_CACHE_DIR, nombre))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def cacheado(origen, parser, version, parsea):
+    """
+    Devuelve el df parseado de origen (ruta o bytes). Si ya estaba en la cache lo lee de ahí; si no, llama a
+    parsea() y guarda el resultado. Los None (archivos que el parser no reconoce) no se guardan
+    """
+    if PARSE_CACHE_MAX_MB <= 0:
+        return parsea()
+
+    digest = hash_contenido(origen)
+    df = buscar(parser, version, digest)
+    if df is not None:
+        return df
+
+    df = parsea()
+    if df is not None:
+        try:
+            guardar(df, ruta_entrada(parser, version, digest))
+            desalojar()
+        except OSError as e:
+            # la cache es solo una ayuda: si no se puede escribir seguimos igual
+            print(f"No se pudo guardar en la cache de parseo: {e}")
+    return df
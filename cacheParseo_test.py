@@ -0,0 +1,104 @@
+"""
+Pruebas de cacheParseo con la cache en un directorio temporal: la entrada se usa mientras el archivo no cambia,
+deja de usarse si cambia el contenido o la versión del parser, y al pasar de PARSE_CACHE_MAX_MB se borran las
+entradas usadas hace más tiempo.
+
+    python -m pytest cacheParseo_test.py
+"""
+
+import os
+import pandas as pd
+import pytest
+import cacheParseo
+import scrape
+from datosSinteticos import dia, libro_cafci
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    directorio = tmp_path / 'cache'
+    monkeypatch.setattr(cacheParseo, 'PARSE_CACHE_DIR', str(directorio))
+    monkeypatch.setattr(cacheParseo, 'PARSE_CACHE_MAX_MB', 512)
+    return directorio
+
+
+@pytest.fixture
+def parseos(monkeypatch):
+    # los archivos que llegan a read_excel_file, o sea los que no salieron de la cache
+    leidos = []
+    original = scrape.read_excel_file
+
+    def read_excel_file(downloadedFiles):
+        leidos.append(os.path.basename(downloadedFiles))
+        return original(downloadedFiles)
+    monkeypatch.setattr(scrape, 'read_excel_file', read_excel_file)
+    monkeypatch.setattr(scrape.validacion, 'VALIDACION', False)
+    return leidos
+
+
+def test_mismo_archivo_sale_de_la_cache(cache, parseos, tmp_path):
+    archivo = tmp_path / '10_Planilla.xlsx'
+    archivo.write_bytes(libro_cafci(5, dia(3)))
+    primero = scrape.read_excel_cached(str(archivo))
+    # otro nombre con el mismo contenido también sale de la cache
+    copia = tmp_path / '11_Planilla.xlsx'
+    copia.write_bytes(archivo.read_bytes())
+    for ruta in (archivo, copia):
+        pd.testing.assert_frame_equal(scrape.read_excel_cached(str(ruta)), primero)
+    assert parseos == ['10_Planilla.xlsx']
+    assert len(os.listdir(cache)) == 1
+
+
+def test_cambia_el_contenido_o_la_version(cache, parseos, tmp_path, monkeypatch):
+    archivo = tmp_path / '10_Planilla.xlsx'
+    archivo.write_bytes(libro_cafci(5, dia(3)))
+    scrape.read_excel_cached(str(archivo))
+    # el mismo archivo con otro contenido se vuelve a parsear
+    archivo.write_bytes(libro_cafci(7, dia(3)))
+    assert len(scrape.read_excel_cached(str(archivo))) == 7
+    # y con otra versión del parser también, aunque el contenido no cambie
+    monkeypatch.setattr(scrape, 'PARSER_VERSION', scrape.PARSER_VERSION + 1)
+    assert len(scrape.read_excel_cached(str(archivo))) == 7
+    assert parseos == ['10_Planilla.xlsx'] * 3
+    assert len(os.listdir(cache)) == 3
+
+
+def test_sin_cache_o_sin_formato_conocido(cache):
+    llamadas = []
+
+    def parsea():
+        llamadas.append(1)
+        return None
+    # lo que el parser no reconoce no se guarda
+    assert cacheParseo.cacheado(b'otro', 'prueba', 1, parsea) is None
+    assert cacheParseo.cacheado(b'otro', 'prueba', 1, parsea) is None
+    assert len(llamadas) == 2 and not os.path.exists(cache)
+
+
+def test_desaloja_las_usadas_hace_mas_tiempo(cache, monkeypatch):
+    # entradas de unos 100 KB: con un máximo de 0.25 MB entran dos
+    monkeypatch.setattr(cacheParseo, 'PARSE_CACHE_MAX_MB', 0.25)
+    df = pd.DataFrame({'valor': range(12500)}, dtype='int64')
+
+    def entrada(contenido):
+        return cacheParseo.cacheado(contenido, 'prueba', 1, lambda: df)
+
+    def en_cache():
+        # los contenidos que siguen en la cache, por su hash
+        hashes = {cacheParseo.hash_contenido(c): c for c in (b'a', b'b', b'c', b'd')}
+        return sorted(hashes[nombre.split('-')[2].split('.')[0]] for nombre in os.listdir(cache))
+
+    for i, contenido in enumerate((b'a', b'b')):
+        entrada(contenido)
+        # las fechas de modificación a mano, así no depende de la resolución del reloj del sistema de archivos
+        ruta = cacheParseo.ruta_entrada('prueba', 1, cacheParseo.hash_contenido(contenido))
+        os.utime(ruta, (1000 + i, 1000 + i))
+    # usar la a la deja como la más reciente: al agregar la c se borra la b
+    entrada(b'a')
+    entrada(b'c')
+    assert en_cache() == [b'a', b'c']
+
+    # con PARSE_CACHE_MAX_MB en 0 no se usa la cache
+    monkeypatch.setattr(cacheParseo, 'PARSE_CACHE_MAX_MB', 0)
+    entrada(b'd')
+    assert en_cache() == [b'a', b'c']
@@ -0,0 +1,132 @@
+"""
+Fixtures compartidas por las pruebas:
+    db      una base SQLite vacía en un directorio temporal
+    cnv     un servidor HTTP local (ServidorCNV) con la forma del sitio de la CNV: la lista de archivos por tandas
+            ("VER MÁS"), la página de cada archivo con el link a.downloadFile y los archivos
+Los datos de prueba (planillas, libros de Excel) están en datosSinteticos.py.
+"""
+
+import datetime
+import http.server
+import threading
+import urllib.parse
+import pytest
+from DataBaseConn import DatabaseConnection
+
+MESES = ['ene', 'feb', 'mar', 'abr', 'may', 'jun', 'jul', 'ago', 'sep', 'oct', 'nov', 'dic']
+
+
+@pytest.fixture
+def db(tmp_path):
+    with DatabaseConnection(db_type='sqlite', db_name=str(tmp_path / 'prueba.db')) as db:
+        yield db
+
+
+def texto_fecha(fecha, hora=None):
+    texto = f"{fecha.day} {MESES[fecha.month - 1]} {fecha.year}"
+    return f"{texto} {hora}" if hora else texto
+
+
+class ManejadorCNV(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 para que la sesión de requests pueda reusar la conexión
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        servidor = self.server
+        servidor.conexiones.add(self.client_address)
+        servidor.pedidos.append(self.path)
+        pedido = urllib.parse.urlparse(self.path)
+        if pedido.path == '/cuotapartes':
+            self.lista(int(urllib.parse.parse_qs(pedido.query).get('tanda', ['0'])[0]))
+        elif pedido.path.startswith('/cuotapartes/'):
+            ID = pedido.path.rsplit('/', 1)[1]
+            href = 'javascript:descarga()' if ID == 'js' else f'../descarga/{ID}'
+            self.responde(f'<html><body><a class="downloadFile" href="{href}">Descargar</a></body></html>'.encode(),
+                          'text/html; charset=utf-8')
+        elif pedido.path.startswith('/descarga/'):
+            ID = pedido.path.rsplit('/', 1)[1]
+            if ID == 'login':
+                # la CNV a veces devuelve una página en lugar del archivo
+                self.responde(b'<html>ingrese</html>', 'text/html')
+            else:
+                self.responde(servidor.archivos.get(ID, b''), 'application/vnd.ms-excel',
+                              {'Content-Disposition': f'attachment; filename="Planilla {ID}.xlsx"'})
+        else:
+            self.responde(b'', 'text/plain', estado=404)
+
+    def lista(self, numero):
+        # la tanda 0 es la página entera; las siguientes, las filas que agrega cada "VER MÁS"
+        servidor = self.server
+        servidor.tandas.append(numero)
+        filas = ''.join(servidor.fila(ID) for ID in servidor.ids_de_tanda(numero))
+        if numero == 0:
+            cuerpo = (
+                '<html><body><table><thead><tr><th>Fecha</th><th>Recepción</th><th>Descripción</th><th>ID</th></tr>'
+                f'</thead><tbody>{filas}</tbody></table><span class="btn btn-leer-mas">VER MÁS</span></body></html>'
+            )
+        else:
+            cuerpo = f'<table><tbody>{filas}</tbody></table>'
+        self.responde(cuerpo.encode(), 'text/html; charset=utf-8',
+                      {'X-Ultima': '1' if numero == servidor.cantidad_tandas - 1 else '0'})
+
+    def responde(self, cuerpo, tipo, encabezados=None, estado=200):
+        self.send_response(estado)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        for nombre, valor in (encabezados or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+class ServidorCNV(http.server.ThreadingHTTPServer):
+    """
+    /cuotapartes es la lista de archivos: un archivo por día, de más nuevo a más viejo (el ID 1000 es del 1/6/24,
+    el 999 del 31/5/24...), de a por_tanda filas. /cuotapartes/ID es la página de un archivo y /descarga/ID el
+    archivo, tomado de archivos {ID: bytes}
+    """
+    daemon_threads = True
+
+    def __init__(self, archivos=None, por_tanda=10, cantidad_tandas=6):
+        super().__init__(('127.0.0.1', 0), ManejadorCNV)
+        self.archivos = dict(archivos or {})
+        self.por_tanda = por_tanda
+        self.cantidad_tandas = cantidad_tandas
+        self.conexiones = set()
+        self.pedidos = []
+        self.tandas = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def lista_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/cuotapartes'
+
+    def url(self, ID):
+        return f'{self.lista_url}/{ID}'
+
+    def ids_de_tanda(self, numero):
+        return range(1000 - numero * self.por_tanda, 1000 - (numero + 1) * self.por_tanda, -1)
+
+    @staticmethod
+    def fecha(ID):
+        return datetime.date(2024, 6, 1) - datetime.timedelta(days=1000 - ID)
+
+    def fila(self, ID):
+        fecha = self.fecha(ID)
+        return (
+            f'<tr><td><a href="/descarga/{ID}">{texto_fecha(fecha)}</a></td><td>{texto_fecha(fecha, "14:35")}</td>'
+            f'<td>Planilla diaria al {texto_fecha(fecha)}</td><td>{ID}</td></tr>'
+        )
+
+    def __exit__(self, *args):
+        self.shutdown()
+        super().__exit__(*args)
+
+
+@pytest.fixture
+def cnv():
+    with ServidorCNV() as servidor:
+        yield servidor
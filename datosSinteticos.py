@@ -0,0 +1,103 @@
+"""
+Datos sintéticos con la forma de los reales, para las pruebas y los benchmarks: planillas de CAFCI ya parseadas
+(como las devuelve scrape.read_excel_file), libros de Excel de CAFCI y de FIMA y series de vcp y patrimonio.
+"""
+
+import datetime
+import io
+import numpy as np
+import pandas as pd
+import esquema
+
+
+def dia(n):
+    return datetime.date(2024, 6, n)
+
+
+def planilla(fecha, fondos):
+    """
+    Planilla tipada de un día, como la devuelve scrape.read_excel_file, con la columna ID.
+    fondos es {codigoCAFCI: sociedadGerente}
+    """
+    n = len(fondos)
+    df = pd.DataFrame({c.nombre: [None] * n for c in esquema.CAFCI_COLUMNAS})
+    df['fondo'] = [f"Fondo {codigo}" for codigo in fondos]
+    df['clasMoneda'] = 'Peso Argentina'
+    df['codigoCAFCI'] = pd.array(list(fondos), dtype='Int64')
+    df['sociedadGerente'] = list(fondos.values())
+    df['fecha'] = fecha
+    df['vcp'] = 100.0
+    df['ID'] = f"ID{fecha:%Y%m%d}"
+    return df
+
+
+def libro_cafci(fondos, fecha=None):
+    """
+    Bytes de un xlsx con la forma de la planilla diaria de CAFCI: nueve filas de encabezado, la fila de títulos y
+    una fila por fondo, con un título intermedio (clasMoneda vacío) cada 50 fondos
+    """
+    from openpyxl import Workbook
+
+    libro = Workbook()
+    hoja = libro.active
+    for _ in range(9):
+        hoja.append(['Cámara Argentina de Fondos Comunes de Inversión'])
+    hoja.append([c.nombre for c in esquema.CAFCI_COLUMNAS])
+    fecha = (fecha or datetime.date.today()).strftime('%d/%m/%y')
+    for i in range(fondos):
+        if i % 50 == 0:
+            hoja.append([f'Renta Fija {i // 50}'])
+        fila = []
+        for c in esquema.CAFCI_COLUMNAS:
+            if c.nombre == 'fecha':
+                fila.append(fecha)
+            elif c.tipo == 'numero':
+                fila.append(1000 + i * 0.37)
+            elif c.tipo == 'entero':
+                fila.append(i)
+            elif c.tipo == 'categoria':
+                fila.append(f'{c.nombre} {i % 7}')
+            else:
+                fila.append(f'{c.nombre} {i}')
+        hoja.append(fila)
+    buffer = io.BytesIO()
+    libro.save(buffer)
+    return buffer.getvalue()
+
+
+def libro_fima(fondos):
+    """
+    Bytes de un xlsx con la forma de la planilla de FIMA: la fecha en K2, los títulos en la fila 5 y una fila
+    por fondo
+    """
+    from openpyxl import Workbook
+
+    libro = Workbook()
+    hoja = libro.active
+    hoja['A1'] = 'Fondos Comunes de Inversión'
+    hoja['K2'] = datetime.datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+    hoja.append([])
+    hoja.append([])
+    hoja.append(['Tipo Fondo', 'Fondo', 'Bloomberg', 'Valor Cuota', 'Var. Diaria', 'Var. Mes', 'TNA', 'Patrimonio',
+                 'VCP Próx. Hábil', 'TNA Próx. Hábil', 'Calificación'])
+    for i in range(fondos):
+        hoja.append(['Renta Fija', f'Fondo {i}', f'FON{i} AR', 1000 + i, 0.01, 0.3, 0.35, 1e9 + i, '-', 0.34, 'AA'])
+    buffer = io.BytesIO()
+    libro.save(buffer)
+    return buffer.getvalue()
+
+
+def series_fondos(fondos, fechas, faltantes=0.02, seed=0):
+    """
+    Filas (codigoCAFCI, fecha, vcp, patrimonio) como las de tablaTempFCI, de los fondos 1 a `fondos` en las fechas
+    dadas, ordenadas por fecha. El vcp es un paseo aleatorio y falta la fracción `faltantes` de los pares fondo-día
+    """
+    rng = np.random.default_rng(seed)
+    n = fondos * len(fechas)
+    df = pd.DataFrame({
+        'codigoCAFCI': np.tile(np.arange(1, fondos + 1), len(fechas)),
+        'fecha': np.repeat(pd.DatetimeIndex(fechas).values, fondos),
+        'vcp': 100 * np.exp(rng.normal(0.0003, 0.01, (len(fechas), fondos)).cumsum(axis=0)).ravel(),
+        'patrimonio': rng.random(n) * 1e9,
+    })
+    return df[rng.random(n) >= faltantes].reset_index(drop=True)
@@ -0,0 +1,205 @@
+"""
+Carga de la planilla de CAFCI en modelo dimensional: una tabla de hechos angosta (diariaCAFCI: ID del archivo,
+codigoCAFCI, fecha y los valores del día) y la dimensión de fondos (fondosCAFCI) con versionado tipo SCD 2.
+
+Cada fila de la dimensión es una versión de los atributos de un fondo, vigente desde vigenteDesde hasta
+vigenteHasta (NULL para la versión actual). Para saber si algo cambió se compara un hash de los atributos
+(hashAtributos) con el de la versión actual; solo cuando difiere se cierra la versión y se agrega una nueva.
+Los archivos pueden llegar en cualquier orden (el pipeline y la recarga los graban a medida que terminan de parsearse).
+Si un fondo del lote ya tiene hechos grabados en su fecha o después, no se puede cerrar la versión vigente sin más:
+se vuelve a armar la historia de ese fondo con sus versiones, lo grabado desde la fecha del lote y las filas nuevas.
+"""
+
+import pandas as pd
+import sqlalchemy
+from DataBaseConn import bulk_load
+import esquema
+
+TABLA_HECHOS = 'diariaCAFCI'
+TABLA_FONDOS = 'fondosCAFCI'
+CLAVE = esquema.CAFCI_CLAVE_FONDO
+
+
+def hash_atributos(df, columnas=esquema.CAFCI_ATRIBUTOS):
+    """
+    Hash (16 caracteres hex) de los atributos de cada fila. Se calcula sobre el texto de cada valor,
+    así no depende de si la columna vino como categoría, object o número
+    """
+    hashes = pd.util.hash_pandas_object(df[columnas].astype(str), index=False)
+    return hashes.map('{:016x}'.format)
+
+
+class DimensionFondos:
+    """
+    Mantiene el hash de la versión vigente de cada fondo (se lee una vez de fondosCAFCI) y graba hechos y
+    versiones nuevas dentro de la transacción que recibe. Los hashes en memoria se actualizan con confirmar(),
+    que hay que llamar recién cuando la transacción se commiteó
+    """
+    CIERRA_VERSION = sqlalchemy.text(
+        f'UPDATE "{TABLA_FONDOS}" SET "vigenteHasta" = :hasta WHERE "{CLAVE}" = :clave AND "vigenteHasta" IS NULL'
+    )
+    HISTORIA = sqlalchemy.text(
+        f'SELECT * FROM "{TABLA_FONDOS}" WHERE "{CLAVE}" IN :claves'
+    ).bindparams(sqlalchemy.bindparam('claves', expanding=True))
+    BORRA_HISTORIA = sqlalchemy.text(
+        f'DELETE FROM "{TABLA_FONDOS}" WHERE "{CLAVE}" IN :claves'
+    ).bindparams(sqlalchemy.bindparam('claves', expanding=True))
+
+    def __init__(self, schema='public'):
+        self.schema = schema
+        self.vigentes = None
+
+    def _vigentes(self, conn):
+        if self.vigentes is None:
+            self.vigentes = {}
+            if self._existe(conn, TABLA_FONDOS):
+                result = conn.execute(sqlalchemy.text(
+                    f'SELECT "{CLAVE}", "hashAtributos" FROM "{TABLA_FONDOS}" WHERE "vigenteHasta" IS NULL'
+                ))
+                self.vigentes = {clave: hash for clave, hash in result}
+        return self.vigentes
+
+    def _existe(self, conn, tabla):
+        schema = self.schema if conn.dialect.name == 'postgresql' else None
+        return sqlalchemy.inspect(conn).has_table(tabla, schema=schema)
+
+    def _grabados(self, conn, desde):
+        """
+        (codigoCAFCI, fecha) de los hechos ya grabados en desde o después. Es un rango por el índice de fecha,
+        que en la carga diaria es de uno o dos días
+        """
+        vacio = pd.DataFrame({CLAVE: pd.Series(dtype='int64'), 'fecha': pd.Series(dtype='datetime64[ns]')})
+        if not self._existe(conn, TABLA_HECHOS):
+            return vacio
+        query = sqlalchemy.text(
+            f'SELECT "{CLAVE}", "fecha" FROM "{TABLA_HECHOS}" WHERE "fecha" >= :desde AND "{CLAVE}" IS NOT NULL'
+        )
+        grabados = pd.read_sql(query, conn, params={'desde': desde.date()}, parse_dates=['fecha'])
+        if grabados.empty:
+            return vacio
+        return grabados.astype({CLAVE: 'int64', 'fecha': 'datetime64[ns]'})
+
+    def carga(self, conn, df):
+        """
+        Graba las filas de df (planillas tipadas, con la columna ID) en diariaCAFCI y las versiones nuevas de
+        fondos en fondosCAFCI. Devuelve los hashes vigentes nuevos, para pasarle a confirmar()
+        """
+        vigentes = self._vigentes(conn)
+
+        sin_clave = df[CLAVE].isna()
+        if sin_clave.any():
+            print(f"Hay {int(sin_clave.sum())} filas sin {CLAVE}: se graban los hechos pero no entran en {TABLA_FONDOS}.")
+
+        fondos = df.loc[~sin_clave, [CLAVE, 'fecha'] + esquema.CAFCI_ATRIBUTOS].copy()
+        fondos[CLAVE] = fondos[CLAVE].astype('int64')
+        fondos['fecha'] = pd.to_datetime(fondos['fecha']).astype('datetime64[ns]')
+        fondos = fondos.dropna(subset=['fecha'])
+
+        # fondos atrasados: los que ya tienen hechos grabados en su primera fecha del lote o después
+        # (se lee antes de grabar los hechos del lote)
+        atrasados = pd.Index([], dtype='int64')
+        grabados = None
+        if not fondos.empty:
+            grabados = self._grabados(conn, fondos['fecha'].min())
+            primera = fondos.groupby(CLAVE)['fecha'].min()
+            ultima_grabada = grabados.groupby(CLAVE)['fecha'].max().reindex(primera.index)
+            atrasados = primera.index[(ultima_grabada >= primera).to_numpy()]
+
+        bulk_load(conn, df[['ID', CLAVE] + esquema.CAFCI_HECHOS], TABLA_HECHOS, self.schema)
+
+        if fondos.empty:
+            return {}
+        fondos['hashAtributos'] = hash_atributos(fondos).values
+        es_atrasado = fondos[CLAVE].isin(atrasados)
+        nuevos = {}
+        if es_atrasado.any():
+            nuevos.update(self._rearma(conn, fondos[es_atrasado], grabados[grabados[CLAVE].isin(atrasados)]))
+        nuevos.update(self._agrega(conn, fondos[~es_atrasado], vigentes))
+        return nuevos
+
+    def _agrega(self, conn, fondos, vigentes):
+        """
+        Versiones de los fondos cuyas filas son todas posteriores a lo grabado: se comparan con la versión vigente,
+        que se cierra si cambió
+        """
+        if fondos.empty:
+            return {}
+        fondos = fondos.sort_values([CLAVE, 'fecha'], kind='stable')
+
+        # hash anterior de cada fila: el de la fila previa del mismo fondo o, para la primera, el de la versión vigente
+        anterior = fondos.groupby(CLAVE, sort=False)['hashAtributos'].shift().astype(object)
+        primera = anterior.isna()
+        anterior[primera] = fondos.loc[primera, CLAVE].map(vigentes).astype(object)
+        versiones = fondos[fondos['hashAtributos'] != anterior].copy()
+        if versiones.empty:
+            return {}
+
+        # cada versión nueva va hasta la siguiente del mismo fondo en este lote; la última queda vigente
+        versiones['vigenteDesde'] = versiones['fecha']
+        versiones['vigenteHasta'] = versiones.groupby(CLAVE, sort=False)['vigenteDesde'].shift(-1)
+
+        # cerramos la versión vigente de los fondos que cambiaron
+        primeras = versiones.drop_duplicates(CLAVE)
+        cierres = [
+            {'clave': clave, 'hasta': fecha}
+            for clave, fecha in zip(primeras[CLAVE].tolist(), primeras['vigenteDesde'].dt.to_pydatetime())
+            if clave in vigentes
+        ]
+        if cierres:
+            conn.execute(self.CIERRA_VERSION, cierres)
+
+        bulk_load(conn, versiones[self._columnas()], TABLA_FONDOS, self.schema)
+        print(f"{len(primeras)} fondos con atributos nuevos o cambiados: {len(versiones)} versiones agregadas a {TABLA_FONDOS}.")
+
+        ultimas = versiones.drop_duplicates(CLAVE, keep='last')
+        return dict(zip(ultimas[CLAVE].tolist(), ultimas['hashAtributos'].tolist()))
+
+    def _rearma(self, conn, fondos, grabados):
+        """
+        Historia de los fondos atrasados, armada de nuevo a partir de tres fuentes, en este orden de prioridad
+        para una misma fecha: las filas del lote, lo grabado desde la primera fecha del lote (con los atributos
+        de la versión vigente en cada fecha) y el comienzo de cada versión existente. Se colapsan las fechas
+        seguidas con el mismo hash; si el resultado difiere de lo que hay, se reemplazan las versiones del fondo
+        """
+        claves = fondos[CLAVE].unique().tolist()
+        columnas = [CLAVE, 'fecha', 'hashAtributos'] + esquema.CAFCI_ATRIBUTOS
+        historia = pd.DataFrame(columns=self._columnas())
+        if self._existe(conn, TABLA_FONDOS):
+            # ISO8601: en SQLite las fechas que grabó CIERRA_VERSION no tienen los microsegundos que pone bulk_load
+            fechas = {'vigenteDesde': {'format': 'ISO8601'}, 'vigenteHasta': {'format': 'ISO8601'}}
+            historia = pd.read_sql(self.HISTORIA, conn, params={'claves': claves}, parse_dates=fechas)
+        historia = historia.astype({CLAVE: 'int64', 'vigenteDesde': 'datetime64[ns]', 'vigenteHasta': 'datetime64[ns]'})
+
+        previas = historia.rename(columns={'vigenteDesde': 'fecha'})[columnas].sort_values('fecha', kind='stable')
+        vistos = pd.merge_asof(grabados.sort_values('fecha', kind='stable'), previas, on='fecha', by=CLAVE)
+        puntos = pd.concat([
+            previas.assign(prioridad=0),
+            vistos.dropna(subset=['hashAtributos']).assign(prioridad=1),
+            fondos[columnas].assign(prioridad=2),
+        ], ignore_index=True)
+        puntos = puntos.sort_values([CLAVE, 'fecha', 'prioridad'], kind='stable').drop_duplicates([CLAVE, 'fecha'], keep='last')
+
+        versiones = puntos[puntos['hashAtributos'] != puntos.groupby(CLAVE, sort=False)['hashAtributos'].shift()].copy()
+        versiones['vigenteDesde'] = versiones['fecha']
+        versiones['vigenteHasta'] = versiones.groupby(CLAVE, sort=False)['vigenteDesde'].shift(-1)
+
+        # fondos cuya historia cambió: los que tienen alguna versión (desde, hasta, hash) que no está en los dos lados
+        identidad = [CLAVE, 'vigenteDesde', 'vigenteHasta', 'hashAtributos']
+        balance = pd.concat([versiones[identidad].assign(n=1), historia[identidad].assign(n=-1)])
+        balance = balance.groupby(identidad, dropna=False)['n'].sum()
+        cambiados = balance[balance != 0].index.get_level_values(CLAVE).unique().tolist()
+        if cambiados:
+            conn.execute(self.BORRA_HISTORIA, {'claves': cambiados})
+            bulk_load(conn, versiones.loc[versiones[CLAVE].isin(cambiados), self._columnas()], TABLA_FONDOS, self.schema)
+            print(f"{len(cambiados)} fondos con archivos fuera de orden: se rearmó su historia en {TABLA_FONDOS}.")
+
+        ultimas = versiones.drop_duplicates(CLAVE, keep='last')
+        return dict(zip(ultimas[CLAVE].tolist(), ultimas['hashAtributos'].tolist()))
+
+    @staticmethod
+    def _columnas():
+        return [CLAVE, 'vigenteDesde', 'vigenteHasta', 'hashAtributos'] + esquema.CAFCI_ATRIBUTOS
+
+    def confirmar(self, nuevos):
+        if self.vigentes is not None:
+            self.vigentes.update(nuevos)
@@ -0,0 +1,81 @@
+"""
+Pruebas de la dimensión de fondos con una base SQLite temporal: la historia de fondosCAFCI tiene que quedar igual
+sin importar el orden en que lleguen los archivos.
+
+    python -m pytest dimensionFondos_test.py
+"""
+
+import pandas as pd
+import pytest
+import sqlalchemy
+from DataBaseConn import DatabaseConnection
+from dimensionFondos import DimensionFondos
+from datosSinteticos import dia, planilla
+
+
+def historia(db):
+    with db.connection() as conn:
+        df = pd.read_sql(sqlalchemy.text(
+            'SELECT "codigoCAFCI", "vigenteDesde", "vigenteHasta", "sociedadGerente" FROM "fondosCAFCI" '
+            'ORDER BY "codigoCAFCI", "vigenteDesde"'
+        ), conn, parse_dates={'vigenteDesde': {'format': 'ISO8601'}, 'vigenteHasta': {'format': 'ISO8601'}})
+    return df
+
+
+@pytest.fixture
+def carga(tmp_path_factory):
+    def carga(archivos, dimension=None):
+        """
+        Carga los archivos en ese orden, cada uno en su transacción, en una base nueva y devuelve la historia de
+        fondosCAFCI
+        """
+        directorio = tmp_path_factory.mktemp('carga')
+        with DatabaseConnection(db_type='sqlite', db_name=str(directorio / 'prueba.db')) as db:
+            dimension = dimension or DimensionFondos()
+            for df in archivos:
+                with db.begin() as conn:
+                    nuevos = dimension.carga(conn, df)
+                dimension.confirmar(nuevos)
+            return historia(db)
+    return carga
+
+
+def test_dos_archivos_en_orden_inverso(carga):
+    viejo = planilla(dia(3), {1: 'Gerente A', 2: 'Gerente X'})
+    nuevo = planilla(dia(4), {1: 'Gerente B', 2: 'Gerente X'})
+
+    en_orden = carga([viejo, nuevo])
+    invertido = carga([nuevo, viejo])
+
+    pd.testing.assert_frame_equal(en_orden, invertido)
+    fondo = invertido[invertido['codigoCAFCI'] == 1].reset_index(drop=True)
+    assert fondo['sociedadGerente'].tolist() == ['Gerente A', 'Gerente B']
+    assert fondo['vigenteHasta'][0] == pd.Timestamp(dia(4))
+    assert pd.isna(fondo['vigenteHasta'][1])
+    # el fondo que no cambió tiene una sola versión, vigente desde el primer día
+    assert invertido[invertido['codigoCAFCI'] == 2]['vigenteDesde'].tolist() == [pd.Timestamp(dia(3))]
+
+
+def test_archivo_atrasado_en_el_medio_de_una_version(carga):
+    # días 3 y 5 con A; el 4 (con B) llega último: A hasta el 4, B del 4 al 5 y A otra vez desde el 5
+    archivos = [planilla(dia(3), {1: 'A'}), planilla(dia(5), {1: 'A'}), planilla(dia(4), {1: 'B'})]
+    resultado = carga(archivos)
+    assert resultado['sociedadGerente'].tolist() == ['A', 'B', 'A']
+    assert resultado['vigenteDesde'].tolist() == [pd.Timestamp(dia(n)) for n in (3, 4, 5)]
+    assert resultado['vigenteHasta'].tolist()[:2] == [pd.Timestamp(dia(4)), pd.Timestamp(dia(5))]
+    assert pd.isna(resultado['vigenteHasta'].iloc[2])
+    pd.testing.assert_frame_equal(resultado, carga(sorted(archivos, key=lambda df: df['fecha'].iloc[0])))
+
+
+def test_archivo_repetido_no_cambia_la_historia(carga):
+    archivos = [planilla(dia(3), {1: 'A'}), planilla(dia(4), {1: 'B'})]
+    pd.testing.assert_frame_equal(carga(archivos), carga(archivos + [archivos[0]]))
+
+
+def test_version_vigente_se_cierra_despues_de_un_atrasado(carga):
+    # después de rearmar la historia, un archivo nuevo en orden tiene que cerrar la versión vigente correcta
+    archivos = [planilla(dia(4), {1: 'B'}), planilla(dia(3), {1: 'A'}), planilla(dia(6), {1: 'C'})]
+    resultado = carga(archivos)
+    assert resultado['sociedadGerente'].tolist() == ['A', 'B', 'C']
+    assert resultado['vigenteHasta'].notna().sum() == 2
+
@@ -0,0 +1,289 @@
+"""
+Esquema de las planillas que se cargan en la base de datos: para cada formato conocido, las columnas
+en orden, con su tipo y si admiten nulos. Los parsers usan esto para nombrar y tipar las columnas
+en lugar de dejar que pandas infiera todo como object.
+
+También tiene la definición de las tablas donde se graban (TABLAS): tipos, índices y, en PostgreSQL,
+particiones mensuales por fecha. bulk_load crea las tablas con este DDL la primera vez, y
+`python esquema.py` crea las que falten y los índices sobre una base existente.
+"""
+
+from collections import namedtuple
+import os
+import pandas as pd
+import sqlalchemy
+
+# tipo: 'texto' (se deja como viene), 'categoria', 'fecha', 'numero' (float64), 'entero' (Int64) o 'fechahora'
+Columna = namedtuple('Columna', ['nombre', 'tipo', 'nulos'])
+
+# Columnas de la planilla diaria de CAFCI, en el orden en que vienen en el formato actual (46 columnas)
+CAFCI_COLUMNAS = [
+    Columna("fondo", 'texto', False),
+    Columna("clasMoneda", 'categoria', False),
+    Columna("clasRegion", 'categoria', True),
+    Columna("clasHorizonte", 'categoria', True),
+    Columna("fecha", 'fecha', True),
+    Columna("vcp", 'numero', True),
+    Columna("vcpAnterior", 'numero', True),
+    Columna("varVcp", 'numero', True),
+    Columna("reexPesos", 'numero', True),
+    Columna("varVcp1", 'numero', True),
+    Columna("varVcp2", 'numero', True),
+    Columna("varVcp3", 'numero', True),
+    Columna("ccp", 'numero', True),
+    Columna("ccpAnterior", 'numero', True),
+    Columna("patrimonio", 'numero', True),
+    Columna("patrimonioAnterior", 'numero', True),
+    Columna("marketShare", 'numero', True),
+    Columna("sociedadDepositaria", 'categoria', True),
+    Columna("codigoCNV", 'entero', True),
+    Columna("calificacion", 'categoria', True),
+    Columna("codigoCAFCI", 'entero', True),
+    Columna("codigoSocGte", 'entero', True),
+    Columna("codigoSocDep", 'entero', True),
+    Columna("sociedadGerente", 'categoria', True),
+    Columna("codigoClasificacion", 'entero', True),
+    Columna("codigoMoneda", 'entero', True),
+    Columna("codigoRegion", 'entero', True),
+    Columna("codigoHorizonte", 'entero', True),
+    Columna("indiceMM", 'texto', True),
+    Columna("comisionIngreso", 'numero', True),
+    Columna("honorariosAdmSG", 'numero', True),
+    Columna("honorariosAdmSD", 'numero', True),
+    Columna("gastosOrdGestion", 'numero', True),
+    Columna("comisionRescate", 'numero', True),
+    Columna("comisionTransferencia", 'numero', True),
+    Columna("honorariosExito", 'numero', True),
+    Columna("monedaFondo", 'categoria', True),
+    Columna("plazoLiq", 'texto', True),
+    Columna("decreto596", 'texto', True),
+    Columna("idFondoCAFCIpadre", 'entero', True),
+    Columna("idFondoCNVpadre", 'entero', True),
+    Columna("tipoEscision", 'texto', True),
+    Columna("repatriacion", 'texto', True),
+    Columna("minimoInversion", 'numero', True),
+    Columna("regularizacionLey27743", 'texto', True),
+    Columna("tipodinero", 'texto', True),
+]
+
+# Formatos conocidos, por cantidad de columnas del archivo. Los viejos no traen las últimas columnas,
+# que se agregan vacías para que todos los archivos carguen la misma tabla
+CAFCI_FORMATOS = {
+    46: CAFCI_COLUMNAS,
+    45: CAFCI_COLUMNAS[:-1],
+    44: CAFCI_COLUMNAS[:-2],
+}
+
+# Formato de la fecha en la columna fecha de la planilla de CAFCI (3/06/24)
+CAFCI_FORMATO_FECHA = '%d/%m/%y'
+
+
+def tipar(df, columnas, formato_fecha=None):
+    """
+    Convierte cada columna del df al tipo que dice el esquema, con operaciones vectorizadas.
+    Los valores que no se pueden convertir a número quedan como NaN, y los que no son enteros en una columna
+    entera quedan vacíos (se avisa cuántos)
+    """
+    for columna in columnas:
+        serie = df[columna.nombre]
+        if columna.tipo == 'numero':
+            df[columna.nombre] = pd.to_numeric(serie, errors='coerce').astype('float64')
+        elif columna.tipo == 'entero':
+            numeros = pd.to_numeric(serie, errors='coerce')
+            # la columna en la base es BIGINT: un valor con decimales (o fuera de rango) haría fallar el COPY
+            # de todo el lote, así que se descarta ese valor y no la planilla
+            invalidos = numeros.notna() & ((numeros % 1 != 0) | (numeros.abs() >= 2 ** 63))
+            if invalidos.any():
+                ejemplos = serie[invalidos].unique()[:3].tolist()
+                print(f"La columna {columna.nombre} tiene {int(invalidos.sum())} valores que no son enteros (por ejemplo {ejemplos}). Quedan vacíos.")
+                numeros = numeros.mask(invalidos)
+            df[columna.nombre] = numeros.astype('Int64')
+        elif columna.tipo == 'fecha':
+            # Convertimos a fecha sin la hora
+            df[columna.nombre] = pd.to_datetime(serie, format=formato_fecha).dt.date
+        elif columna.tipo == 'categoria':
+            df[columna.nombre] = serie.astype('category')
+    return df
+
+
+def completar(df, columnas):
+    """
+    Agrega vacías las columnas del esquema que el archivo no trae, y deja las columnas en el orden del esquema
+    """
+    for columna in columnas:
+        if columna.nombre not in df.columns:
+            df[columna.nombre] = None
+    return df[[columna.nombre for columna in columnas]]
+
+
+# Modelo dimensional de la planilla de CAFCI: los datos diarios de cada fondo van a la tabla de hechos
+# (diariaCAFCI) y el resto de las columnas, que casi no cambian, a la dimensión de fondos (fondosCAFCI)
+CAFCI_CLAVE_FONDO = 'codigoCAFCI'
+CAFCI_HECHOS = [
+    'fecha', 'vcp', 'vcpAnterior', 'varVcp', 'reexPesos', 'varVcp1', 'varVcp2', 'varVcp3',
+    'ccp', 'ccpAnterior', 'patrimonio', 'patrimonioAnterior', 'marketShare',
+]
+CAFCI_ATRIBUTOS = [
+    c.nombre for c in CAFCI_COLUMNAS if c.nombre not in CAFCI_HECHOS and c.nombre != CAFCI_CLAVE_FONDO
+]
+
+
+# Columnas de diariaFIMA, como las arma fimaETL.parse_attachment
+FIMA_COLUMNAS = [
+    Columna("tipoFondo", 'texto', True),
+    Columna("fondo", 'texto', False),
+    Columna("codBloomberg", 'texto', True),
+    Columna("vcp", 'numero', True),
+    Columna("varVcp", 'numero', True),
+    Columna("varvcpMes", 'numero', True),
+    Columna("tna", 'numero', True),
+    Columna("patrimonio", 'numero', True),
+    Columna("vcpProxHabil", 'texto', True),
+    Columna("tnaProxHabil", 'numero', True),
+    Columna("calificacion", 'texto', True),
+    Columna("fechaCorrespondeParseada", 'fechahora', True),
+    Columna("id", 'texto', True),
+    Columna("fechaPlanilla", 'texto', True),
+]
+
+# Definición de cada tabla: columnas, índices (tuplas de columnas), columna por la que se particiona por mes
+# en PostgreSQL (None si no se particiona) y las columnas de fondo y fecha que usan las lecturas de series
+Tabla = namedtuple('Tabla', ['columnas', 'indices', 'particion', 'clave', 'fecha'])
+
+_columnas_cafci = {c.nombre: c for c in CAFCI_COLUMNAS}
+TABLAS = {
+    'tablaTempFCI': Tabla(
+        CAFCI_COLUMNAS + [Columna("ID", 'texto', True)],
+        [('codigoCAFCI', 'fecha'), ('fecha',)],
+        'fecha', 'codigoCAFCI', 'fecha',
+    ),
+    'diariaCAFCI': Tabla(
+        [Columna("ID", 'texto', True)] + [_columnas_cafci[n] for n in [CAFCI_CLAVE_FONDO] + CAFCI_HECHOS],
+        [('codigoCAFCI', 'fecha'), ('fecha',)],
+        'fecha', 'codigoCAFCI', 'fecha',
+    ),
+    'fondosCAFCI': Tabla(
+        [_columnas_cafci[CAFCI_CLAVE_FONDO], Columna("vigenteDesde", 'fechahora', True),
+         Columna("vigenteHasta", 'fechahora', True), Columna("hashAtributos", 'texto', True)]
+        + [_columnas_cafci[n] for n in CAFCI_ATRIBUTOS],
+        [('codigoCAFCI', 'vigenteDesde')],
+        None, 'codigoCAFCI', 'vigenteDesde',
+    ),
+    'diariaFIMA': Tabla(
+        FIMA_COLUMNAS,
+        [('codBloomberg', 'fechaCorrespondeParseada'), ('fechaCorrespondeParseada',)],
+        'fechaCorrespondeParseada', 'codBloomberg', 'fechaCorrespondeParseada',
+    ),
+}
+
+# filas que no pasaron la validación (ver validacion.py): las mismas columnas de la tabla diaria más el motivo
+TABLAS['cuarentenaCAFCI'] = Tabla(
+    TABLAS['tablaTempFCI'].columnas + [Columna("motivo", 'texto', True)],
+    [('codigoCAFCI', 'fecha')], None, 'codigoCAFCI', 'fecha',
+)
+TABLAS['cuarentenaFIMA'] = Tabla(
+    TABLAS['diariaFIMA'].columnas + [Columna("motivo", 'texto', True)],
+    [('codBloomberg', 'fechaCorrespondeParseada')], None, 'codBloomberg', 'fechaCorrespondeParseada',
+)
+
+TIPOS_SQL = {
+    'postgresql': {
+        'texto': 'TEXT', 'categoria': 'TEXT', 'fecha': 'DATE', 'fechahora': 'TIMESTAMP',
+        'numero': 'DOUBLE PRECISION', 'entero': 'BIGINT',
+    },
+    'sqlite': {
+        'texto': 'TEXT', 'categoria': 'TEXT', 'fecha': 'DATE', 'fechahora': 'TIMESTAMP',
+        'numero': 'FLOAT', 'entero': 'BIGINT',
+    },
+}
+
+
+def _nombre(conn, nombre, schema=None):
+    preparer = conn.dialect.identifier_preparer
+    if schema and conn.dialect.name == 'postgresql':
+        return f"{preparer.quote_schema(schema)}.{preparer.quote(nombre)}"
+    return preparer.quote(nombre)
+
+
+def ddl_indices(conn, nombre, schema=None):
+    quote = conn.dialect.identifier_preparer.quote
+    return [
+        f"CREATE INDEX IF NOT EXISTS {quote(nombre + '_' + '_'.join(columnas) + '_idx')} "
+        f"ON {_nombre(conn, nombre, schema)} ({', '.join(quote(c) for c in columnas)})"
+        for columnas in TABLAS[nombre].indices
+    ]
+
+
+def ddl(conn, nombre, schema=None):
+    """
+    Sentencias para crear la tabla (con su partición DEFAULT si se particiona) y sus índices
+    """
+    tabla = TABLAS[nombre]
+    tipos = TIPOS_SQL.get(conn.dialect.name, TIPOS_SQL['postgresql'])
+    quote = conn.dialect.identifier_preparer.quote
+    columnas = ",\n    ".join(f"{quote(c.nombre)} {tipos[c.tipo]}" for c in tabla.columnas)
+    sentencias = [f"CREATE TABLE IF NOT EXISTS {_nombre(conn, nombre, schema)} (\n    {columnas}\n)"]
+    if tabla.particion and conn.dialect.name == 'postgresql':
+        sentencias[0] += f" PARTITION BY RANGE ({quote(tabla.particion)})"
+        # las filas sin fecha (o de un mes sin partición) caen en la DEFAULT
+        sentencias.append(
+            f"CREATE TABLE IF NOT EXISTS {_nombre(conn, nombre + '_default', schema)} "
+            f"PARTITION OF {_nombre(conn, nombre, schema)} DEFAULT"
+        )
+    return sentencias + ddl_indices(conn, nombre, schema)
+
+
+def crea_tabla(conn, nombre, schema=None):
+    for sentencia in ddl(conn, nombre, schema):
+        conn.execute(sqlalchemy.text(sentencia))
+
+
+def es_particionada(conn, nombre, schema=None):
+    if conn.dialect.name != 'postgresql' or TABLAS[nombre].particion is None:
+        return False
+    query = sqlalchemy.text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace WHERE c.relname = :tabla AND n.nspname = :schema"
+    )
+    return conn.execute(query, {'tabla': nombre, 'schema': schema or 'public'}).first() is not None
+
+
+def asegura_particiones(conn, nombre, df, schema=None):
+    """
+    Crea (si no existen) las particiones mensuales de los meses que hay en df. No hace nada si la tabla
+    no está particionada (por ejemplo una tabla vieja creada por to_sql)
+    """
+    tabla = TABLAS[nombre]
+    if tabla.particion not in df.columns or not es_particionada(conn, nombre, schema):
+        return
+    meses = pd.to_datetime(df[tabla.particion]).dt.to_period('M').dropna().unique()
+    for mes in sorted(meses):
+        desde, hasta = mes.start_time.date(), (mes + 1).start_time.date()
+        conn.execute(sqlalchemy.text(
+            f"CREATE TABLE IF NOT EXISTS {_nombre(conn, f'{nombre}_{mes.year}_{mes.month:02d}', schema)} "
+            f"PARTITION OF {_nombre(conn, nombre, schema)} FOR VALUES FROM ('{desde}') TO ('{hasta}')"
+        ))
+
+
+def crear_tablas(db, schema='public'):
+    """
+    Crea las tablas de TABLAS que no existen y los índices que falten en las que ya existen.
+    Las tablas existentes no se reparticionan: eso requiere migrar los datos a mano
+    """
+    with db.begin() as conn:
+        schema = schema if conn.dialect.name == 'postgresql' else None
+        for nombre in TABLAS:
+            if sqlalchemy.inspect(conn).has_table(nombre, schema=schema):
+                print(f"La tabla {nombre} ya existe. Creando los índices que falten...")
+                for sentencia in ddl_indices(conn, nombre, schema):
+                    conn.execute(sqlalchemy.text(sentencia))
+            else:
+                print(f"Creando la tabla {nombre}...")
+                crea_tabla(conn, nombre, schema)
+
+
+if __name__ == "__main__":
+    from DataBaseConn import DatabaseConnection
+
+    with DatabaseConnection(db_type="postgresql", db_name=os.environ.get('POSTGRES_DB')) as db:
+        crear_tablas(db)
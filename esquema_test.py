@@ -0,0 +1,16 @@
+"""
+Pruebas de esquema.tipar: lo que sale tiene que poder grabarse en las tablas de TABLAS.
+
+    python -m pytest esquema_test.py
+"""
+
+import pandas as pd
+import esquema
+
+
+def test_entero_con_decimales_queda_vacio_y_la_columna_sigue_entera(capsys):
+    df = pd.DataFrame({'codigoCNV': ['123', '124.0', '125.5', None, 'x', 1e20]})
+    df = esquema.tipar(df, [esquema.Columna('codigoCNV', 'entero', True)])
+    assert df['codigoCNV'].dtype == 'Int64'
+    assert df['codigoCNV'].tolist() == [123, 124, pd.NA, pd.NA, pd.NA, pd.NA]
+    assert '2 valores que no son enteros' in capsys.readouterr().out
@@ -0,0 +1,90 @@
+"""
+Parseo de fechas con nombres de mes en castellano ("3 jun 2024", "3 jun. 2024", "3 junio 2024 14:35"),
+sin depender del locale del sistema: locale.setlocale es global para todo el proceso, no se puede usar desde
+varios threads a la vez y falla en los equipos que no tienen es_ES instalado.
+
+El mes se traduce con un diccionario y la fecha (con la hora) se arma con operaciones vectorizadas de pandas. Como
+en la lista de la CNV los mismos textos se repiten en muchas filas, se parsea cada texto distinto una sola vez, y
+de esos, cada fecha y cada hora distintas una sola vez.
+"""
+
+import re
+import numpy as np
+import pandas as pd
+
+# las tres primeras letras del mes, en castellano (y las que difieren en inglés, por si la página viene en inglés)
+MESES = {
+    'ene': 1, 'feb': 2, 'mar': 3, 'abr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'ago': 8, 'sep': 9, 'set': 9, 'oct': 10, 'nov': 11, 'dic': 12,
+    'jan': 1, 'apr': 4, 'aug': 8, 'dec': 12,
+}
+
+# día y mes (con o sin punto) y año
+_PATRON_DIA = r'^(\d{1,2})\s+([^\W\d_]+)\.?\s+(\d{4})$'
+# la hora: "14:35", "14:35:10", "2:35 p.m." o "2:35 p. m."
+_PATRON_HORA = r'^(\d{1,2}):(\d{2})(?::(\d{2}))?(?:\s*([ap])\.?\s*m\.?)?$'
+
+
+def _parseaDias(textos):
+    """
+    datetime64 de cada texto "3 jun 2024" (NaT si no respeta el formato, el mes no se conoce o la fecha no existe)
+    """
+    partes = pd.Series(textos, dtype=object).str.extract(_PATRON_DIA)
+    componentes = pd.DataFrame({
+        'year': pd.to_numeric(partes[2]),
+        'month': partes[1].str.lower().str[:3].map(MESES),
+        'day': pd.to_numeric(partes[0]),
+    })
+    fechas = pd.Series(pd.NaT, index=componentes.index, dtype='datetime64[ns]')
+    completas = componentes.notna().all(axis=1)
+    if completas.any():
+        fechas[completas] = pd.to_datetime(componentes[completas], errors='coerce')
+    return fechas.to_numpy()
+
+
+def _parseaHoras(textos):
+    """
+    timedelta64 de cada hora "14:35" o "2:35 p.m." desde la medianoche: cero si el texto está vacío y NaT si no
+    respeta el formato o la hora no existe
+    """
+    partes = pd.Series(textos, dtype=object).str.extract(_PATRON_HORA, flags=re.IGNORECASE)
+    hora = pd.to_numeric(partes[0])
+    minuto = pd.to_numeric(partes[1])
+    segundo = pd.to_numeric(partes[2]).fillna(0)
+    # con a.m./p.m. la hora va de 1 a 12: 12 a.m. es medianoche y 12 p.m. mediodía
+    ampm = partes[3].str.lower()
+    hora = hora.where(ampm.isna(), (hora % 12 + 12 * (ampm == 'p')).where(hora.between(1, 12)))
+    segundos = (3600 * hora + 60 * minuto + segundo).where((hora < 24) & (minuto < 60) & (segundo < 60))
+    segundos[pd.Series(textos, dtype=object) == ''] = 0
+    return pd.to_timedelta(segundos, unit='s').to_numpy()
+
+
+def _parseaTextos(textos):
+    """
+    datetime64 de cada texto "3 jun 2024" o "3 jun 2024 14:35" (NaT si no se puede interpretar).
+    Se separan la fecha (las tres primeras palabras) y la hora, y cada fecha y cada hora distintas se parsean
+    una sola vez
+    """
+    partes = [texto.split(None, 3) if isinstance(texto, str) else [] for texto in textos]
+    codigos_dia, dias = pd.factorize(np.array([' '.join(p[:3]) for p in partes], dtype=object))
+    codigos_hora, horas = pd.factorize(np.array([p[3].rstrip() if len(p) > 3 else '' for p in partes], dtype=object))
+    return _parseaDias(dias)[codigos_dia] + _parseaHoras(horas)[codigos_hora]
+
+
+def parseaFecha(serie, errors='raise'):
+    """
+    Convierte una serie de textos como "3 jun 2024", "3 jun. 2024 14:35" o "3 jun 2024 2:35 p.m." a datetime64.
+    Con errors='raise' un texto que no se puede interpretar levanta ValueError; con 'coerce' queda NaT
+    """
+    serie = pd.Series(serie, dtype=object)
+
+    # cada texto distinto se parsea una sola vez y se expande a todas las filas (los espacios de los costados
+    # se ignoran al separar las palabras). Los nulos tienen código -1, que toma el NaT agregado al final
+    codigos, unicos = pd.factorize(serie)
+    fechas = np.append(_parseaTextos(unicos), np.datetime64('NaT', 'ns'))[codigos]
+    fechas = pd.Series(fechas, index=serie.index, dtype='datetime64[ns]')
+
+    invalidas = serie.notna() & fechas.isna()
+    if invalidas.any() and errors == 'raise':
+        raise ValueError(f"No se pudo interpretar la fecha '{serie[invalidas].iloc[0]}'")
+    return fechas
@@ -0,0 +1,56 @@
+"""
+Pruebas de fechas.parseaFecha con textos como los de la lista de la CNV.
+
+    python -m pytest fechas_test.py
+"""
+
+import pandas as pd
+import pytest
+from fechas import parseaFecha
+
+
+@pytest.mark.parametrize('texto, fecha', [
+    ('3 jun 2024', pd.Timestamp(2024, 6, 3)),
+    ('3 jun. 2024', pd.Timestamp(2024, 6, 3)),
+    (' 3 Junio 2024 ', pd.Timestamp(2024, 6, 3)),
+    ('15 set 2023', pd.Timestamp(2023, 9, 15)),
+    ('1 ENE 2024', pd.Timestamp(2024, 1, 1)),
+    ('31 dic. 2023', pd.Timestamp(2023, 12, 31)),
+    # los meses que en inglés se escriben distinto
+    ('3 aug 2024', pd.Timestamp(2024, 8, 3)),
+    ('3 jun 2024 14:35', pd.Timestamp(2024, 6, 3, 14, 35)),
+    ('3 jun 2024 14:35:10', pd.Timestamp(2024, 6, 3, 14, 35, 10)),
+    ('3 jun 2024 2:35 p.m.', pd.Timestamp(2024, 6, 3, 14, 35)),
+    ('3 jun 2024 2:35 p. m.', pd.Timestamp(2024, 6, 3, 14, 35)),
+    ('3 jun 2024 9:05 AM', pd.Timestamp(2024, 6, 3, 9, 5)),
+    ('3 jun 2024 12:05 a.m.', pd.Timestamp(2024, 6, 3, 0, 5)),
+    ('3 jun 2024 12:05 p.m.', pd.Timestamp(2024, 6, 3, 12, 5)),
+])
+def test_textos_validos(texto, fecha):
+    assert parseaFecha(pd.Series([texto]))[0] == fecha
+
+
+@pytest.mark.parametrize('texto', [
+    '3 xyz 2024', '31 feb 2024', 'jun 2024', '3 jun', '', 'ayer',
+    '3 jun 2024 25:00', '3 jun 2024 10:60', '3 jun 2024 13:00 p.m.', '3 jun 2024 0:15 a.m.', '3 jun 2024 14hs',
+])
+def test_textos_invalidos(texto):
+    assert pd.isna(parseaFecha(pd.Series([texto]), errors='coerce')[0])
+    with pytest.raises(ValueError, match='No se pudo interpretar'):
+        parseaFecha(pd.Series([texto]))
+
+
+def test_repetidos_y_nulos_conservan_el_orden_y_el_indice():
+    serie = pd.Series(['3 jun 2024 14:35', None, '4 jun 2024', '3 jun 2024 14:35', '4 jun 2024 9:00'],
+                      index=[10, 11, 12, 13, 14])
+    fechas = parseaFecha(serie)
+    assert fechas.dtype == 'datetime64[ns]'
+    assert fechas.index.tolist() == serie.index.tolist()
+    assert fechas.tolist()[2:] == [pd.Timestamp(2024, 6, 4), pd.Timestamp(2024, 6, 3, 14, 35),
+                                   pd.Timestamp(2024, 6, 4, 9)]
+    assert fechas[10] == fechas[13] and pd.isna(fechas[11])
+
+
+def test_todos_nulos():
+    assert parseaFecha(pd.Series([None, None])).isna().all()
+    assert parseaFecha(pd.Series([], dtype=object)).empty
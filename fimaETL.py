@@ -1,17 +1,32 @@
 """
 Script para chequear la casilla data@outlier.com.ar en búsqueda de nuevos archivos recibidos de FIMA.
 Este script debería ejecutarse, disparado por un cron (entre los horarios de las 19 y las 21, y las 0:30 y las 2:00, o hasta que un nuevo archivo sea recibido)
+Con FIMA_IMAP_MODE=idle, en cambio, queda corriendo como daemon con una conexión abierta y procesa los mails apenas llegan
 """
 
 import time
 import os
+import io
 import imaplib
 import email
+import email.header
+import email.utils
 import re
+import json
+import itertools
+import base64
+import quopri
+import select
+import ssl
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import pandas as pd
 from DataBaseConn import DatabaseConnection
+import lectorExcel
+import cacheParseo
+import validacion
 import uuid
+import hashlib
 
 # get mail server details from environment variables
 MAIL_SERVER = os.getenv("MAIL_SERVER")
@@ -21,22 +36,141 @@ MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
 ATTACH_DIR = os.getenv("ATTACH_DIR")
 FIMA_FROM_ADDRESS = os.getenv("FIMA_FROM_ADDRESS")
 destination_folder = 'INBOX.fima_archivados'
+# carpeta para los mails que no se van a poder procesar nunca (asunto sin fecha): se sacan de INBOX y no se reintentan
+ERROR_FOLDER = os.getenv("FIMA_ERROR_FOLDER", 'INBOX.fima_errores')
+# 'uid' usa check_mail_uid (FETCH por lotes, solo la parte del adjunto); 'seq' usa el check_mail original;
+# 'idle' queda corriendo con watch_mail
+IMAP_MODE = os.getenv("FIMA_IMAP_MODE", "uid")
+# dónde se guarda el último UIDVALIDITY/UID procesado
+UID_STATE_FILE = os.getenv("FIMA_UID_STATE", os.path.join(ATTACH_DIR or '.', '.fima_uid_state.json'))
+FETCH_BATCH_SIZE = 100
+# versión de parse_workbook: cambiarla cuando cambie el resultado del parseo, así no se usan entradas viejas de la cache
+PARSER_VERSION = 1
+# modo idle: cada cuánto se renueva el IDLE (el RFC pide menos de 29 minutos), cada cuánto se hace NOOP si
+# el servidor no soporta IDLE, cada cuánto se vuelve si hay adjuntos procesándose y esperas para reconectar
+IDLE_TIMEOUT = 25 * 60
+NOOP_INTERVAL = 60
+PENDING_POLL_INTERVAL = 5
+RECONNECT_MIN_DELAY = 5
+RECONNECT_MAX_DELAY = 300
+# cada cuánto el daemon vuelve a intentar, sin reconectar, los mensajes que no se pudieron grabar
+RETRY_INTERVAL = 5 * 60
+
+# Regular expression to match the date pattern in the subject
+#date_pattern = re.compile(r'(\d{2}-\d{2}-\d{4})')
+date_pattern = re.compile(r'\d{1,2}[-\/]\d{1,2}[-\/]\d{2,4}')
+# nombre con el que se guardan los adjuntos: fecha_sha256_uuid.ext
+stored_name_pattern = re.compile(r'^(\d{8})_([0-9a-f]{64})_([0-9a-f-]{36})(\.[^.]*)?$')
+_stored_hashes = None
+# valida las filas de cada planilla contra el último valor de cada fondo (ver validacion.py)
+validador = validacion.Validador('diariaFIMA', 'cuarentenaFIMA') if validacion.VALIDACION else None
 
 def generate_uuid():
     return str(uuid.uuid4())
 
 
-def check_mail():
+def stored_hashes():
+    """
+    Set con los hashes de los adjuntos ya guardados en ATTACH_DIR (los nombres son fecha_hash_uuid.ext).
+    Se arma una sola vez recorriendo la carpeta y después se actualiza a medida que se guardan adjuntos
+    """
+    global _stored_hashes
+    if _stored_hashes is None:
+        _stored_hashes = set()
+        for name in os.listdir(ATTACH_DIR):
+            match = stored_name_pattern.match(name)
+            if match:
+                _stored_hashes.add(match.group(2))
+    return _stored_hashes
+
+
+def write_attachment(file_path, payload):
+    """
+    Escribe el adjunto en ATTACH_DIR. Se escribe a un temporal y se renombra, así nunca queda un archivo
+    a medias con nombre válido
+    """
+    with open(file_path + '.part', 'wb') as f:
+        f.write(payload)
+    os.replace(file_path + '.part', file_path)
+
+
+def subject_date(subject):
+    """
+    Fecha a la que corresponde el archivo, tomada del asunto del mail (3-06-2024, 3/06/24). None si el asunto
+    no tiene una fecha válida
+    """
+    date_match = date_pattern.search(subject or '')
+    if not date_match:
+        return None
+
+    # Extracted date string
+    date_str = re.sub(r'[\/]', '-', date_match.group(0))
+
+    # Try to parse with a 4-digit year. If it fails, fall back to a 2-digit year
+    for date_format in ('%d-%m-%Y', '%d-%m-%y'):
+        try:
+            return datetime.strptime(date_str, date_format)
+        except ValueError:
+            pass
+    return None
+
+
+def store_attachment(subject, date_header, file_name, payload, unit):
+    """
+    Procesa el adjunto y agrega a la unidad de trabajo `unit` (ver DatabaseConnection.ingestion) el registro
+    del mail para archivosFIMA y sus filas para diariaFIMA. El adjunto se guarda en ATTACH_DIR cuando se commitea.
+    La fecha a la que corresponde el archivo se toma del asunto del mail.
+    Devuelve True si se procesó, False si el asunto no tenía una fecha
+    """
+    # extract the date from the subject
+    print(subject)
+    fechaCorrespondeParseada = subject_date(subject)
+    if fechaCorrespondeParseada is None:
+        print(f"No encontré una fecha en el asunto '{subject}'. No se procesa el adjunto {file_name}")
+        return False
+
+    # el archivo se guarda con un nombre derivado del contenido (fecha_hash_uuid), así no hay colisiones
+    # aunque lleguen varios adjuntos en el mismo segundo, y si ya guardamos ese mismo contenido lo salteamos
+    digest = hashlib.sha256(payload).hexdigest()
+    if digest in stored_hashes():
+        print(f"El adjunto {file_name} ya había sido procesado (hash {digest[:12]}). No se vuelve a cargar")
+        return True
+
+    email_datetime = email.utils.parsedate_to_datetime(date_header)
+    print(f"Saving attachment {file_name} received on {email_datetime} to {ATTACH_DIR}")
+
+    id = generate_uuid()
+    extension = os.path.splitext(file_name)[1].lower()
+    file_name = f"{fechaCorrespondeParseada:%Y%m%d}_{digest}_{id}{extension}"
+    file_path = os.path.join(ATTACH_DIR, file_name)
+    emails_df = pd.DataFrame([{
+        'fechaRecepcion': email_datetime,
+        'descripcion': subject,
+        'fechaCorrespondeParseada': fechaCorrespondeParseada,
+        'fileName': file_name,
+        'id': id
+    }])
+    # primero parseamos y validamos, así un archivo roto no deja el registro del mail sin sus filas
+    print("Enviando a procesar el archivo")
+    diaria, cuarentena = valida_diaria(parse_attachment(emails_df, payload), unit.db)
+    print("Enviando a almacenar mail en la base de datos")
+    load_mail_to_db(emails_df, unit)
+    add_diaria(diaria, unit, cuarentena)
+
+    # el archivo se escribe recién cuando se commitea, porque su presencia en ATTACH_DIR indica que ya se procesó
+    stored_hashes().add(digest)
+    unit.on_commit(lambda: write_attachment(file_path, payload))
+    unit.on_rollback(lambda: stored_hashes().discard(digest))
+    return True
+
+
+def check_mail(db):
     """
     Check the mailbox for new emails and download the attachments
     """
     print(f"Chequeando la casilla de correo {MAIL_USER} en el servidor {MAIL_SERVER} en el puerto {MAIL_PORT} a las {time.ctime()}")
     # connect to the mail server using SSL
 
-    # Regular expression to match the date pattern in the subject
-    #date_pattern = re.compile(r'(\d{2}-\d{2}-\d{4})')
-    date_pattern = re.compile(r'\d{1,2}[-\/]\d{1,2}[-\/]\d{2,4}')
-
     mail = imaplib.IMAP4_SSL(MAIL_SERVER, MAIL_PORT)
     mail.login(MAIL_USER, MAIL_PASSWORD)
     mail.select('inbox')
@@ -65,57 +199,19 @@ def check_mail():
                 file_name = part.get_filename()
                 if file_name and (file_name.endswith('.xls') or file_name.endswith('.xlsx')):
                     
-                    # extract the date from the subject
-                    print(email_message['Subject'])
-                    date_match = date_pattern.search(email_message['Subject'])
-                    if date_match:
-                        # Extracted date string
-                        date_str = date_match.group(0)
-                        date_str = re.sub(r'[\/]', '-', date_str)
-                    
-                        # Convert the date string to a datetime object with hours, minutes and seconds to account for
-                        from datetime import datetime
-
-                        try:
-                            # Try to parse with a 4-digit year
-                            fechaCorrespondeParseada = datetime.strptime(date_str, '%d-%m-%Y')
-                        except ValueError:
-                            # If it fails, fall back to a 2-digit year
-                            fechaCorrespondeParseada = datetime.strptime(date_str, '%d-%m-%y')
- 
-                        #fechaCorrespondeParseada = datetime.strptime(date_str, '%d-%m-%Y')
-
-                    # assign a file_path adding 
-                    email_datetime = email.utils.parsedate_to_datetime(email_message['date'])
-                    email_datetime_formatted = email_datetime.strftime('%Y%m%d_%H-%M-%S')
-                    print(f"Saving attachment {file_name} received on {email_datetime} to {ATTACH_DIR}")
-
-                    file_name = f"{email_datetime_formatted}_{file_name}_{date_str}"
-                    file_path = os.path.join(ATTACH_DIR, file_name)
-                    with open(file_path, 'wb') as f:
-                        f.write(part.get_payload(decode=True))
-                        # pause 1 seconds to prevent having the same timestamp in the file name
-                        time.sleep(1)
-                    emails_df = pd.DataFrame([{
-                        'fechaRecepcion': email_datetime,
-                        'descripcion': email_message['Subject'],
-                        'fechaCorrespondeParseada': fechaCorrespondeParseada,
-                        'fileName': file_name
-                    }])
-                    emails_df['id'] = emails_df.apply(lambda x: generate_uuid(), axis=1)
-                    print("Enviando a almacenar mail en la base de datos")
-                    load_mail_to_db(emails_df)
-                    print("Enviando a procesar el archivo")
-                    process_attachment(emails_df)
-                    # Move the email to the destination folder
-                    print(f"Moving email {num} to {destination_folder}")
-                    result = mail.copy(num, destination_folder)
-                    if result[0] == 'OK':
-                        print(f"Message {num} copied to {destination_folder} successfully.")
-                        # delete the original email
-                        mail.store(num, '+FLAGS', '\\Deleted')  
-                    else:
-                        print(f"Failed to copy message {num}. Server response: {result}. Message not deleted.")
+                    # cada mail se graba en su propia transacción, antes de moverlo
+                    with db.ingestion() as unit:
+                        stored = store_attachment(email_message['Subject'], email_message['date'], file_name, part.get_payload(decode=True), unit)
+                    if stored:
+                        # Move the email to the destination folder
+                        print(f"Moving email {num} to {destination_folder}")
+                        result = mail.copy(num, destination_folder)
+                        if result[0] == 'OK':
+                            print(f"Message {num} copied to {destination_folder} successfully.")
+                            # delete the original email
+                            mail.store(num, '+FLAGS', '\\Deleted')  
+                        else:
+                            print(f"Failed to copy message {num}. Server response: {result}. Message not deleted.")
                     break
                     
             #mail.store(num, '+FLAGS', '\\Seen')
@@ -123,20 +219,606 @@ def check_mail():
     mail.logout()
 
 
+def _imap_tokens(data):
+    """
+    Tokeniza la respuesta de un FETCH tal como la devuelve imaplib (bytes y tuplas (encabezado, literal)).
+    Devuelve '(' y ')', strings para átomos y strings entre comillas, None para NIL y bytes para los literales
+    """
+    for item in data:
+        if isinstance(item, tuple):
+            text, literal = item
+        else:
+            text, literal = item, None
+        text = text.decode('utf-8', errors='replace')
+
+        # el encabezado de un literal termina en {n}, que reemplazamos por el literal en sí
+        if literal is not None:
+            text = re.sub(r'\{\d+\}$', '', text)
+
+        i = 0
+        while i < len(text):
+            c = text[i]
+            if c in ' \r\n':
+                i += 1
+            elif c in '()':
+                yield c
+                i += 1
+            elif c == '"':
+                i += 1
+                value = []
+                while i < len(text) and text[i] != '"':
+                    if text[i] == '\\':
+                        i += 1
+                    value.append(text[i])
+                    i += 1
+                i += 1
+                yield ''.join(value)
+            else:
+                # átomo. Lo que va entre corchetes (BODY[HEADER.FIELDS (DATE)]) es parte del átomo
+                start = i
+                depth = 0
+                while i < len(text) and (depth or text[i] not in ' ()\r\n'):
+                    if text[i] == '[':
+                        depth += 1
+                    elif text[i] == ']':
+                        depth -= 1
+                    i += 1
+                atom = text[start:i]
+                yield None if atom.upper() == 'NIL' else atom
+
+        if literal is not None:
+            yield literal
+
+
+def parse_fetch_response(data):
+    """
+    Convierte la respuesta de un UID FETCH en un dict {uid: {item: valor}}, por ejemplo
+    {12: {'BODYSTRUCTURE': [...], 'BODY[HEADER.FIELDS (SUBJECT DATE)]': b'...'}}
+    """
+    tokens = _imap_tokens(data)
+
+    def parse_list():
+        items = []
+        for token in tokens:
+            if token == '(':
+                items.append(parse_list())
+            elif token == ')':
+                return items
+            else:
+                items.append(token)
+        return items
+
+    messages = {}
+    for token in tokens:
+        # cada mensaje viene como: número de secuencia (ITEM valor ITEM valor ...)
+        if token != '(':
+            continue
+        values = parse_list()
+        fields = {str(values[i]).upper(): values[i + 1] for i in range(0, len(values) - 1, 2)}
+        if 'UID' in fields:
+            messages[int(fields['UID'])] = fields
+    return messages
+
+
+def _decode_header_value(value):
+    # nombres de archivo codificados como =?utf-8?...?=
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    return str(email.header.make_header(email.header.decode_header(value)))
+
+
+def _part_filename(part):
+    """
+    Nombre del archivo de una parte del BODYSTRUCTURE, tomado del Content-Disposition o del parámetro name
+    """
+    params = part[2] if len(part) > 2 and isinstance(part[2], list) else []
+    for element in part[7:]:
+        # disposition: ("attachment" ("filename" "x.xls"))
+        if isinstance(element, list) and len(element) == 2 and isinstance(element[0], str) and isinstance(element[1], list):
+            params = element[1] + params
+            break
+    for key in ('filename', 'name'):
+        for i in range(0, len(params) - 1, 2):
+            if str(params[i]).lower() == key and params[i + 1]:
+                return _decode_header_value(params[i + 1])
+    return None
+
+
+def find_attachment_parts(structure, prefix=''):
+    """
+    Recorre el BODYSTRUCTURE y devuelve una lista de (número de parte, nombre de archivo, encoding)
+    con los adjuntos xls/xlsx
+    """
+    found = []
+    if structure and isinstance(structure[0], list):
+        # multipart: las partes son las listas del principio, numeradas desde 1. Después viene el subtipo
+        for i, part in enumerate(itertools.takewhile(lambda p: isinstance(p, list), structure)):
+            found += find_attachment_parts(part, f"{prefix}{i + 1}.")
+        return found
+
+    file_name = _part_filename(structure)
+    if file_name and file_name.lower().endswith(('.xls', '.xlsx')):
+        encoding = str(structure[5]).lower() if len(structure) > 5 and structure[5] else '7bit'
+        found.append((prefix.rstrip('.') or '1', file_name, encoding))
+    return found
+
+
+def _decode_part(payload, encoding):
+    if encoding == 'base64':
+        return base64.b64decode(payload)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(payload)
+    return payload
 
-def load_mail_to_db(df):
 
-    df.to_sql(name = 'archivosFIMA', con = db.engine, index = False, schema = 'public', if_exists='append')
+def _uid_set(uids):
+    return ','.join(str(uid) for uid in uids)
+
+
+def load_uid_state():
+    """
+    Lee el último UIDVALIDITY/UID procesado. Si no hay estado, devuelve (None, 0)
+    """
+    try:
+        with open(UID_STATE_FILE) as f:
+            state = json.load(f)
+        return state.get('uidvalidity'), int(state.get('last_uid', 0))
+    except (OSError, ValueError):
+        return None, 0
+
+
+def save_uid_state(uidvalidity, last_uid):
+    with open(UID_STATE_FILE, 'w') as f:
+        json.dump({'uidvalidity': uidvalidity, 'last_uid': last_uid}, f)
+
+
+def _capabilities(mail):
+    # las capacidades pueden cambiar después del login, así que las volvemos a pedir
+    _, data = mail.capability()
+    return set(data[0].decode().upper().split())
+
+
+def move_messages(mail, uids, folder=None):
+    """
+    Mueve los mensajes a folder (destination_folder si no se pasa) con un solo UID MOVE, o con
+    UID COPY + STORE \\Deleted si el servidor no soporta MOVE
+    """
+    if not uids:
+        return
+    folder = folder or destination_folder
+    uid_set = _uid_set(uids)
+    capabilities = _capabilities(mail)
+    print(f"Moving emails {uid_set} to {folder}")
+    if 'MOVE' in capabilities:
+        result = mail.uid('MOVE', uid_set, folder)
+        if result[0] != 'OK':
+            print(f"Failed to move messages {uid_set}. Server response: {result}.")
+        return
+
+    result = mail.uid('COPY', uid_set, folder)
+    if result[0] != 'OK':
+        print(f"Failed to copy messages {uid_set}. Server response: {result}. Messages not deleted.")
+        return
+    mail.uid('STORE', uid_set, '+FLAGS', '(\\Deleted)')
+    if 'UIDPLUS' in capabilities:
+        mail.uid('EXPUNGE', uid_set)
+
+
+def undated_messages(messages):
+    """
+    UIDs de los mensajes con adjunto cuyo asunto no tiene una fecha válida. No se van a poder procesar nunca,
+    así que en lugar de reintentarlos (y frenar la marca de UID) se mueven a ERROR_FOLDER
+    """
+    return sorted(uid for uid, m in messages.items() if m['parts'] and subject_date(m['subject']) is None)
+
+
+def reject_messages(mail, uids):
+    """
+    Mueve los mensajes a ERROR_FOLDER, creándola si no existe
+    """
+    if not uids:
+        return
+    print(f"Los mensajes {_uid_set(uids)} no tienen fecha en el asunto. Se mueven a {ERROR_FOLDER}")
+    # si la carpeta ya existe el servidor contesta NO, que imaplib devuelve sin levantar error
+    mail.create(ERROR_FOLDER)
+    move_messages(mail, uids, ERROR_FOLDER)
+
+
+def fetch_new_messages(mail, last_uid):
+    """
+    Busca los mensajes de FIMA con UID mayor a last_uid y trae, en un FETCH por lote, su BODYSTRUCTURE
+    y los encabezados Subject/Date. Devuelve un dict {uid: {'subject', 'date', 'parts'}}
+    """
+    result, data = mail.uid('SEARCH', None, f'(FROM "{FIMA_FROM_ADDRESS}" UID {last_uid + 1}:*)')
+    # UID n:* siempre incluye el último mensaje aunque su UID sea menor a n
+    uids = sorted(uid for uid in map(int, data[0].split()) if uid > last_uid)
+
+    messages = {}
+    for start in range(0, len(uids), FETCH_BATCH_SIZE):
+        batch = uids[start:start + FETCH_BATCH_SIZE]
+        _, data = mail.uid('FETCH', _uid_set(batch), '(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (SUBJECT DATE)])')
+        for uid, fields in parse_fetch_response(data).items():
+            header = next((v for k, v in fields.items() if k.startswith('BODY[HEADER')), b'') or b''
+            headers = email.message_from_bytes(header)
+            messages[uid] = {
+                'subject': _decode_header_value(headers['Subject'] or ''),
+                'date': headers['Date'],
+                'parts': find_attachment_parts(fields.get('BODYSTRUCTURE') or []),
+            }
+    return messages
+
+
+def fetch_parts(mail, wanted):
+    """
+    Baja solo las partes pedidas. wanted es {uid: (número de parte, encoding)}.
+    Hace un FETCH por cada número de parte distinto, con todos los UIDs que lo piden
+    """
+    by_part = {}
+    for uid, (part, encoding) in wanted.items():
+        by_part.setdefault(part, []).append(uid)
+
+    payloads = {}
+    for part, uids in by_part.items():
+        for start in range(0, len(uids), FETCH_BATCH_SIZE):
+            batch = uids[start:start + FETCH_BATCH_SIZE]
+            _, data = mail.uid('FETCH', _uid_set(batch), f'(UID BODY.PEEK[{part}])')
+            for uid, fields in parse_fetch_response(data).items():
+                body = fields.get(f'BODY[{part}]')
+                if isinstance(body, str):
+                    body = body.encode()
+                if uid in wanted and body is not None:
+                    payloads[uid] = _decode_part(body, wanted[uid][1])
+    return payloads
+
+
+def connect_mail():
+    """
+    Abre la conexión SSL con el servidor, hace login y selecciona INBOX.
+    Devuelve la conexión y el UIDVALIDITY de la casilla
+    """
+    mail = imaplib.IMAP4_SSL(MAIL_SERVER, MAIL_PORT)
+    mail.login(MAIL_USER, MAIL_PASSWORD)
+    mail.select('inbox')
+
+    uidvalidity = mail.response('UIDVALIDITY')[1][0]
+    uidvalidity = uidvalidity.decode() if isinstance(uidvalidity, bytes) else uidvalidity
+    return mail, uidvalidity
 
 
-def process_attachment(df):
+def start_uid(uidvalidity):
+    """
+    Último UID procesado según UID_STATE_FILE, o 0 si cambió la numeración de la casilla
+    """
+    saved_uidvalidity, last_uid = load_uid_state()
+    if saved_uidvalidity != uidvalidity:
+        # cambió la numeración de la casilla, hay que mirar todo de nuevo
+        return 0
+    return last_uid
+
+
+def fetch_attachments(mail, last_uid):
+    """
+    Trae los mensajes nuevos (UID mayor a last_uid) y el primer adjunto xls/xlsx de cada uno.
+    Devuelve (messages, payloads): los datos de cada mensaje y los bytes de los adjuntos, por UID
+    """
+    messages = fetch_new_messages(mail, last_uid)
+    print(f"Hay {len(messages)} mensajes nuevos de {FIMA_FROM_ADDRESS}")
+
+    # igual que en check_mail, procesamos solo el primer adjunto xls/xlsx de cada mail. Los que no tienen fecha
+    # en el asunto no se bajan (ver undated_messages)
+    undated = set(undated_messages(messages))
+    wanted = {uid: (m['parts'][0][0], m['parts'][0][2]) for uid, m in messages.items() if m['parts'] and uid not in undated}
+    payloads = fetch_parts(mail, wanted)
+    for uid in wanted:
+        if uid not in payloads:
+            print(f"No se pudo bajar el adjunto del mensaje {uid}")
+    return messages, payloads
+
+
+def handle_message(uid, message, payload, unit):
+    """
+    Procesa el adjunto de un mensaje dentro de la unidad de trabajo `unit`.
+    Devuelve True si se procesó y el mensaje se puede archivar una vez commiteado. Si falla, lo que el mensaje
+    llegó a agregar a la unidad se descarta y el resto de los mensajes se graba igual
+    """
+    mark = unit.savepoint()
+    try:
+        return store_attachment(message['subject'], message['date'], message['parts'][0][1], payload, unit)
+    except Exception as e:
+        print(f"Ocurrió un error procesando el mensaje {uid}: {e}")
+        unit.rollback_to(mark)
+        return False
+
+
+def check_mail_uid(db):
+    """
+    Igual que check_mail pero por UID: trae encabezados y BODYSTRUCTURE de todos los mensajes nuevos en lotes,
+    baja solo la parte del adjunto xls/xlsx y mueve los mensajes procesados con un solo comando.
+    Recuerda el último UID procesado (por UIDVALIDITY) en UID_STATE_FILE para no volver a mirar mensajes viejos
+    """
+    print(f"Chequeando la casilla de correo {MAIL_USER} en el servidor {MAIL_SERVER} en el puerto {MAIL_PORT} a las {time.ctime()}")
+
+    mail, uidvalidity = connect_mail()
+    last_uid = start_uid(uidvalidity)
+
+    messages, payloads = fetch_attachments(mail, last_uid)
+    rejected = undated_messages(messages)
+
+    processed = []
+    failed = []
+    try:
+        # todos los adjuntos de la corrida se graban juntos, en una sola transacción
+        with db.ingestion() as unit:
+            for uid in sorted(messages):
+                if not messages[uid]['parts'] or uid in rejected:
+                    continue
+                if uid in payloads and handle_message(uid, messages[uid], payloads[uid], unit):
+                    processed.append(uid)
+                else:
+                    failed.append(uid)
+    except Exception as e:
+        print(f"No se pudo grabar la corrida en la base de datos: {e}. No se archiva ningún mensaje")
+        failed = sorted(set(failed) | set(processed))
+        processed = []
+    print(f"Métricas de commit: {db.commit_metrics}")
+
+    # recién con todo commiteado movemos los mensajes. Los que no tienen fecha van a ERROR_FOLDER y la marca
+    # los pasa, porque reintentarlos no cambia nada
+    move_messages(mail, processed)
+    reject_messages(mail, rejected)
+
+    # avanzamos la marca hasta antes del primer mensaje que falló, así se reintenta en la próxima corrida
+    if messages:
+        new_last_uid = min(failed) - 1 if failed else max(messages)
+        save_uid_state(uidvalidity, max(last_uid, new_last_uid))
+
+    mail.close()
+    mail.logout()
+
+
+def _buffered(mail):
+    """
+    Si ya hay algo leído del servidor esperando en mail.file (el buffer de readline) o en la capa SSL.
+    select solo mira el socket, así que una línea que llegó en el mismo paquete que la anterior quedaría
+    esperando hasta el timeout. peek con el socket no bloqueante devuelve el buffer sin esperar
+    """
+    if hasattr(mail.sock, 'pending') and mail.sock.pending():
+        return True
+    timeout = mail.sock.gettimeout()
+    mail.sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        mail.sock.settimeout(timeout)
+
+
+def idle(mail, timeout):
+    """
+    Manda IDLE y espera hasta `timeout` segundos a que el servidor avise que llegó algo (EXISTS/RECENT).
+    Devuelve True si hubo novedades. imaplib no trae IDLE, así que lo hablamos directo sobre la conexión
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    line = mail.readline()
+    if not line.startswith(b'+'):
+        raise imaplib.IMAP4.error(f"El servidor rechazó IDLE: {line!r}")
+
+    news = False
+    deadline = time.monotonic() + timeout
+    try:
+        while not news:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # si no hay nada para leer esperamos con select, así no bloqueamos el readline
+            if not _buffered(mail) and not select.select([mail.sock], [], [], remaining)[0]:
+                break
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("El servidor cerró la conexión durante IDLE")
+            news = line.startswith(b'*') and (b'EXISTS' in line or b'RECENT' in line)
+    finally:
+        mail.send(b'DONE\r\n')
+        # leemos hasta la respuesta al IDLE. Lo que llegue en el medio lo vamos a ver con el próximo SEARCH
+        while True:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("El servidor cerró la conexión al terminar IDLE")
+            if line.startswith(tag):
+                break
+    return news
+
+
+def watch_mail(db):
+    """
+    Modo daemon: mantiene una sola conexión abierta y espera los mails de FIMA con IDLE (o NOOP cada
+    NOOP_INTERVAL segundos si el servidor no soporta IDLE), así se reacciona en segundos sin tener que
+    loguearse en cada corrida del cron. Los adjuntos se procesan en un worker aparte para no bloquear
+    la conexión; los mensajes ya procesados se archivan en la vuelta siguiente. Si se corta la conexión
+    se reconecta esperando cada vez más (hasta RECONNECT_MAX_DELAY segundos). Los mensajes que fallan se
+    vuelven a intentar cada RETRY_INTERVAL segundos en la misma sesión, y la marca no pasa de ellos
+    """
+    print(f"Vigilando la casilla de correo {MAIL_USER} en el servidor {MAIL_SERVER} en el puerto {MAIL_PORT} desde las {time.ctime()}")
+
+    def ingest(uid, message, payload):
+        # en el daemon cada mail se graba en su propia transacción apenas llega
+        try:
+            with db.ingestion() as unit:
+                stored = handle_message(uid, message, payload, unit)
+            return stored
+        except Exception as e:
+            print(f"No se pudo grabar el mensaje {uid} en la base de datos: {e}")
+            return False
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    # {future: (uid, mensaje)} de lo que está en el worker
+    pending = {}
+    # los que fallaron, {uid: mensaje}, para volver a bajarlos y reintentarlos
+    failed = {}
+    next_retry = time.monotonic() + RETRY_INTERVAL
+    backoff = RECONNECT_MIN_DELAY
+
+    try:
+        while True:
+            mail = None
+            try:
+                mail, uidvalidity = connect_mail()
+                last_uid = start_uid(uidvalidity)
+                use_idle = 'IDLE' in _capabilities(mail)
+                backoff = RECONNECT_MIN_DELAY
+                print(f"Conectado. Esperando mails con {'IDLE' if use_idle else 'NOOP'}")
+
+                while True:
+                    messages, payloads = fetch_attachments(mail, last_uid)
+                    rejected = undated_messages(messages)
+                    reject_messages(mail, rejected)
+                    # después de reconectar vuelven los que fallaron o que el worker todavía está procesando
+                    working = {uid for uid, _ in pending.values()}
+                    for uid in sorted(messages):
+                        if not messages[uid]['parts'] or uid in rejected or uid in working:
+                            continue
+                        failed.pop(uid, None)
+                        if uid in payloads:
+                            pending[executor.submit(ingest, uid, messages[uid], payloads[uid])] = (uid, messages[uid])
+                        else:
+                            failed[uid] = messages[uid]
+                    if messages:
+                        last_uid = max(last_uid, max(messages))
+
+                    # last_uid ya pasó a los que fallaron, así que el SEARCH no los vuelve a traer: los bajamos de nuevo
+                    if failed and time.monotonic() >= next_retry:
+                        next_retry = time.monotonic() + RETRY_INTERVAL
+                        print(f"Reintentando los mensajes {sorted(failed)}")
+                        retry = fetch_parts(mail, {uid: (m['parts'][0][0], m['parts'][0][2]) for uid, m in failed.items()})
+                        for uid, payload in sorted(retry.items()):
+                            message = failed.pop(uid)
+                            pending[executor.submit(ingest, uid, message, payload)] = (uid, message)
+
+                    # archivamos los mensajes que el worker ya terminó de procesar
+                    processed = []
+                    for future in [f for f in pending if f.done()]:
+                        uid, message = pending.pop(future)
+                        if future.result():
+                            processed.append(uid)
+                        else:
+                            failed[uid] = message
+                    move_messages(mail, sorted(processed))
+
+                    # la marca no pasa del primer mensaje que falló o que todavía se está procesando
+                    unfinished = set(failed) | {uid for uid, _ in pending.values()}
+                    save_uid_state(uidvalidity, min(unfinished) - 1 if unfinished else last_uid)
+
+                    # si hay adjuntos procesándose volvemos pronto para archivarlos
+                    timeout = PENDING_POLL_INTERVAL if pending else IDLE_TIMEOUT
+                    if failed:
+                        timeout = max(0, min(timeout, next_retry - time.monotonic()))
+                    if use_idle:
+                        idle(mail, timeout)
+                    else:
+                        time.sleep(min(timeout, NOOP_INTERVAL))
+                        mail.noop()
+
+            except (imaplib.IMAP4.error, OSError) as e:
+                print(f"Se perdió la conexión con el servidor ({e}). Reintentando en {backoff} segundos")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, RECONNECT_MAX_DELAY)
+            finally:
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
+    except KeyboardInterrupt:
+        print(f"Deteniendo la vigilancia de la casilla a las {time.ctime()}")
+    finally:
+        executor.shutdown(wait=True)
+
+
+
+def load_mail_to_db(df, unit):
+    """
+    Agrega el registro del mail a la unidad de trabajo, para archivosFIMA
+    """
+    unit.add(df, 'archivosFIMA', schema = 'public')
+
+
+def celda(encabezado, fila, columna):
+    """
+    Valor de la celda (fila, columna) del encabezado leído sin títulos, o None si la hoja no llega hasta ahí
+    """
+    if fila < encabezado.shape[0] and columna < encabezado.shape[1]:
+        return encabezado.iat[fila, columna]
+    return None
+
+
+def process_attachment(df, unit, payload=None):
     """
     Esta función debe tomar el archivo descargado y parsearlo para obtener la información
-    Luego grabar ese df en la base de datos
+    Luego agregar ese df a la unidad de trabajo, para grabarlo en la base de datos
     """
+    diaria, cuarentena = valida_diaria(parse_attachment(df, payload), unit.db)
+    add_diaria(diaria, unit, cuarentena)
 
-    # Leer el archivo
-    diaria = pd.read_excel(os.path.join(ATTACH_DIR,df.iloc[0,3]), skiprows=4, usecols = "A:K")
+
+def valida_diaria(diaria, db):
+    """
+    Valida las filas de la planilla contra los últimos valores grabados. Devuelve (diaria, cuarentena): las
+    filas buenas y las marcadas. Sin validador devuelve la planilla entera y cuarentena None
+    """
+    if validador is None:
+        return diaria, None
+    with db.connection() as conn:
+        try:
+            return validador.valida(diaria, conn)
+        except Exception:
+            # puede haber recordado parte del lote como últimos valores
+            validador.reinicia()
+            raise
+
+
+def add_diaria(diaria, unit, cuarentena=None):
+    """
+    Agrega a la unidad de trabajo las filas ya validadas de la planilla: las buenas para diariaFIMA y
+    las marcadas para cuarentenaFIMA
+    """
+    if cuarentena is not None:
+        unit.add(cuarentena, 'cuarentenaFIMA', schema = 'public')
+        # si no se llega a grabar, los últimos valores en memoria quedan desactualizados
+        unit.on_rollback(validador.reinicia)
+    unit.add(diaria, 'diariaFIMA', schema = 'public')
+
+
+def parse_attachment(df, payload=None):
+    """
+    Parsea el archivo de FIMA y devuelve el df listo para grabar en diariaFIMA.
+    Si se pasa payload (los bytes del adjunto) se parsea desde memoria, sin volver a leer el archivo del disco.
+    Lo que sale de la planilla se guarda en la cache de parseo, así volver a cargar el mismo adjunto no la relee
+    """
+
+    # Leemos el libro una sola vez (desde los bytes del mail si los tenemos, si no desde ATTACH_DIR)
+    source = payload if payload is not None else os.path.join(ATTACH_DIR, df.iloc[0,3])
+    diaria = cacheParseo.cacheado(source, 'fima', PARSER_VERSION, lambda: parse_workbook(source))
+
+    # Add the columns that come from the mail: the date parsed in the calling function and the mail id
+    diaria.insert(11, 'fechaCorrespondeParseada', df.iloc[0, 2])
+    diaria.insert(12, 'id', df.iloc[0, 4])
+    return diaria
+
+
+def parse_workbook(source):
+    """
+    Lee la planilla de FIMA (ruta o bytes) y devuelve la tabla con los tipos limpios y la fecha de la planilla,
+    sin las columnas que dependen del mail
+    """
+
+    # de un solo libro sacamos tanto la tabla como las celdas del encabezado donde viene la fecha
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with lectorExcel.abrir(source) as workbook:
+        diaria = workbook.parse(skiprows=4, usecols = "A:K")
+        encabezado = workbook.parse(header=None, nrows=3)
 
     nombresColumna = [
         'tipoFondo',
@@ -152,14 +834,11 @@ def process_attachment(df):
         'calificacion'
     ]
     diaria.columns = nombresColumna
-    # Add a column with the date parsed in the calling function
-    diaria['fechaCorrespondeParseada'] = df.iloc[0, 2]
-    diaria['id'] = df.iloc[0, 4]
     # La fecha puede venir en K2 (más usual) pero también en H2 o H3 (la he visto en esos dos también). 
     # Esta forma captura las 3 celdas y luego asigna a date_value aquella que no es nula. Si no hay nada, pasará con null.
-    date_value1 = pd.read_excel(os.path.join(ATTACH_DIR, df.iloc[0,3]), usecols="K", nrows=2, header=None).iloc[1,0]
-    date_value2 = pd.read_excel(os.path.join(ATTACH_DIR, df.iloc[0,3]), usecols="H", nrows=2, header=None).iloc[1,0]
-    date_value3 = pd.read_excel(os.path.join(ATTACH_DIR, df.iloc[0,3]), usecols="H", nrows=3, header=None).iloc[1,0]
+    date_value1 = celda(encabezado, 1, 10)  # K2
+    date_value2 = celda(encabezado, 1, 7)   # H2
+    date_value3 = celda(encabezado, 2, 7)   # H3
     date_value = next((val for val in [date_value1, date_value2, date_value3] if pd.notna(val)), None)
     diaria['fechaPlanilla'] = date_value
 
@@ -190,7 +869,7 @@ def process_attachment(df):
             diaria[col] = diaria[col].astype(str).str.strip()
             diaria.loc[diaria[col].isin(['nan', 'None']), col] = pd.NA
 
-    diaria.to_sql(name = 'diariaFIMA', con = db.engine, index = False, schema = 'public', if_exists='append')
+    return diaria
     # la fecha máxima era 29-07-2025
     
 
@@ -205,12 +884,13 @@ if __name__ == "__main__":
     
     print(f"Iniciando chequeo de mails en la casilla data@outlier.com.ar a las {time.ctime()}")
 
-    db = DatabaseConnection(db_type="postgresql", db_name= os.environ.get('POSTGRES_DB'))
-    db.connect()
-
-    check_mail()
-
-
-    db.disconnect()
+    # una sola conexión (con su pool) para toda la corrida
+    with DatabaseConnection(db_type="postgresql", db_name= os.environ.get('POSTGRES_DB')) as db:
+        if IMAP_MODE == 'seq':
+            check_mail(db)
+        elif IMAP_MODE == 'idle':
+            watch_mail(db)
+        else:
+            check_mail_uid(db)
 
 
@@ -0,0 +1,379 @@
+"""
+Pruebas de la parte IMAP de fimaETL contra un servidor IMAP mínimo que corre en un thread local
+(ServidorIMAP): habla lo justo de IMAP4rev1 para lo que usan check_mail_uid, watch_mail e idle.
+
+    python -m pytest fimaETL_imap_test.py
+"""
+
+import base64
+import imaplib
+import json
+import os
+import re
+import socketserver
+import threading
+import time
+import pytest
+import sqlalchemy
+import fimaETL
+from datosSinteticos import libro_fima
+
+
+class ServidorIMAP(socketserver.ThreadingTCPServer):
+    """
+    Casilla en memoria: mensajes {uid: {'subject', 'date', 'bodystructure', 'partes': {número: bytes}}}.
+    Los mensajes movidos quedan en carpetas {carpeta: {uid: mensaje}}.
+    Con idle_exists, al recibir IDLE manda la continuación y un EXISTS en el mismo paquete
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, mensajes=None, capacidades='IMAP4rev1 IDLE MOVE UIDPLUS', idle_exists=False):
+        super().__init__(('127.0.0.1', 0), ManejadorIMAP)
+        self.mensajes = dict(mensajes or {})
+        self.carpetas = {}
+        self.capacidades = capacidades
+        self.idle_exists = idle_exists
+        self.comandos = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def puerto(self):
+        return self.server_address[1]
+
+    def conecta(self):
+        mail = imaplib.IMAP4('127.0.0.1', self.puerto)
+        mail.login('usuario', 'clave')
+        mail.select('inbox')
+        return mail
+
+    def __exit__(self, *args):
+        self.shutdown()
+        super().__exit__(*args)
+
+
+class ManejadorIMAP(socketserver.StreamRequestHandler):
+
+    def manda(self, *lineas):
+        # todas las líneas en un solo send, como las puede juntar el servidor real
+        self.wfile.write(b''.join(l if isinstance(l, bytes) else l.encode() + b'\r\n' for l in lineas))
+        self.wfile.flush()
+
+    def handle(self):
+        servidor = self.server
+        self.manda(f"* OK [CAPABILITY {servidor.capacidades}] listo")
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            tag, comando, *resto = linea.decode().rstrip('\r\n').split(' ', 2)
+            comando = comando.upper()
+            args = resto[0] if resto else ''
+            if comando == 'UID':
+                comando, _, args = args.partition(' ')
+                comando = 'UID ' + comando.upper()
+            servidor.comandos.append(f"{comando} {args}")
+
+            if comando == 'CAPABILITY':
+                self.manda(f"* CAPABILITY {servidor.capacidades}", f"{tag} OK CAPABILITY")
+            elif comando in ('LOGIN', 'NOOP', 'CLOSE', 'CREATE'):
+                self.manda(f"{tag} OK {comando}")
+            elif comando == 'SELECT':
+                self.manda(f"* {len(servidor.mensajes)} EXISTS", "* OK [UIDVALIDITY 42] UIDs",
+                           f"{tag} OK [READ-WRITE] SELECT")
+            elif comando == 'LOGOUT':
+                self.manda("* BYE chau", f"{tag} OK LOGOUT")
+                return
+            elif comando == 'IDLE':
+                self.idle(tag)
+            elif comando == 'UID SEARCH':
+                desde = int(re.search(r'UID (\d+):\*', args).group(1))
+                uids = [uid for uid in sorted(servidor.mensajes) if uid >= desde]
+                # como los servidores reales, n:* incluye siempre el último mensaje
+                if not uids and servidor.mensajes:
+                    uids = [max(servidor.mensajes)]
+                self.manda(f"* SEARCH {' '.join(map(str, uids))}".rstrip(), f"{tag} OK SEARCH")
+            elif comando == 'UID FETCH':
+                self.fetch(tag, args)
+            elif comando in ('UID MOVE', 'UID COPY'):
+                uids, _, destino = args.partition(' ')
+                for uid in map(int, uids.split(',')):
+                    if comando == 'UID MOVE' and uid in servidor.mensajes:
+                        servidor.carpetas.setdefault(destino, {})[uid] = servidor.mensajes.pop(uid)
+                self.manda(f"{tag} OK {comando}")
+            else:
+                self.manda(f"{tag} BAD no entiendo {comando}")
+
+    def idle(self, tag):
+        if self.server.idle_exists:
+            self.manda("+ idling", f"* {len(self.server.mensajes) + 1} EXISTS")
+        else:
+            self.manda("+ idling")
+        while self.rfile.readline().strip().upper() != b'DONE':
+            pass
+        self.manda(f"{tag} OK IDLE terminado")
+
+    def fetch(self, tag, args):
+        uids, _, items = args.partition(' ')
+        salida = []
+        for i, uid in enumerate(int(u) for u in uids.split(',')):
+            mensaje = self.server.mensajes.get(uid)
+            if mensaje is None:
+                continue
+            campos = [f"UID {uid}".encode()]
+            if 'BODYSTRUCTURE' in items:
+                campos.append(f"BODYSTRUCTURE {mensaje['bodystructure']}".encode())
+            if 'HEADER.FIELDS' in items:
+                encabezado = f"Subject: {mensaje['subject']}\r\nDate: {mensaje['date']}\r\n\r\n".encode()
+                campos.append(b"BODY[HEADER.FIELDS (SUBJECT DATE)] {%d}\r\n%s" % (len(encabezado), encabezado))
+            parte = re.search(r'BODY\.PEEK\[([\d.]+)\]', items)
+            if parte:
+                cuerpo = mensaje['partes'][parte.group(1)]
+                campos.append(b"BODY[%s] {%d}\r\n%s" % (parte.group(1).encode(), len(cuerpo), cuerpo))
+            salida.append(b"* %d FETCH (%s)\r\n" % (i + 1, b' '.join(campos)))
+        self.manda(*salida, f"{tag} OK FETCH")
+
+
+@pytest.fixture
+def servidor(request):
+    opciones = getattr(request, 'param', {})
+    with ServidorIMAP(**opciones) as servidor:
+        yield servidor
+
+
+@pytest.mark.parametrize('servidor', [{'idle_exists': True}], indirect=True)
+def test_idle_ve_el_exists_que_llega_con_la_continuacion(servidor):
+    # el EXISTS queda en el buffer de readline junto con "+ idling": select no lo ve en el socket
+    mail = servidor.conecta()
+    inicio = time.monotonic()
+    assert fimaETL.idle(mail, timeout=10)
+    assert time.monotonic() - inicio < 2
+    mail.logout()
+
+
+def test_idle_sin_novedades_respeta_el_timeout(servidor):
+    mail = servidor.conecta()
+    inicio = time.monotonic()
+    assert not fimaETL.idle(mail, timeout=0.5)
+    assert 0.4 < time.monotonic() - inicio < 3
+    # la conexión sigue usable después del IDLE
+    assert mail.noop()[0] == 'OK'
+    mail.logout()
+
+
+TEXTO = '("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 12 1 NIL NIL NIL NIL)'
+
+
+def adjunto(nombre):
+    return (f'("APPLICATION" "VND.MS-EXCEL" ("NAME" "{nombre}") NIL NIL "BASE64" 1000 NIL '
+            f'("ATTACHMENT" ("FILENAME" "{nombre}")) NIL NIL)')
+
+
+def mensaje(subject, contenido=None, nombre='fima.xlsx', anidado=False):
+    """
+    Mail de FIMA: texto y, si hay contenido, la planilla adjunta en base64 (en la parte 2, o en la 1.2 si anidado)
+    """
+    if contenido is None:
+        estructura, partes = TEXTO, {}
+    elif anidado:
+        estructura = f'(({TEXTO}{adjunto(nombre)} "MIXED" ("BOUNDARY" "b2") NIL NIL NIL){TEXTO} "MIXED" ("BOUNDARY" "b1") NIL NIL NIL)'
+        partes = {'1.2': base64.encodebytes(contenido)}
+    else:
+        estructura = f'({TEXTO}{adjunto(nombre)} "MIXED" ("BOUNDARY" "b1") NIL NIL NIL)'
+        partes = {'2': base64.encodebytes(contenido)}
+    return {'subject': subject, 'date': 'Fri, 16 Oct 2026 19:30:00 -0300', 'bodystructure': estructura, 'partes': partes}
+
+
+def test_parse_fetch_response_y_find_attachment_parts():
+    # así devuelve imaplib un FETCH con un literal: tupla (encabezado, literal) y el resto de la línea aparte
+    data = [
+        (b'1 (UID 12 BODYSTRUCTURE ' + mensaje('x', b'x', nombre='=?utf-8?B?UGxhbmlsbGEgw7EueGxz?=',
+                                               anidado=True)['bodystructure'].encode()
+         + b' BODY[HEADER.FIELDS (SUBJECT DATE)] {18}', b'Subject: "hola"\r\n\r\n'),
+        b')',
+    ]
+    campos = fimaETL.parse_fetch_response(data)[12]
+    assert campos['BODY[HEADER.FIELDS (SUBJECT DATE)]'] == b'Subject: "hola"\r\n\r\n'
+    assert fimaETL.find_attachment_parts(campos['BODYSTRUCTURE']) == [('1.2', 'Planilla ñ.xls', 'base64')]
+    # un mensaje de una sola parte sin adjunto
+    assert fimaETL.find_attachment_parts(fimaETL.parse_fetch_response([b'2 (UID 13 BODYSTRUCTURE ' + TEXTO.encode() + b')'])[13]['BODYSTRUCTURE']) == []
+
+
+@pytest.mark.parametrize('servidor', [{'mensajes': {
+    3: mensaje('Informe diario 16/10/2026', b'planilla 3'),
+    6: mensaje('Informe diario 16-10-26', b'planilla 6', nombre='otra.xls', anidado=True),
+    7: mensaje('Sin adjunto'),
+}}], indirect=True)
+def test_fetch_new_messages_y_fetch_parts(servidor):
+    mail = servidor.conecta()
+    mensajes = fimaETL.fetch_new_messages(mail, 2)
+    assert {uid: m['parts'] for uid, m in mensajes.items()} == {
+        3: [('2', 'fima.xlsx', 'base64')], 6: [('1.2', 'otra.xls', 'base64')], 7: [],
+    }
+    assert mensajes[6]['subject'] == 'Informe diario 16-10-26'
+    assert fimaETL.fetch_parts(mail, {3: ('2', 'base64'), 6: ('1.2', 'base64')}) == {3: b'planilla 3', 6: b'planilla 6'}
+    # UID 8:* devuelve igual el último mensaje, que no es nuevo
+    assert fimaETL.fetch_new_messages(mail, 7) == {}
+    mail.logout()
+
+
+@pytest.fixture
+def casilla(db, monkeypatch, tmp_path):
+    """
+    fimaETL apuntando a directorios temporales, sin validación, y una base SQLite
+    """
+    (tmp_path / 'adjuntos').mkdir()
+    monkeypatch.setattr(fimaETL, 'ATTACH_DIR', str(tmp_path / 'adjuntos'))
+    monkeypatch.setattr(fimaETL, 'UID_STATE_FILE', str(tmp_path / 'uid.json'))
+    monkeypatch.setattr(fimaETL, '_stored_hashes', None)
+    monkeypatch.setattr(fimaETL, 'validador', None)
+    monkeypatch.setattr(fimaETL.cacheParseo, 'PARSE_CACHE_DIR', str(tmp_path / 'cache'))
+    return db
+
+
+def corre(servidor, db, monkeypatch):
+    monkeypatch.setattr(fimaETL, 'connect_mail', lambda: (servidor.conecta(), '42'))
+    fimaETL.check_mail_uid(db)
+    with open(fimaETL.UID_STATE_FILE) as f:
+        return json.load(f)['last_uid']
+
+
+@pytest.mark.parametrize('servidor', [{'mensajes': {
+    3: mensaje('Informe diario 16/10/2026', libro_fima(5)),
+    4: mensaje('Informe diario', libro_fima(6)),
+    5: mensaje('Informe diario 32/13/2026', libro_fima(7)),
+    6: mensaje('Informe diario 17/10/2026', libro_fima(8)),
+    7: mensaje('Sin adjunto'),
+}}], indirect=True)
+def test_check_mail_uid_saca_los_mails_sin_fecha(servidor, casilla, monkeypatch):
+    assert corre(servidor, casilla, monkeypatch) == 7
+    assert sorted(servidor.carpetas[fimaETL.destination_folder]) == [3, 6]
+    assert sorted(servidor.carpetas[fimaETL.ERROR_FOLDER]) == [4, 5]
+    # los adjuntos de los mails sin fecha ni se bajan
+    bajados = [c.split()[2] for c in servidor.comandos if re.search(r'BODY\.PEEK\[\d', c)]
+    assert bajados and not {'4', '5'} & {uid for uids in bajados for uid in uids.split(',')}
+    with casilla.connection() as conn:
+        filas = conn.execute(sqlalchemy.text('SELECT count(*) FROM "diariaFIMA"')).scalar()
+    assert filas == 5 + 8
+
+    # la corrida siguiente no tiene nada nuevo y la marca queda donde estaba
+    assert corre(servidor, casilla, monkeypatch) == 7
+
+
+@pytest.mark.parametrize('servidor', [{'mensajes': {
+    3: mensaje('Informe diario 16/10/2026', libro_fima(5)),
+    4: mensaje('Informe diario 17/10/2026', b'no es una planilla'),
+    5: mensaje('Informe diario 18/10/2026', libro_fima(7)),
+}}], indirect=True)
+def test_check_mail_uid_reintenta_un_adjunto_que_fallo(servidor, casilla, monkeypatch):
+    # un adjunto que no se pudo leer sí se reintenta: la marca queda antes de él y el mail sigue en INBOX
+    assert corre(servidor, casilla, monkeypatch) == 3
+    assert sorted(servidor.mensajes) == [4]
+    assert fimaETL.ERROR_FOLDER not in servidor.carpetas
+
+
+@pytest.mark.parametrize('servidor', [{'mensajes': {
+    3: mensaje('Informe diario 16/10/2026', libro_fima(5)),
+    4: mensaje('Informe diario 17/10/2026', libro_fima(6)),
+    5: mensaje('Informe diario 18/10/2026', libro_fima(7)),
+}}], indirect=True)
+def test_watch_mail_reintenta_en_la_sesion_un_mensaje_que_fallo(servidor, casilla, monkeypatch):
+    # el 4 falla la primera vez: se reintenta sin reconectar y la marca no lo pasa hasta que se graba
+    monkeypatch.setattr(fimaETL, 'connect_mail', lambda: (servidor.conecta(), '42'))
+    monkeypatch.setattr(fimaETL, 'RETRY_INTERVAL', 0)
+    monkeypatch.setattr(fimaETL, 'PENDING_POLL_INTERVAL', 0.05)
+    handle_message = fimaETL.handle_message
+    intentos = []
+
+    def falla_el_primer_intento(uid, message, payload, unit):
+        intentos.append(uid)
+        if intentos.count(uid) == 1 and uid == 4:
+            return False
+        return handle_message(uid, message, payload, unit)
+    monkeypatch.setattr(fimaETL, 'handle_message', falla_el_primer_intento)
+    marcas = []
+    save_uid_state = fimaETL.save_uid_state
+
+    def guarda(uidvalidity, last_uid):
+        marcas.append(last_uid)
+        save_uid_state(uidvalidity, last_uid)
+    monkeypatch.setattr(fimaETL, 'save_uid_state', guarda)
+    vueltas = []
+
+    def espera(mail, timeout):
+        # cortamos cuando ya no queda nada en INBOX, o a las 100 vueltas
+        vueltas.append(timeout)
+        if not servidor.mensajes or len(vueltas) == 100:
+            raise KeyboardInterrupt
+        time.sleep(timeout)
+    monkeypatch.setattr(fimaETL, 'idle', espera)
+
+    fimaETL.watch_mail(casilla)
+    assert intentos.count(4) == 2
+    assert sorted(servidor.carpetas[fimaETL.destination_folder]) == [3, 4, 5]
+    assert cuenta(casilla, 'diariaFIMA') == 5 + 6 + 7
+    # mientras el 4 no se grabó la marca quedó antes de él
+    assert max(marcas[:marcas.index(5)]) <= 3 and marcas[-1] == 5
+    # y se reintentó sin volver a conectarse
+    assert sum(c.startswith('LOGIN') for c in servidor.comandos) == 1
+
+
+def cuenta(db, tabla):
+    # filas de la tabla, 0 si todavía no existe
+    if not sqlalchemy.inspect(db.engine).has_table(tabla):
+        return 0
+    with db.connection() as conn:
+        return conn.execute(sqlalchemy.text(f'SELECT count(*) FROM "{tabla}"')).scalar()
+
+
+class ValidadorQueFalla:
+
+    def __init__(self):
+        self.reinicios = 0
+
+    def valida(self, diaria, conn):
+        raise ValueError('no se pudieron leer los últimos valores')
+
+    def reinicia(self):
+        self.reinicios += 1
+
+
+def test_handle_message_no_graba_el_mail_si_falla_la_validacion(casilla, monkeypatch):
+    planilla = libro_fima(5)
+    datos = {'subject': 'Informe diario 16/10/2026', 'date': 'Fri, 16 Oct 2026 19:30:00 -0300',
+             'parts': [('2', 'fima.xlsx', 'base64')]}
+    validador = ValidadorQueFalla()
+    monkeypatch.setattr(fimaETL, 'validador', validador)
+    with casilla.ingestion() as unit:
+        assert not fimaETL.handle_message(3, datos, planilla, unit)
+    assert cuenta(casilla, 'archivosFIMA') == 0
+    assert cuenta(casilla, 'diariaFIMA') == 0
+    assert os.listdir(fimaETL.ATTACH_DIR) == []
+    assert validador.reinicios == 1
+
+    # al reintentarlo queda un solo registro del mail, con sus filas
+    monkeypatch.setattr(fimaETL, 'validador', None)
+    with casilla.ingestion() as unit:
+        assert fimaETL.handle_message(3, datos, planilla, unit)
+    assert cuenta(casilla, 'archivosFIMA') == 1
+    assert cuenta(casilla, 'diariaFIMA') == 5
+
+
+def test_handle_message_descarta_lo_agregado_si_falla_despues_del_mail(casilla, monkeypatch):
+    # el segundo mensaje falla con el registro del mail ya agregado a la unidad: solo se graba el primero
+    datos = {'date': 'Fri, 16 Oct 2026 19:30:00 -0300', 'parts': [('2', 'fima.xlsx', 'base64')]}
+    add_diaria = fimaETL.add_diaria
+
+    def falla_la_segunda(diaria, unit, cuarentena=None):
+        if len(diaria) == 6:
+            raise ValueError('no se pudo agregar la planilla')
+        add_diaria(diaria, unit, cuarentena)
+    monkeypatch.setattr(fimaETL, 'add_diaria', falla_la_segunda)
+    with casilla.ingestion() as unit:
+        assert fimaETL.handle_message(3, dict(datos, subject='Informe diario 16/10/2026'), libro_fima(5), unit)
+        assert not fimaETL.handle_message(4, dict(datos, subject='Informe diario 17/10/2026'), libro_fima(6), unit)
+    assert cuenta(casilla, 'archivosFIMA') == 1
+    assert cuenta(casilla, 'diariaFIMA') == 5
+    assert len(os.listdir(fimaETL.ATTACH_DIR)) == 1
+    # el hash del adjunto que falló no quedó como procesado
+    assert len(fimaETL.stored_hashes()) == 1
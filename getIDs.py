@@ -5,10 +5,8 @@ con los nuevos registros que se hayan cargado en la página de la CNV.
 
 import time
 import pandas as pd
-import locale
 import os
 from io import StringIO
-from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
@@ -17,29 +15,82 @@ from selenium.webdriver.chrome.options import Options
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import TimeoutException, WebDriverException
 from DataBaseConn import DatabaseConnection
+from tablaCNV import extraeTabla, extraeFilas, parseaFechas
+from fechas import parseaFecha
+from selenium.webdriver.support.ui import WebDriverWait
+import sqlalchemy
+
+CNV_URL = 'https://www.cnv.gov.ar/SitioWeb/FondosComunesInversion/CuotaPartes'
+# segundos que esperamos a que aparezcan filas nuevas después de cada "VER MÁS"
+VER_MAS_TIMEOUT = float(os.environ.get('CNV_VER_MAS_TIMEOUT', '10'))
+# con CNV_LISTADO_COMPLETO=1 se expande la lista entera, como antes
+LISTADO_COMPLETO = os.environ.get('CNV_LISTADO_COMPLETO', '0') == '1'
+# las filas de la tabla de archivos (la primera de la página), en orden del documento
+FILAS_XPATH = "((//table)[1]//tr)"
+
+def alcanzoLoConocido(df, db=None, desde=None):
+    """
+    Indica si la tabla cargada hasta ahora ya llega a archivos conocidos: algún ID que ya está en archivosCAFCI
+    o alguna fecha de recepción anterior a `desde`. Como la lista viene de más nuevo a más viejo, a partir de ahí
+    todo lo que falta cargar ya lo tenemos
+    """
+    if df is None or df.empty:
+        return False
+
+    if desde is not None:
+        recepcion = parseaFecha(df['fechaRecepcion'], errors='coerce')
+        if (recepcion < pd.Timestamp(desde)).any():
+            return True
+
+    if db is not None and tablaExiste(db):
+        if existing_IDs(db, df['ID']):
+            return True
+
+    return False
 
-def getTablaFromURL():
+
+def filasNuevas(driver, vistas):
     """
-    Get the table from the URL and return a DataFrame with the data
+    Las filas de la tabla que están después de las primeras `vistas`, como DataFrame, y la cantidad de filas que
+    ya vimos. Solo se piden al navegador y se parsean esas filas, no la página entera
     """
-    locale.setlocale(locale.LC_TIME, 'es_ES')
-    try:
-        # Set up Selenium WebDriver
-        options = Options()
-        options.add_argument('--headless')  # Ensure headless mode is enabled
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        
-        # Optional: For better stability in headless mode, you might want to add:
-        options.add_argument('--disable-gpu')
-        options.add_argument('start-maximized')
-        options.add_argument('disable-infobars')
-        options.add_argument('--disable-extensions')
+    filas = driver.find_elements(By.XPATH, f"{FILAS_XPATH}[position() > {vistas}]")
+    return extraeFilas(''.join(fila.get_attribute('outerHTML') for fila in filas)), vistas + len(filas)
 
-        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+
+def chromeHeadless():
+    """
+    Chrome headless para leer la página de la CNV
+    """
+    # Set up Selenium WebDriver
+    options = Options()
+    options.add_argument('--headless')  # Ensure headless mode is enabled
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+
+    # Optional: For better stability in headless mode, you might want to add:
+    options.add_argument('--disable-gpu')
+    options.add_argument('start-maximized')
+    options.add_argument('disable-infobars')
+    options.add_argument('--disable-extensions')
+
+    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+
+
+def getTablaFromURL(db=None, desde=None, max_clicks=None, driver=None):
+    """
+    Get the table from the URL and return a DataFrame with the data.
+    Si se pasa db (o desde, una fecha de recepción), después de cada "VER MÁS" mira las filas nuevas y deja de
+    expandir la lista apenas aparece un ID que ya está en archivosCAFCI (o un archivo recibido antes de desde).
+    Sin db ni desde, expande la lista completa. max_clicks limita la cantidad de clicks.
+    driver es un WebDriver ya creado; si no se pasa se abre un Chrome headless
+    """
+    try:
+        if driver is None:
+            driver = chromeHeadless()
 
         # URL of the webpage
-        url = 'https://www.cnv.gov.ar/SitioWeb/FondosComunesInversion/CuotaPartes'
+        url = CNV_URL
         
 
         # Load the webpage
@@ -48,14 +99,29 @@ def getTablaFromURL():
         driver.get(url)
         print(f"Página cargada")
 
+        incremental = db is not None or desde is not None
+        clicks = 0
+        # filas de la tabla que ya miramos (la primera es la de títulos): después de cada click solo se miran las nuevas
+        vistas = 1
+
         # Click the "VER MÁS" button
         print("Haciendo click en 'VER MÁS' para expandir la lista de archivos disponibles.")
-        while True:
+        while max_clicks is None or clicks < max_clicks:
+            if incremental:
+                nuevas, vistas = filasNuevas(driver, vistas)
+                if alcanzoLoConocido(nuevas, db, desde):
+                    print("La lista ya llega a archivos que teníamos. No expandimos más.")
+                    break
             try:
+                filas = len(driver.find_elements(By.XPATH, "//table//tr"))
                 ver_mas_button = driver.find_element(By.XPATH, "//span[@class='btn btn-leer-mas']")
                 ActionChains(driver).move_to_element(ver_mas_button).click(ver_mas_button).perform()
+                clicks += 1
                 print("Boton presionado. Esperando que cargue el contenido...")
-                time.sleep(2)  # Wait for more content to load
+                # Wait for more content to load: esperamos a que aparezcan filas nuevas en lugar de un tiempo fijo
+                WebDriverWait(driver, VER_MAS_TIMEOUT).until(
+                    lambda d: len(d.find_elements(By.XPATH, "//table//tr")) > filas
+                )
             except:
                 print("Continuando a carga de tabla")
                 break
@@ -64,55 +130,13 @@ def getTablaFromURL():
         page_source = driver.page_source
         driver.quit()
 
-        # Parse the HTML content with BeautifulSoup
-        soup = BeautifulSoup(page_source, 'lxml')
-
-        # Find the table in the HTML
-        table = soup.find('table')
-        if table is None:
+        df = extraeTabla(page_source)
+        if df is None:
             print("No encontré ninguna tabla en la página.")
             return
         print("Recorriendo la tabla para extraer los datos...")
-        # Extract data from the table
-        rows = table.find_all('tr')[1:]  # Skip the header row
-        fechas_documento = []
-        fechas_recepcion = []
-        descripciones = []
-        ids = []
-        hrefs = []
-
-        for row in rows:
-            cells = row.find_all('td')
-            if len(cells) == 4:
-                a_tag = cells[0].find('a')
-                if a_tag:
-                    fechas_documento.append(a_tag.text.strip())
-                    hrefs.append(a_tag['href'].strip())
-                else:
-                    fechas_documento.append(cells[0].text.strip())
-                    hrefs.append(None)
-
-                fechas_recepcion.append(cells[1].text.strip())
-                descripciones.append(cells[2].text.strip())
-                ids.append(cells[3].text.strip())
-
-        # Create DataFrame
-        df = pd.DataFrame({
-            'fechaCorresponde': fechas_documento,
-            'fechaRecepcion': fechas_recepcion,
-            'descripcion': descripciones,
-            'ID': ids,
-            'href': hrefs,
-            'descargado': False
-        })
-
-        # Convert first and second column of df into datetime. format is 3 jun 2024
-        df.iloc[:, 0] = pd.to_datetime(df.iloc[:, 0], format='%d %b %Y')
-        df.iloc[:, 1] = pd.to_datetime(df.iloc[:, 1], format='%d %b %Y %H:%M')
-
-        # Add a column with the date parsed from the 2nd column of the df
-        df['fechaCorrespondeParseada'] = df.iloc[:, 2].apply(lambda x: x.split(" al")[1].strip())
-        df['fechaCorrespondeParseada'] = pd.to_datetime(df['fechaCorrespondeParseada'], format='%d %b. %Y')
+
+        df = parseaFechas(df)
 
         print("Tabla obtenida correctamente.")
 
@@ -121,39 +145,92 @@ def getTablaFromURL():
     except Exception as e:
         print(f"Ocurrió un error: {e}")
         
-def grabaTabla(df):
+def tablaExiste(db):
+    """
+    Indica si archivosCAFCI ya fue creada (en el schema public en PostgreSQL)
+    """
+    schema = 'public' if db.db_type == 'postgresql' else None
+    return sqlalchemy.inspect(db.engine).has_table('archivosCAFCI', schema=schema)
+
+
+def ensure_ID_index(db):
+    """
+    Crea (si no existe) un índice único sobre "ID" en archivosCAFCI, así buscar si un ID ya está grabado
+    no obliga a recorrer toda la tabla
+    """
+    query = 'CREATE UNIQUE INDEX IF NOT EXISTS "archivosCAFCI_ID_idx" ON "archivosCAFCI" ("ID")'
+    try:
+        with db.begin() as conn:
+            conn.execute(sqlalchemy.text(query))
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        # por ejemplo si la tabla ya tiene IDs duplicados. Seguimos igual, solo que sin índice
+        print(f"No se pudo crear el índice sobre ID en archivosCAFCI: {e}")
+
+
+def existing_IDs(db, ids, chunk_size=1000):
+    """
+    Devuelve el set de IDs, de entre los que recibe, que ya están grabados en archivosCAFCI.
+    Solo consulta esos IDs, así el costo depende del tamaño de lo bajado y no del de la tabla
+    """
+    query = sqlalchemy.text('SELECT "ID" FROM "archivosCAFCI" WHERE "ID" IN :ids').bindparams(
+        sqlalchemy.bindparam('ids', expanding=True)
+    )
+    ids = list(dict.fromkeys(ids))
+    found = set()
+    with db.connection() as conn:
+        for start in range(0, len(ids), chunk_size):
+            result = conn.execute(query, {'ids': ids[start:start + chunk_size]})
+            found.update(row[0] for row in result)
+    return found
+
+
+def grabaTabla(df, db=None):
     """
     vamos a grabar la tabla pero verificando primero que no haya registros duplicados
     """
-    db = DatabaseConnection(db_type="postgresql", db_name= os.environ.get('POSTGRES_DB'))
-    db.connect()
-    # chequeamos si hay registros duplicados
-    query = 'SELECT * FROM "archivosCAFCI"'
-    df_db = pd.read_sql(query, db.engine)
-    if df_db.empty:
+    if df is None or df.empty:
+        print("No hay registros para grabar.")
+        return
+
+    propia = db is None
+    if propia:
+        db = DatabaseConnection(db_type="postgresql", db_name= os.environ.get('POSTGRES_DB'))
+        db.connect()
+    # con el índice único sobre ID, un ID repetido en la página haría fallar toda la carga
+    repetidos = df['ID'].duplicated()
+    if repetidos.any():
+        print(f"La tabla obtenida de la web tiene {repetidos.sum()} IDs repetidos. Grabamos una sola vez cada uno")
+        df = df[~repetidos]
+    # chequeamos si hay registros duplicados, consultando solo los IDs que bajamos
+    if not tablaExiste(db):
         print(f"La tabla está vacía, grabando...")
-        df.to_sql(name = 'archivosCAFCI', con = db.engine, index = False, schema = 'public')
+        db.bulk_load(df, 'archivosCAFCI', schema = 'public')
+        ensure_ID_index(db)
     else:
-        print(f"La tabla almacenada en la base de datos tiene {df_db.shape[0]} registros")
+        ensure_ID_index(db)
         print(f"La tabla obtenida de la web tiene {df.shape[0]} registros")
-        df = df[~df['ID'].isin(df_db['ID'])]
+        df = df[~df['ID'].isin(existing_IDs(db, df['ID']))]
         if df.empty:
             print(f"No hay registros nuevos para grabar. Todos los IDs ya estaban en la base de datos.")
         else:
             print(f"Grabando {df.shape[0]} registros nuevos...")
-            df.to_sql(name = 'archivosCAFCI', con = db.engine, index = False, schema = 'public', if_exists='append')
+            db.bulk_load(df, 'archivosCAFCI', schema = 'public')
 
-    db.disconnect() 
+    if propia:
+        db.close()
 
 if __name__ == "__main__":
     print(f"Iniciando obtención de IDs de la página de CNV a las {time.ctime()}")
 
-    # baja la tabla y la devuelve en un dataframe
-    tabla = getTablaFromURL()
+    with DatabaseConnection(db_type="postgresql", db_name= os.environ.get('POSTGRES_DB')) as db:
+
+        # baja la tabla y la devuelve en un dataframe. Salvo que se pida la lista completa,
+        # deja de expandirla cuando llega a IDs que ya están en la base de datos
+        tabla = getTablaFromURL(db=None if LISTADO_COMPLETO else db)
 
-    # grabamos la tabla en la base de datos
-    print(f"Grabando tabla en la base de datos...")
-    grabaTabla(tabla)
+        # grabamos la tabla en la base de datos
+        print(f"Grabando tabla en la base de datos...")
+        grabaTabla(tabla, db)
 
     print(f"Proceso finalizado a las {time.ctime()}")
-    print("-----------------------------------------------------------------")
\ No newline at end of file
+    print("-----------------------------------------------------------------")
@@ -0,0 +1,148 @@
+"""
+Pruebas de getIDs.getTablaFromURL contra una copia local de la lista de la CNV: el servidor HTTP de conftest.py
+(fixture cnv) sirve la página con la primera tanda de filas y las tandas siguientes, y un navegador mínimo
+(Navegador) que hace de WebDriver sobre lxml: "VER MÁS" pide la tanda siguiente y la agrega a la tabla, como el
+JavaScript de la página. Y grabaTabla con IDs repetidos sobre una base SQLite temporal.
+
+    python -m pytest getIDs_test.py
+"""
+
+import urllib.request
+import pandas as pd
+import pytest
+import sqlalchemy
+from lxml import html
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+import getIDs
+
+
+class Elemento:
+
+    def __init__(self, navegador, nodo):
+        self.navegador = navegador
+        self.nodo = nodo
+
+    def get_attribute(self, nombre):
+        if nombre == 'outerHTML':
+            return html.tostring(self.nodo, encoding='unicode', with_tail=False)
+        return self.nodo.get(nombre)
+
+    def click(self):
+        if 'btn-leer-mas' in self.nodo.get('class', ''):
+            self.navegador.ver_mas(self.nodo)
+
+
+class Navegador:
+    """
+    Lo que getTablaFromURL usa de un WebDriver: get, find_element(s) por XPath, page_source y quit
+    """
+
+    def __init__(self):
+        self.arbol = None
+        self.tanda = 0
+
+    def get(self, url):
+        self.url = url
+        with urllib.request.urlopen(url) as respuesta:
+            self.arbol = html.fromstring(respuesta.read().decode())
+
+    def ver_mas(self, boton):
+        self.tanda += 1
+        with urllib.request.urlopen(f'{self.url}?tanda={self.tanda}') as respuesta:
+            filas = html.fromstring(respuesta.read().decode()).xpath('//tr')
+            ultima = respuesta.headers['X-Ultima'] == '1'
+        self.arbol.xpath('(//table)[1]/tbody')[0].extend(filas)
+        if ultima:
+            boton.getparent().remove(boton)
+
+    def find_elements(self, by, xpath):
+        assert by == By.XPATH
+        return [Elemento(self, nodo) for nodo in self.arbol.xpath(xpath)]
+
+    def find_element(self, by, xpath):
+        elementos = self.find_elements(by, xpath)
+        if not elementos:
+            raise NoSuchElementException(xpath)
+        return elementos[0]
+
+    @property
+    def page_source(self):
+        return html.tostring(self.arbol, encoding='unicode')
+
+    def quit(self):
+        pass
+
+
+class Acciones:
+    # ActionChains sobre el Navegador: el click va directo al elemento
+
+    def __init__(self, driver):
+        self.elemento = None
+
+    def move_to_element(self, elemento):
+        return self
+
+    def click(self, elemento):
+        self.elemento = elemento
+        return self
+
+    def perform(self):
+        self.elemento.click()
+
+
+@pytest.fixture
+def servidor(cnv, monkeypatch):
+    monkeypatch.setattr(getIDs, 'CNV_URL', cnv.lista_url)
+    monkeypatch.setattr(getIDs, 'ActionChains', Acciones)
+    return cnv
+
+
+@pytest.fixture
+def revisadas(monkeypatch):
+    # cuántas filas recibe alcanzoLoConocido en cada revisión
+    cantidades = []
+    original = getIDs.alcanzoLoConocido
+
+    def alcanzoLoConocido(df, db=None, desde=None):
+        cantidades.append(len(df))
+        return original(df, db, desde)
+    monkeypatch.setattr(getIDs, 'alcanzoLoConocido', alcanzoLoConocido)
+    return cantidades
+
+
+def test_para_al_llegar_a_un_ID_conocido(servidor, revisadas, db):
+    # ya teníamos hasta el 965, que está en la cuarta tanda
+    db.bulk_load(pd.DataFrame({'ID': [str(ID) for ID in range(900, 966)], 'descargado': True}), 'archivosCAFCI')
+    df = getIDs.getTablaFromURL(db=db, driver=Navegador())
+    assert servidor.tandas == [0, 1, 2, 3]
+    assert len(df) == 4 * servidor.por_tanda
+    assert df['ID'].iloc[0] == '1000'
+    # después de cada click solo se revisan las filas nuevas
+    assert revisadas == [servidor.por_tanda] * 4
+
+
+def test_para_al_llegar_a_la_fecha_desde(servidor, revisadas):
+    # el 975 se recibió el 7/5/24: la tanda 2 ya trae archivos anteriores
+    df = getIDs.getTablaFromURL(desde=pd.Timestamp(2024, 5, 8), driver=Navegador())
+    assert servidor.tandas == [0, 1, 2]
+    assert len(df) == 3 * servidor.por_tanda
+    assert revisadas == [servidor.por_tanda] * 3
+
+
+def test_sin_db_ni_desde_expande_todo(servidor, revisadas):
+    df = getIDs.getTablaFromURL(driver=Navegador())
+    assert servidor.tandas == list(range(servidor.cantidad_tandas))
+    assert len(df) == servidor.cantidad_tandas * servidor.por_tanda
+    assert df['fechaRecepcion'].iloc[-1] == pd.Timestamp(2024, 4, 3, 14, 35)
+    assert revisadas == []
+
+
+def test_grabaTabla_con_un_ID_repetido(db):
+    # la primera vez, con la tabla todavía sin crear, el 1 aparece dos veces
+    getIDs.grabaTabla(pd.DataFrame({'ID': ['1', '1'], 'descargado': True}), db)
+    # después el 3 aparece dos veces y el 1 ya estaba grabado: se graban 2 y 3, una vez cada uno
+    getIDs.grabaTabla(pd.DataFrame({'ID': ['1', '2', '3', '3'], 'descargado': False}), db)
+    with db.connection() as conn:
+        ids = conn.execute(sqlalchemy.text('SELECT "ID", descargado FROM "archivosCAFCI" ORDER BY "ID"')).fetchall()
+    assert [(ID, int(descargado)) for ID, descargado in ids] == [('1', 1), ('2', 0), ('3', 0)]
@@ -0,0 +1,92 @@
+"""
+Lectura de las planillas de CAFCI y FIMA. Los dos ETL abren los libros con abrir(), que elige el motor
+de pandas según EXCEL_ENGINE y, si el motor rápido no puede con un archivo, vuelve a intentar con el
+motor por defecto de pandas (openpyxl para xlsx, que ya lee en modo read-only, y xlrd para xls).
+"""
+
+import importlib.util
+import os
+import pandas as pd
+
+# 'auto' usa calamine si está instalado (pip install python-calamine); 'default' usa el motor por defecto
+# de pandas; cualquier otro valor se pasa tal cual como engine ('calamine', 'openpyxl', 'xlrd')
+EXCEL_ENGINE = os.environ.get('EXCEL_ENGINE', 'auto')
+
+
+def motores(engine=EXCEL_ENGINE):
+    """
+    Devuelve la lista de motores a probar, en orden. None es el motor por defecto de pandas,
+    que siempre queda al final como respaldo
+    """
+    if engine == 'auto':
+        engine = 'calamine' if importlib.util.find_spec('python_calamine') else None
+    elif engine in ('default', ''):
+        engine = None
+    return [engine, None] if engine is not None else [None]
+
+
+class Libro:
+    """
+    Un libro de Excel abierto, con la misma interfaz que pd.ExcelFile (parse y close, usable con with).
+    Si el motor elegido falla al abrir o al leer una hoja, pasa al siguiente motor de la lista y reintenta
+    """
+
+    def __init__(self, origen, engine=EXCEL_ENGINE):
+        self.origen = origen
+        self.motores = motores(engine)
+        self.workbook = None
+        self._abrir()
+
+    def _abrir(self):
+        while True:
+            # si es un BytesIO hay que volver al principio antes de abrirlo otra vez
+            if hasattr(self.origen, 'seek'):
+                self.origen.seek(0)
+            try:
+                self.workbook = pd.ExcelFile(self.origen, engine=self.motores[0])
+                return
+            except Exception as e:
+                if not self._siguiente(e):
+                    raise
+
+    def _siguiente(self, error):
+        """
+        Descarta el motor actual. Devuelve False si no queda otro para probar
+        """
+        if len(self.motores) == 1:
+            return False
+        print(f"El motor {self.motores[0]} no pudo leer el archivo ({error}). Probando con el motor por defecto.")
+        self.motores.pop(0)
+        return True
+
+    @property
+    def engine(self):
+        return self.workbook.engine
+
+    def parse(self, *args, **kwargs):
+        while True:
+            try:
+                return self.workbook.parse(*args, **kwargs)
+            except Exception as e:
+                if not self._siguiente(e):
+                    raise
+                self.workbook.close()
+                self._abrir()
+
+    def close(self):
+        if self.workbook is not None:
+            self.workbook.close()
+            self.workbook = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def abrir(origen, engine=EXCEL_ENGINE):
+    """
+    Abre el libro (ruta o buffer de bytes) con el motor configurado
+    """
+    return Libro(origen, engine)
@@ -7,34 +7,119 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin, urlparse, unquote
+import requests
+import re
 import time
 import tempfile
+import threading
+import queue
+import shutil
+import sqlite3
 import os
 import pandas as pd
-#from DataBaseConn import DatabaseConnection
+from DataBaseConn import DatabaseConnection, bulk_load
+import esquema
+import lectorExcel
+import cacheParseo
+from dimensionFondos import DimensionFondos
+import validacion
 import sqlalchemy
 
 
-db_user = os.environ.get('POSTGRES_USER')
-db_password = os.environ.get('POSTGRES_PASSWORD')
-db_host = os.environ.get('POSTGRES_HOST')
-db_port = os.environ.get('POSTGRES_PORT', '5432')  # Default port for PostgreSQL is 5432
 db_name = os.environ.get('POSTGRES_DB')
 dtypeMap = {'date': sqlalchemy.types.Date}
 
+# Tiempos máximos (en segundos) para que cargue la página del archivo y para que termine la descarga
+PAGE_TIMEOUT = float(os.environ.get('CAFCI_PAGE_TIMEOUT', '30'))
+DOWNLOAD_TIMEOUT = float(os.environ.get('CAFCI_DOWNLOAD_TIMEOUT', '120'))
+# 'http' baja los archivos sin browser (y usa Selenium solo si falla), 'selenium' usa siempre el browser
+DOWNLOAD_MODE = os.environ.get('CAFCI_DOWNLOAD_MODE', 'http')
+HTTP_TIMEOUT = float(os.environ.get('CAFCI_HTTP_TIMEOUT', '60'))
+# cantidad de descargas en paralelo y mínimo de segundos entre pedidos a cnv.gov.ar (entre todos los workers)
+DOWNLOAD_WORKERS = int(os.environ.get('CAFCI_WORKERS', '1'))
+MIN_REQUEST_INTERVAL = float(os.environ.get('CAFCI_MIN_INTERVAL', '0.5'))
+# tamaño de las colas entre las etapas descarga -> parseo -> carga
+PIPELINE_QUEUE_SIZE = int(os.environ.get('CAFCI_QUEUE_SIZE', '4'))
+# cantidad de archivos que se graban juntos (filas y estado en archivosCAFCI) en una transacción
+STATUS_BATCH_SIZE = int(os.environ.get('CAFCI_STATUS_BATCH', '20'))
+# versión de read_excel_file / esquema.CAFCI_COLUMNAS: cambiarla cuando cambie el resultado del parseo, así no se usan entradas viejas de la cache
+PARSER_VERSION = 2
+# 'plano' graba las planillas enteras en tablaTempFCI; 'dimension' las separa en diariaCAFCI + fondosCAFCI
+# (ver dimensionFondos.py); 'ambos' graba las dos formas, para la transición
+CAFCI_MODELO = os.environ.get('CAFCI_MODELO', 'plano')
+# si está definido, las planillas descargadas se guardan ahí (como ID_nombre) en lugar de borrarse, para poder
+# recargarlas después con backfill.py
+ARCHIVE_DIR = os.environ.get('CAFCI_ARCHIVE_DIR')
+HTTP_CHUNK_SIZE = 64 * 1024
+HTTP_USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'
+# Extensiones que usa Chrome para las descargas en curso
+PARTIAL_SUFFIXES = ('.crdownload', '.tmp', '.part')
+
+
+def wait_for_download(tempDir, timeout=DOWNLOAD_TIMEOUT, poll=0.25, stable_checks=2):
+    """
+    Espera a que termine la descarga en tempDir.
+    Se considera terminada cuando no quedan archivos parciales de Chrome (.crdownload) y el tamaño
+    de los archivos descargados no cambia durante `stable_checks` chequeos consecutivos.
+    Devuelve la lista de archivos descargados. Si se cumple el timeout levanta TimeoutError.
+    """
+    deadline = time.monotonic() + timeout
+    last_sizes = None
+    stable = 0
+
+    while time.monotonic() < deadline:
+        # ignoramos los archivos ocultos que Chrome crea mientras prepara la descarga
+        entries = [f for f in os.listdir(tempDir) if not f.startswith('.')]
+        partial = [f for f in entries if f.endswith(PARTIAL_SUFFIXES)]
+        done = [f for f in entries if f not in partial]
+
+        if done and not partial:
+            try:
+                sizes = {f: os.path.getsize(os.path.join(tempDir, f)) for f in done}
+            except FileNotFoundError:
+                # Chrome renombró el archivo entre listdir y getsize. Volvemos a mirar
+                sizes = None
+
+            if sizes and sizes == last_sizes and all(sizes.values()):
+                stable += 1
+                if stable >= stable_checks:
+                    return sorted(done)
+            else:
+                stable = 0
+            last_sizes = sizes
+        else:
+            last_sizes = None
+            stable = 0
 
+        time.sleep(poll)
 
-def download_file(df, db):
+    raise TimeoutError(f"La descarga en {tempDir} no terminó luego de {timeout} segundos.")
+
+
+def clear_dir(tempDir):
     """
-    Descarga los archivos excel de los respectivos IDS desde la url
-    y los guarda en una carpeta temporal
+    Borra lo que haya quedado en la carpeta temporal (descargas fallidas o parciales)
+    para que no se mezclen con la descarga siguiente
     """
-    # Create a temporary directory to store the downloaded files
-    tempDir = tempfile.mkdtemp()
-    #tempDir = "/tmp/scrape"
-    #print(f"Carpeta temporal: {tempDir}")
+    for f in os.listdir(tempDir):
+        try:
+            os.remove(os.path.join(tempDir, f))
+        except OSError:
+            pass
 
+
+
+def create_driver(tempDir):
+    """
+    Levanta un Chrome headless que descarga directamente en tempDir
+    """
     options = Options()
     options.add_argument('--headless')  # Ensure headless mode is enabled
     options.add_argument('--no-sandbox')
@@ -58,175 +143,598 @@ def download_file(df, db):
     options.add_experimental_option('prefs', prefs)
 
     # Set up the Selenium WebDriver
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
 
-    # vamos a recorrer el df y visitar las urls en href para bajar los archivos
-    for index, row in df.iterrows():
 
-        print(f"Descargando archivo para el ID {row['ID']}, corresponde a fecha {row['fechaCorresponde']}. Row: {index} de {len(df)}")
+def create_session(pool_size=4):
+    """
+    Sesión HTTP con keep-alive y pool de conexiones para bajar los archivos sin browser
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'User-Agent': HTTP_USER_AGENT})
+    return session
 
-        # Navigate to the URL
-        url = row['href']
-        driver.get(url)
 
-        # Give time for the page to load if necessary
-        time.sleep(10)
+def resolve_download_url(session, url):
+    """
+    Baja el html de la página del archivo y devuelve la url absoluta del link a.downloadFile.
+    Devuelve None si el link no existe o no apunta a un archivo (por ejemplo si lo arma un javascript)
+    """
+    response = session.get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
 
-        # Locate the download link using class name and other attributes if needed
-        download_link = driver.find_element(By.CSS_SELECTOR, 'a.downloadFile')
-        download_link.click()
+    link = BeautifulSoup(response.text, 'lxml').select_one('a.downloadFile')
+    if link is None:
+        return None
 
-        # Wait for the download to complete
-        time.sleep(20)
+    href = (link.get('href') or '').strip()
+    if not href or href.startswith('#') or href.lower().startswith('javascript:'):
+        return None
 
-        # vamos a buscar el nombre del archivo descargado. Debería descargar uno solo
-        downloadedFiles = set(os.listdir(tempDir))
-        
-        # verificamos que haya descargado un archivo. Si falló, continuamos con el siguiente
-        if len(downloadedFiles) == 0 or len(downloadedFiles) > 1:
-            print(f"No se descargó ningún archivo de la url {url} o bajaron más de uno. Abortando este archivo")
-            continue
-        
-        downloadedFiles = os.path.join(tempDir, downloadedFiles.pop())
-
-        print(f"Mandando archivo {downloadedFiles} a parsear")
-
-        # se lo mandamos a la función parse_excel_file
-        status = parse_excel_file(downloadedFiles, db, row['ID'])
-
-        # si la función fue exitosa, cambiamos el valor de descargado a True
-        #acá comenzo el comment
-        # if status:
-        #     # actualizamos el valor de descargado en la base de datos
-        #     print(f"Actualizando el valor descargado en la base de datos para el ID {row['ID']}")
-        #     query = f'UPDATE "archivosCAFCI" SET descargado = True, procesado_ok = True WHERE "ID" = \'{row["ID"]}\';'
-        #     #db.execute_query(query)
-        #     with db.connect() as conn:
-        #         conn.execute(sqlalchemy.text(query))
-        # else:
-        #     print(f"Hubo un error al parsear el archivo {downloadedFiles}. No se actualizó el valor descargado en la base de datos.")
-        #acá termino el comment
-
-        if status:
-        # actualizamos el valor de descargado en la base de datos
-            print(f"Actualizando el valor descargado en la base de datos para el ID {row['ID']}")
-            query = f'UPDATE "archivosCAFCI" SET descargado = True, procesado_ok = True WHERE "ID" = \'{row["ID"]}\';'
-            # print(f"Executing query: {query}")  # Debugging: print the query
+    return urljoin(response.url, href)
+
+
+def filename_from_response(response):
+    """
+    Nombre del archivo según el header Content-Disposition o, si no viene, según la url
+    """
+    disposition = response.headers.get('Content-Disposition', '')
+    match = re.search(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)\"?", disposition, re.IGNORECASE)
+    if match:
+        file_name = unquote(match.group(1))
+    else:
+        file_name = unquote(os.path.basename(urlparse(response.url).path))
+    # nos quedamos solo con el nombre, por las dudas de que venga con una ruta
+    return os.path.basename(file_name) or 'archivo.xls'
+
+
+def download_file_http(session, url, tempDir):
+    """
+    Descarga el archivo de la página `url` usando solo HTTP.
+    Devuelve la ruta al archivo descargado o None si no se pudo resolver el link o no vino un archivo
+    """
+    file_url = resolve_download_url(session, url)
+    if file_url is None:
+        return None
+
+    with session.get(file_url, stream=True, timeout=HTTP_TIMEOUT) as response:
+        response.raise_for_status()
+        # si nos devuelve una página en lugar del archivo, no sirve
+        if response.headers.get('Content-Type', '').startswith('text/html'):
+            return None
+
+        file_path = os.path.join(tempDir, filename_from_response(response))
+        # escribimos a un .part y renombramos al final, así nunca queda un archivo a medias con el nombre final
+        partial_path = file_path + '.part'
+        with open(partial_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=HTTP_CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(partial_path, file_path)
+
+    if os.path.getsize(file_path) == 0:
+        os.remove(file_path)
+        return None
+
+    return file_path
+
+
+def download_file_selenium(driver, url, tempDir):
+    """
+    Descarga el archivo de la página `url` haciendo click en a.downloadFile con el browser.
+    Devuelve la ruta al archivo descargado o None si falló
+    """
+    driver.get(url)
+
+    # Esperamos a que el link de descarga esté disponible en lugar de dormir un tiempo fijo
+    try:
+        download_link = WebDriverWait(driver, PAGE_TIMEOUT).until(
+            EC.element_to_be_clickable((By.CSS_SELECTOR, 'a.downloadFile'))
+        )
+    except TimeoutException:
+        print(f"No apareció el link de descarga en {url} luego de {PAGE_TIMEOUT} segundos.")
+        return None
+    download_link.click()
+
+    # Esperamos a que la descarga termine (sin .crdownload y con tamaño estable). Debería descargar uno solo
+    try:
+        downloadedFiles = wait_for_download(tempDir)
+    except TimeoutError as e:
+        print(e)
+        return None
+    if len(downloadedFiles) != 1:
+        return None
+
+    return os.path.join(tempDir, downloadedFiles[0])
+
+
+class RateLimiter:
+    """
+    Espacia los pedidos a cnv.gov.ar: como mucho uno cada `interval` segundos entre todos los workers
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class DownloadWorker:
+    """
+    Un worker de descarga, con su propia carpeta temporal, su sesión HTTP y, si hace falta, su propio browser.
+    Así varios workers pueden descargar a la vez sin que se mezclen los archivos
+    """
+    def __init__(self, mode, rate_limiter):
+        self.tempDir = tempfile.mkdtemp()
+        self.session = create_session() if mode == 'http' else None
+        # el browser lo levantamos solo si hace falta
+        self.driver = None
+        self.rate_limiter = rate_limiter
+
+    def fetch(self, url, destPrefix):
+        """
+        Descarga el archivo de `url` y lo mueve a destPrefix + '_' + nombre del archivo.
+        Devuelve la ruta final o None si no se pudo descargar
+        """
+        downloadedFiles = None
+
+        if self.session is not None:
+            self.rate_limiter.wait()
             try:
-                with db.connect() as conn:
-                    result = conn.execute(sqlalchemy.text(query))
-                    conn.commit()  # Commit the transaction
-                    print(f"Query executed successfully, {result.rowcount} rows affected.")  # Debugging: print the number of affected rows
-            except Exception as e:
-                print(f"An error occurred while executing the query: {e}")  # Debugging: print any exceptions
-        else:
-            print(f"Hubo un error al parsear el archivo {downloadedFiles}. No se actualizó el valor descargado en la base de datos.")
+                downloadedFiles = download_file_http(self.session, url, self.tempDir)
+            except (requests.RequestException, OSError) as e:
+                print(f"Falló la descarga directa de {url}: {e}")
+            if downloadedFiles is None:
+                print(f"No se pudo bajar el archivo de {url} por HTTP. Probamos con el browser")
+                clear_dir(self.tempDir)
+
+        if downloadedFiles is None:
+            if self.driver is None:
+                self.driver = create_driver(self.tempDir)
+            self.rate_limiter.wait()
+            downloadedFiles = download_file_selenium(self.driver, url, self.tempDir)
+
+        if downloadedFiles is None:
+            clear_dir(self.tempDir)
+            return None
+
+        # lo sacamos de la carpeta del worker para que quede libre para la próxima descarga
+        finalPath = f"{destPrefix}_{os.path.basename(downloadedFiles)}"
+        os.replace(downloadedFiles, finalPath)
+        return finalPath
+
+    def close(self):
+        if self.driver is not None:
+            self.driver.quit()
+        if self.session is not None:
+            self.session.close()
+        shutil.rmtree(self.tempDir, ignore_errors=True)
+
+
+class StageStats:
+    """
+    Contadores de una etapa del pipeline: cuántos archivos pasaron, cuánto tiempo estuvo trabajando
+    y cuánto tiempo estuvo esperando que la etapa anterior le mande algo
+    """
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.idle = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy, idle):
+        with self._lock:
+            self.items += 1
+            self.busy += busy
+            self.idle += idle
+
+    def __str__(self):
+        return f"{self.name}: {self.items} archivos, {self.busy:.1f}s trabajando, {self.idle:.1f}s esperando"
+
 
+# marca de fin que se pasan las etapas del pipeline
+_DONE = object()
 
-        print(f"Borramos el archivo {downloadedFiles} descargado de la carpeta temporal.")
-        # borramos el archivos en tempDir
-        os.remove(os.path.join(tempDir, downloadedFiles))
 
-        #print(f"Archivo {downloadedFiles} parseado y guardado en la base de datos. Continuando con el siguiente archivo.")
+def _put(q, item, stop):
+    """
+    Pone item en la cola esperando si está llena (backpressure). Devuelve False si se frenó el pipeline
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    """
+    Saca un item de la cola esperando si está vacía. Devuelve None si se frenó el pipeline
+    """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return None
+
+
+def download_file(df, db, mode=DOWNLOAD_MODE, workers=DOWNLOAD_WORKERS, min_interval=MIN_REQUEST_INTERVAL, queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Descarga los archivos excel de los respectivos IDS desde la url, los parsea y los graba en la base de datos.
+    Las tres etapas (descarga -> parseo -> carga) corren a la vez, conectadas por colas de `queue_size` elementos,
+    así la red no queda parada mientras se parsea ni el parser mientras se descarga.
+    Con mode = 'http' intenta primero bajar el archivo sin browser y solo si falla usa Selenium.
+    Con mode = 'selenium' usa siempre el browser.
+    Las descargas se hacen con `workers` workers en paralelo, respetando `min_interval` segundos entre pedidos.
+    La carga en la base de datos se hace siempre desde este thread, de a un archivo por vez
+    """
+    # Create a temporary directory to store the downloaded files
+    tempDir = tempfile.mkdtemp()
+    #tempDir = "/tmp/scrape"
+    #print(f"Carpeta temporal: {tempDir}")
+
+    workers = max(1, workers)
+    rate_limiter = RateLimiter(min_interval)
+    stop = threading.Event()
+    rows_q = queue.Queue(maxsize=queue_size)
+    parse_q = queue.Queue(maxsize=queue_size)
+    load_q = queue.Queue(maxsize=queue_size)
+    stats = [StageStats('descarga'), StageStats('parseo'), StageStats('carga')]
+
+    def feed():
+        # vamos a recorrer el df y pasarle las urls en href a los workers de descarga
+        for index, row in df.iterrows():
+            if not _put(rows_q, (index, row), stop):
+                return
+        for _ in range(workers):
+            _put(rows_q, _DONE, stop)
+
+    def download_stage():
+        # el worker se crea dentro del try: si no arranca (por ejemplo el webdriver), igual avisamos que terminamos
+        worker = None
+        try:
+            worker = DownloadWorker(mode, rate_limiter)
+            while True:
+                t0 = time.monotonic()
+                item = _get(rows_q, stop)
+                t1 = time.monotonic()
+                if item is None or item is _DONE:
+                    break
+
+                index, row = item
+                print(f"Descargando archivo para el ID {row['ID']}, corresponde a fecha {row['fechaCorresponde']}. Row: {index} de {len(df)}")
+                try:
+                    downloadedFiles = worker.fetch(row['href'], os.path.join(tempDir, str(row['ID'])))
+                except Exception as e:
+                    print(f"Ocurrió un error descargando {row['href']}: {e}")
+                    downloadedFiles = None
+                stats[0].add(time.monotonic() - t1, t1 - t0)
+
+                if not _put(parse_q, (row, downloadedFiles), stop):
+                    break
+        except Exception as e:
+            print(f"No se pudo iniciar el worker de descarga: {e}")
+        finally:
+            if worker is not None:
+                worker.close()
+            _put(parse_q, _DONE, stop)
+
+    def parse_stage():
+        pending = workers
+        try:
+            while pending:
+                t0 = time.monotonic()
+                item = _get(parse_q, stop)
+                t1 = time.monotonic()
+                if item is None:
+                    break
+                if item is _DONE:
+                    pending -= 1
+                    continue
+
+                row, downloadedFiles = item
+                parsed, error = None, None
+                if downloadedFiles is not None:
+                    print(f"Mandando archivo {downloadedFiles} a parsear")
+                    try:
+                        parsed = read_excel_cached(downloadedFiles)
+                    except Exception as e:
+                        error = e
+                    stats[1].add(time.monotonic() - t1, t1 - t0)
+
+                if not _put(load_q, (row, downloadedFiles, parsed, error), stop):
+                    break
+        finally:
+            _put(load_q, _DONE, stop)
+
+    threads = [threading.Thread(target=feed, daemon=True), threading.Thread(target=parse_stage, daemon=True)]
+    threads += [threading.Thread(target=download_stage, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    estado = EstadoArchivos(db)
+    try:
+        while True:
+            t0 = time.monotonic()
+            item = load_q.get()
+            t1 = time.monotonic()
+            if item is _DONE:
+                break
+
+            row, downloadedFiles, parsed, error = item
+            url = row['href']
+
+            # verificamos que haya descargado un archivo. Si falló, continuamos con el siguiente
+            if downloadedFiles is None:
+                print(f"No se descargó ningún archivo de la url {url} o bajaron más de uno. Abortando este archivo")
+                continue
+
+            if error is not None:
+                print(f"Ocurrió un error parseando el archivo {downloadedFiles}: {error}. No se actualizó el valor descargado en la base de datos.")
+            elif parsed is None:
+                # el archivo no tiene un formato conocido. Lo marcamos como no procesado
+                estado.add_failed(row['ID'])
+            else:
+                # las filas y el estado se graban juntos cuando se completa el lote
+                estado.add_ok(row['ID'], parsed)
+            stats[2].add(time.monotonic() - t1, t1 - t0)
+
+            if ARCHIVE_DIR:
+                print(f"Guardamos el archivo {downloadedFiles} en {ARCHIVE_DIR}.")
+                os.makedirs(ARCHIVE_DIR, exist_ok=True)
+                shutil.move(downloadedFiles, os.path.join(ARCHIVE_DIR, os.path.basename(downloadedFiles)))
+            else:
+                print(f"Borramos el archivo {downloadedFiles} descargado de la carpeta temporal.")
+                # borramos el archivos en tempDir
+                os.remove(downloadedFiles)
+    finally:
+        # Termine. Grabamos lo que quedó pendiente, frenamos las etapas (cierran sus browsers y sesiones) y vuelvo
+        estado.flush()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        shutil.rmtree(tempDir, ignore_errors=True)
+        for stage in stats:
+            print(stage)
+
+
+class EstadoArchivos:
+    """
+    Acumula los archivos procesados (sus filas para tablaTempFCI y su estado para archivosCAFCI) y los graba
+    de a lotes de batch_size archivos. Cada lote va en una sola transacción: el COPY de las filas y un UPDATE
+    por estado para todos los IDs del lote, así las filas y el estado nunca quedan desparejos
+    """
+    UPDATE_OK = sqlalchemy.text(
+        'UPDATE "archivosCAFCI" SET descargado = True, procesado_ok = True WHERE "ID" IN :ids'
+    ).bindparams(sqlalchemy.bindparam('ids', expanding=True))
+    UPDATE_FAILED = sqlalchemy.text(
+        'UPDATE "archivosCAFCI" SET procesado_ok = False WHERE "ID" IN :ids'
+    ).bindparams(sqlalchemy.bindparam('ids', expanding=True))
+
+    def __init__(self, db, batch_size=STATUS_BATCH_SIZE, modelo=CAFCI_MODELO):
+        self.db = db
+        self.batch_size = batch_size
+        self.modelo = modelo
+        self.dimension = DimensionFondos() if modelo in ('dimension', 'ambos') else None
+        # las filas se validan contra el último valor de cada fondo antes de grabarlas (ver validacion.py)
+        tabla = 'tablaTempFCI' if modelo in ('plano', 'ambos') else 'diariaCAFCI'
+        self.validador = validacion.Validador(tabla, 'cuarentenaCAFCI') if validacion.VALIDACION else None
+        self.rows = []
+        self.ok = []
+        self.failed = []
+        # ID -> error de los archivos que se marcaron como no procesados porque no se pudieron grabar
+        self.errores = {}
+        # IDs cuyo estado (y sus filas, si estaban ok) quedó grabado en el último flush, aunque el lote no se
+        # haya grabado entero
+        self.grabados = set()
+
+    def add_ok(self, ID, df):
+        # Agregamos una columna, ID, que nos indica los datos a qué bajada pertenecen
+        df = df.copy()  # Ensure we are working with a copy of the DataFrame
+        df.loc[:, 'ID'] = ID
+        self.rows.append(df)
+        self.ok.append(ID)
+        self._maybe_flush()
+
+    def add_failed(self, ID):
+        self.failed.append(ID)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.ok) + len(self.failed) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Graba el lote pendiente en una transacción. Si falla por los datos de algún archivo (y no por la conexión)
+        se vuelve a grabar de a un archivo y solo los que fallan solos se marcan como no procesados, con el error en
+        self.errores. Si falla la conexión no se graba nada más y esos IDs quedan para la próxima corrida.
+        Los IDs que sí se grabaron quedan en self.grabados.
+        Devuelve True si se grabó (o se marcó como no procesado) todo el lote
+        """
+        self.errores = {}
+        self.grabados = set()
+        if not self.ok and not self.failed:
+            return True
+
+        ok, failed, rows = self.ok, self.failed, self.rows
+        self.ok, self.failed, self.rows = [], [], []
+        try:
+            self._graba(ok, failed, rows)
+            self.grabados.update(ok + failed)
+            return True
+        except Exception as e:
+            print(f"Hubo un error al grabar el lote de los IDs {ok + failed}: {e}.")
+            if _es_de_conexion(e):
+                print("No se actualizó el valor descargado en la base de datos.")
+                return False
+            error = e
+
+        if len(ok) == 1:
+            # el lote tenía un solo archivo: es el que falla
+            print(f"Se marca como no procesado el ID {ok[0]}.")
+            self.errores[ok[0]] = str(error)
+            failed.append(ok[0])
+        elif ok:
+            # un archivo con datos que la base no acepta no puede trabar a los demás del lote
+            print(f"Grabamos de a un archivo los {len(ok)} archivos del lote.")
+            for ID, df in zip(ok, rows):
+                try:
+                    self._graba([ID], [], [df])
+                    self.grabados.add(ID)
+                except Exception as e:
+                    if _es_de_conexion(e):
+                        print(f"Hubo un error de conexión grabando el ID {ID}: {e}. Los que faltan quedan para la próxima corrida.")
+                        return False
+                    print(f"No se pudo grabar el archivo del ID {ID}: {e}. Se marca como no procesado.")
+                    self.errores[ID] = str(e)
+                    failed.append(ID)
+        try:
+            self._graba([], failed, [])
+            self.grabados.update(failed)
+        except Exception as e:
+            print(f"Hubo un error al marcar como no procesados los IDs {failed}: {e}.")
+            return False
+        return True
+
+    def _graba(self, ok, failed, rows):
+        """
+        Graba en una transacción las filas de los archivos de ok y el estado de los IDs de ok y failed
+        """
+        vigentes = {}
+        try:
+            with self.db.begin() as conn:
+                if rows:
+                    df = pd.concat(rows, ignore_index=True)
+                    if self.validador is not None:
+                        df, cuarentena = self.validador.valida(df, conn)
+                        bulk_load(conn, cuarentena, 'cuarentenaCAFCI', schema = 'public')
+                    if self.modelo in ('plano', 'ambos'):
+                        bulk_load(conn, df, 'tablaTempFCI', schema = 'public')
+                    if self.dimension is not None:
+                        vigentes = self.dimension.carga(conn, df)
+                if ok:
+                    conn.execute(self.UPDATE_OK, {'ids': ok})
+                if failed:
+                    conn.execute(self.UPDATE_FAILED, {'ids': failed})
+        except Exception:
+            if self.validador is not None:
+                # los últimos valores en memoria incluyen filas que no se grabaron
+                self.validador.reinicia()
+            raise
+
+        if self.dimension is not None:
+            self.dimension.confirmar(vigentes)
+        destino = 'tablaTempFCI' if self.modelo == 'plano' else 'diariaCAFCI'
+        print(f"Grabados {len(ok)} archivos en {destino} y actualizado el estado de {len(ok) + len(failed)} IDs en archivosCAFCI.")
+
+
+# SQLSTATE de los errores de conexión (clase 08) y de la base que se está apagando o reiniciando (57P)
+_SQLSTATE_CONEXION = ('08', '57P')
+# errores de SQLite que no dependen de los datos: la base bloqueada o que no se puede abrir o leer
+_SQLITE_CONEXION = ('SQLITE_BUSY', 'SQLITE_LOCKED', 'SQLITE_CANTOPEN', 'SQLITE_IOERR')
+
+
+def _es_de_conexion(e):
+    """
+    Si el error es de la conexión con la base (y no de los datos de un archivo): en ese caso reintentar
+    de a un archivo no sirve y no hay que marcar nada como no procesado. bulk_load usa el cursor del driver,
+    así que los errores pueden venir sin envolver por SQLAlchemy. No alcanza con que sea un OperationalError:
+    SQLite y Postgres también lo usan para errores del esquema o de los datos ("no such column"), así que
+    se mira el SQLSTATE (o el código de SQLite)
+    """
+    if isinstance(e, (sqlalchemy.exc.TimeoutError, sqlalchemy.exc.DisconnectionError)):
+        return True
+    if getattr(e, 'connection_invalidated', False):
+        return True
+    # el error del driver, si SQLAlchemy lo envolvió
+    if getattr(e, 'orig', None) is not None:
+        return _es_de_conexion(e.orig)
+    # pgcode en psycopg2, sqlstate en psycopg 3
+    sqlstate = getattr(e, 'pgcode', None) or getattr(e, 'sqlstate', None)
+    if sqlstate:
+        return sqlstate.startswith(_SQLSTATE_CONEXION)
+    if isinstance(e, sqlite3.Error):
+        return (getattr(e, 'sqlite_errorname', None) or '').startswith(_SQLITE_CONEXION)
+    # psycopg no trae SQLSTATE cuando el servidor cierra la conexión o ya estaba cerrada
+    nombres = {clase.__name__ for clase in type(e).__mro__}
+    return type(e).__module__.split('.')[0] in ('psycopg2', 'psycopg') and bool(nombres & {'OperationalError', 'InterfaceError'})
 
-    # Termine. Cierro el browser y vuelvo
-    driver.quit()
 
-  
 def parse_excel_file(downloadedFiles, db, ID) -> bool:
     """
     Esta función debe tomar el archivo descargado y parsearlo para obtener la información
-    Luego grabar ese df en la base de datos
-    """
-
-    # Leer el archivo
-    df = pd.read_excel(downloadedFiles, skiprows=9)
-
-    nombresColumna = [
-        "fondo",
-        "clasMoneda",
-        "clasRegion",
-        "clasHorizonte",
-        "fecha",
-        "vcp",
-        "vcpAnterior",
-        "varVcp",
-        "reexPesos",
-        "varVcp1",
-        "varVcp2",
-        "varVcp3",
-        "ccp",
-        "ccpAnterior",
-        "patrimonio",
-        "patrimonioAnterior",
-        "marketShare",
-        "sociedadDepositaria",
-        "codigoCNV",
-        "calificacion",
-        "codigoCAFCI",
-        "codigoSocGte",
-        "codigoSocDep",
-        "sociedadGerente",
-        "codigoClasificacion",
-        "codigoMoneda",
-        "codigoRegion",
-        "codigoHorizonte",
-        "indiceMM",
-        "comisionIngreso",
-        "honorariosAdmSG",
-        "honorariosAdmSD",
-        "gastosOrdGestion",
-        "comisionRescate",
-        "comisionTransferencia",
-        "honorariosExito",
-        "monedaFondo",
-        "plazoLiq",
-        "decreto596",
-        "idFondoCAFCIpadre",
-        "idFondoCNVpadre",
-        "tipoEscision",
-        "repatriacion",
-        "minimoInversion",
-        "regularizacionLey27743",
-        "tipodinero"
-    ]
-
-    # Si df tiene 44 columnas, es un archivo de los viejos y hay que sacar la última columna de nombresColumna y seguir procesando.
-    # Si tiene 45 columnas, es un archivo de los nuevos y hay que seguir procesando con los nombres de columnas asignados
-    # Si tiene cualquier otro número de columnas, es un archivo raro y no lo vamos a procesar. Informamos cuantas columnas tiene, ponemos que no se proceso y retornamos False
-    if df.shape[1] == 44:
-        nombresColumna = nombresColumna[:-1]
-        df.columns = nombresColumna
-        df['regularizacionLey27743'] = None
-    elif df.shape[1] == 46:
-        df.columns = nombresColumna
-    else:
-        print(f"El archivo {downloadedFiles} tiene {df.shape[1]} columnas. No es un archivo común. No se grabará en la base de datos.")
-        query = f'UPDATE "archivosCAFCI" SET procesado_ok = False WHERE \"ID\" = \'{ID}\';'
-        with db.connect() as conn:
-            conn.execute(sqlalchemy.text(query))
+    Luego grabar ese df en la base de datos, junto con el estado del archivo en archivosCAFCI
+    """
+    estado = EstadoArchivos(db)
+    df = read_excel_cached(downloadedFiles)
+    if df is None:
+        estado.add_failed(ID)
+        estado.flush()
         return False # con esto status será False y no se actualizará el valor descargado en la base de datos
 
-    # Eliminamos las filas que tienen el atributo clasMoneda vacío y asi nos quitamos de encima los títulos intermedios
-    df = df.dropna(subset=["clasMoneda"])
+    estado.add_ok(ID, df)
+    if not estado.flush():
+        return False
+    print(f"Archivo {downloadedFiles} parseado y guardado en la base de datos.")
 
-    # Convertimos la columna fecha a datetime sin la hora
-    df.iloc[:, 4] = pd.to_datetime(df.iloc[:, 4], format='%d/%m/%y').dt.date
+    return True
 
-    # Convertimos la columna 5 a float pero primero le sacamos algunos caracteres inválidos con coerce. pondrá NaN en esos casos
-    df.iloc[:,5] = pd.to_numeric(df.iloc[:,5], errors='coerce')
 
-    # Agregamos una columna, ID, que nos indica los datos a qué bajada pertenecen
-    df = df.copy()  # Ensure we are working with a copy of the DataFrame
-    df.loc[:, 'ID'] = ID
+def read_excel_cached(downloadedFiles):
+    """
+    Igual que read_excel_file, pero si el mismo archivo ya se parseó antes (por ejemplo en una corrida que falló
+    al grabar) devuelve el df guardado en la cache de parseo
+    """
+    return cacheParseo.cacheado(downloadedFiles, 'cafci', PARSER_VERSION, lambda: read_excel_file(downloadedFiles))
 
-    # Grabar el df en la base de datos
-    df.to_sql(name = 'tablaTempFCI', con = db, index = False, schema = 'public', if_exists='append')
-    #db.to_sql(df, "tablaTempFCI")
 
-    print(f"Archivo {downloadedFiles} parseado y guardado en la base de datos.")
+def read_excel_file(downloadedFiles):
+    """
+    Lee el archivo descargado y devuelve el df con las columnas renombradas y tipadas según esquema.CAFCI_FORMATOS.
+    Devuelve None si el archivo no tiene un formato conocido
+    """
+    with lectorExcel.abrir(downloadedFiles) as workbook:
+        # primero leemos solo la fila de títulos para saber qué formato tiene el archivo
+        titulos = workbook.parse(skiprows=9, nrows=0)
 
-    return True
+        # Si df tiene 44 o 45 columnas, es un archivo de los viejos al que le faltan las últimas columnas, que agregamos vacías.
+        # Si tiene 46 columnas, es un archivo de los nuevos y hay que seguir procesando con los nombres de columnas asignados
+        # Si tiene cualquier otro número de columnas, es un archivo raro y no lo vamos a procesar. Informamos cuantas columnas tiene y retornamos None para que se marque como no procesado
+        columnas = esquema.CAFCI_FORMATOS.get(titulos.shape[1])
+        if columnas is None:
+            print(f"El archivo {downloadedFiles} tiene {titulos.shape[1]} columnas. No es un archivo común. No se grabará en la base de datos.")
+            return None
+
+        # Leer el archivo con los nombres del esquema. Las columnas de texto se leen tal cual
+        df = workbook.parse(
+            skiprows=9,
+            header=0,
+            names=[c.nombre for c in columnas],
+            usecols=range(len(columnas)),
+            dtype={c.nombre: object for c in columnas if c.tipo in ('texto', 'categoria')},
+        )
+
+    # Eliminamos las filas que no tienen las columnas obligatorias (clasMoneda vacío) y asi nos quitamos de encima los títulos intermedios
+    df = df.dropna(subset=[c.nombre for c in columnas if not c.nulos])
+
+    # Convertimos cada columna a su tipo: fecha sin la hora, números con coerce (pondrá NaN si hay caracteres inválidos), categorías
+    df = esquema.tipar(df.copy(), columnas, esquema.CAFCI_FORMATO_FECHA)
+
+    return esquema.completar(df, esquema.CAFCI_COLUMNAS)
 
 
 def which_IDs(db):
@@ -237,7 +745,8 @@ def which_IDs(db):
 
     # consultamos cuales tienen descargado = False
     query = 'SELECT * FROM "archivosCAFCI" WHERE descargado = False and procesado_ok is NULL;'
-    df = pd.read_sql(query, db)
+    with db.connection() as conn:
+        df = pd.read_sql(sqlalchemy.text(query), conn)
 
     # retornamos el df
     return df
@@ -245,25 +754,24 @@ def which_IDs(db):
 
 if __name__ == "__main__":
     # Traer los IDs que no han sido descargados
-    # db = DatabaseConnection(db_type="postgresql", db_name= os.environ.get('POSTGRES_DB'))
-    # db.connect()
-    db = sqlalchemy.create_engine(f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}')
-    
-    # Imprimimos hora y día de comienzo
-    print(f"Iniciando descarga de archivos el día {pd.Timestamp.now()}")
+    # una sola conexión (con su pool) para toda la corrida, en lugar de una conexión nueva por UPDATE
+    with DatabaseConnection(db_type="postgresql", db_name=db_name) as db:
 
-    # Qué archivos no han sido descargados?
-    df = which_IDs(db)
+        # Imprimimos hora y día de comienzo
+        print(f"Iniciando descarga de archivos el día {pd.Timestamp.now()}")
 
-    # si df vuelve vacío, no hay archivos para descargar
-    if not df.empty:
-        # Descargar los archivos de los IDs
-        # vamos a probar solo con el primero
-        download_file(df, db)
+        # Qué archivos no han sido descargados?
+        df = which_IDs(db)
 
-        print(f"Descarga de archivos finalizada el día {pd.Timestamp.now()}")
-        print("-----------------------------------------------------------------")
-    else:
-        print("No hay archivos para descargar. Finalizando.")
-    # db.disconnect()
+        # si df vuelve vacío, no hay archivos para descargar
+        if not df.empty:
+            # Descargar los archivos de los IDs
+            # vamos a probar solo con el primero
+            download_file(df, db)
+
+            print(f"Descarga de archivos finalizada el día {pd.Timestamp.now()}")
+            print(f"Métricas del pool de conexiones: {db.pool_metrics}")
+            print("-----------------------------------------------------------------")
+        else:
+            print("No hay archivos para descargar. Finalizando.")
 
@@ -0,0 +1,255 @@
+"""
+Pruebas de scrape con una base SQLite temporal:
+    - EstadoArchivos: un archivo que la base no acepta no tiene que trabar a los demás archivos del lote, y un
+      error de conexión (por el SQLSTATE, no por la clase) no marca nada.
+    - La descarga por HTTP, contra el servidor local de conftest.py (fixture cnv) que sirve las páginas de los
+      archivos con el link a.downloadFile y los archivos.
+    - wait_for_download sobre una carpeta temporal, con un reloj falso (Reloj) que hace avanzar la descarga.
+
+    python -m pytest scrape_test.py
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import pandas as pd
+import pytest
+import sqlalchemy
+import scrape
+from datosSinteticos import planilla, dia, libro_cafci
+
+
+class DataError(Exception):
+    pass
+
+
+class OperationalError(Exception):
+    # como el de psycopg2 cuando se corta la conexión con el servidor
+    pgcode = '08006'
+
+
+@pytest.fixture
+def archivos_cafci(db):
+    # archivosCAFCI con los IDs 0 a 4, sin procesar
+    ids = [str(i) for i in range(5)]
+    db.bulk_load(pd.DataFrame({'ID': ids, 'descargado': [False] * 5, 'procesado_ok': [None] * 5}), 'archivosCAFCI')
+    return db
+
+
+def falla_con(monkeypatch, ID, clase):
+    # el COPY de tablaTempFCI falla si el lote trae las filas del archivo ID
+    original = scrape.bulk_load
+
+    def bulk_load(conn, df, tabla, schema=None):
+        if tabla == 'tablaTempFCI' and (df['ID'] == ID).any():
+            raise clase(f"valor inválido en el archivo {ID}")
+        return original(conn, df, tabla, schema)
+    monkeypatch.setattr(scrape, 'bulk_load', bulk_load)
+    monkeypatch.setattr(scrape.validacion, 'VALIDACION', False)
+
+
+def carga_lote(db):
+    estado = scrape.EstadoArchivos(db, batch_size=5, modelo='plano')
+    for i in range(5):
+        estado.add_ok(str(i), planilla(dia(3 + i), {1: 'Gerente A'}))
+    with db.connection() as conn:
+        archivos = dict(conn.execute(sqlalchemy.text('SELECT "ID", procesado_ok FROM "archivosCAFCI"')).fetchall())
+        filas = {}
+        if sqlalchemy.inspect(conn).has_table('tablaTempFCI'):
+            filas = dict(conn.execute(sqlalchemy.text('SELECT "ID", count(*) FROM "tablaTempFCI" GROUP BY "ID"')).fetchall())
+    return estado, archivos, filas
+
+
+def test_un_archivo_con_error_no_traba_al_lote(archivos_cafci, monkeypatch):
+    db = archivos_cafci
+    falla_con(monkeypatch, '2', DataError)
+    estado, archivos, filas = carga_lote(db)
+    assert set(filas) == {'0', '1', '3', '4'}
+    # en SQLite la columna queda como texto (la crea pandas con la primera fila)
+    assert [int(archivos[str(i)]) for i in range(5)] == [1, 1, 0, 1, 1]
+    assert list(estado.errores) == ['2']
+
+
+def test_error_de_conexion_no_marca_nada(archivos_cafci, monkeypatch):
+    db = archivos_cafci
+    falla_con(monkeypatch, '2', OperationalError)
+    estado, archivos, filas = carga_lote(db)
+    assert filas == {}
+    assert all(procesado_ok is None for procesado_ok in archivos.values())
+    assert estado.errores == {}
+
+
+def test_error_de_esquema_de_sqlite_no_es_de_conexion(archivos_cafci, monkeypatch):
+    # sqlite3 usa OperationalError también para "no such column": el archivo se marca como no procesado
+    db = archivos_cafci
+    original = scrape.bulk_load
+
+    def bulk_load(conn, df, tabla, schema=None):
+        if tabla == 'tablaTempFCI' and (df['ID'] == '2').any():
+            conn.exec_driver_sql('SELECT noExiste FROM "archivosCAFCI"')
+        return original(conn, df, tabla, schema)
+    monkeypatch.setattr(scrape, 'bulk_load', bulk_load)
+    monkeypatch.setattr(scrape.validacion, 'VALIDACION', False)
+    estado, archivos, filas = carga_lote(db)
+    assert set(filas) == {'0', '1', '3', '4'}
+    assert [int(archivos[str(i)]) for i in range(5)] == [1, 1, 0, 1, 1]
+    assert 'no such column' in estado.errores['2']
+
+
+@pytest.mark.parametrize('error, conexion', [
+    (sqlalchemy.exc.TimeoutError('pool agotado'), True),
+    (OperationalError('server closed the connection unexpectedly'), True),
+    (type('AdminShutdown', (Exception,), {'sqlstate': '57P01'})('apagando'), True),
+    (type('UndefinedColumn', (Exception,), {'pgcode': '42703'})('no existe la columna'), False),
+    (sqlite3.OperationalError('table x has no column named y'), False),
+    (DataError('valor inválido'), False),
+])
+def test_es_de_conexion(error, conexion):
+    assert scrape._es_de_conexion(error) == conexion
+    # igual si viene envuelto por SQLAlchemy
+    envuelto = sqlalchemy.exc.OperationalError('INSERT', {}, error)
+    assert scrape._es_de_conexion(envuelto) == conexion
+
+
+@pytest.fixture
+def archivos_cnv(cnv):
+    cnv.archivos.update({'10': libro_cafci(20), '11': libro_cafci(30), 'vacio': b''})
+    return cnv
+
+
+def test_descarga_http(archivos_cnv):
+    cnv = archivos_cnv
+    sesion = scrape.create_session()
+    with tempfile.TemporaryDirectory() as directorio:
+        rutas = [scrape.download_file_http(sesion, cnv.url(ID), directorio) for ID in ('10', '11')]
+        assert [os.path.basename(r) for r in rutas] == ['Planilla 10.xlsx', 'Planilla 11.xlsx']
+        with open(rutas[1], 'rb') as f:
+            assert f.read() == cnv.archivos['11']
+        # no quedan .part
+        assert sorted(os.listdir(directorio)) == ['Planilla 10.xlsx', 'Planilla 11.xlsx']
+    sesion.close()
+    assert cnv.pedidos == ['/cuotapartes/10', '/descarga/10', '/cuotapartes/11', '/descarga/11']
+    # los cuatro pedidos van por la misma conexión
+    assert len(cnv.conexiones) == 1
+
+
+@pytest.mark.parametrize('ID', ['js', 'login', 'vacio'])
+def test_descarga_http_sin_archivo(archivos_cnv, ID):
+    cnv = archivos_cnv
+    sesion = scrape.create_session()
+    with tempfile.TemporaryDirectory() as directorio:
+        assert scrape.download_file_http(sesion, cnv.url(ID), directorio) is None
+        assert os.listdir(directorio) == []
+    sesion.close()
+
+
+def test_download_file_baja_parsea_y_graba(archivos_cnv, db, monkeypatch, tmp_path):
+    cnv = archivos_cnv
+    monkeypatch.setattr(scrape.validacion, 'VALIDACION', False)
+    monkeypatch.setattr(scrape.cacheParseo, 'PARSE_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(scrape, 'ARCHIVE_DIR', None)
+    archivos = pd.DataFrame({'ID': ['10', '11'], 'fechaCorresponde': None,
+                             'href': [cnv.url('10'), cnv.url('11')], 'descargado': False, 'procesado_ok': None})
+    db.bulk_load(archivos[['ID', 'descargado', 'procesado_ok']], 'archivosCAFCI')
+
+    scrape.download_file(archivos, db, mode='http', workers=2, min_interval=0)
+
+    with db.connection() as conn:
+        estado = conn.execute(sqlalchemy.text('SELECT "ID", descargado, procesado_ok FROM "archivosCAFCI" ORDER BY "ID"')).fetchall()
+        filas = dict(conn.execute(sqlalchemy.text('SELECT "ID", count(*) FROM "tablaTempFCI" GROUP BY "ID"')).fetchall())
+    assert [(ID, int(d), int(p)) for ID, d, p in estado] == [('10', 1, 1), ('11', 1, 1)]
+    assert filas == {'10': 20, '11': 30}
+
+
+def test_download_file_termina_si_un_worker_no_arranca(archivos_cnv, db, monkeypatch, tmp_path):
+    # el primer worker no puede crear su browser: el otro baja todo y download_file no se queda esperando
+    cnv = archivos_cnv
+    monkeypatch.setattr(scrape.validacion, 'VALIDACION', False)
+    monkeypatch.setattr(scrape.cacheParseo, 'PARSE_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(scrape, 'ARCHIVE_DIR', None)
+    archivos = pd.DataFrame({'ID': ['10', '11'], 'fechaCorresponde': None,
+                             'href': [cnv.url('10'), cnv.url('11')], 'descargado': False, 'procesado_ok': None})
+    db.bulk_load(archivos[['ID', 'descargado', 'procesado_ok']], 'archivosCAFCI')
+    DownloadWorker = scrape.DownloadWorker
+    creados = []
+
+    def crea(mode, rate_limiter):
+        creados.append(mode)
+        if len(creados) == 1 or mode == 'selenium':
+            raise RuntimeError('no se pudo iniciar el webdriver')
+        return DownloadWorker(mode, rate_limiter)
+    monkeypatch.setattr(scrape, 'DownloadWorker', crea)
+
+    def corre(mode):
+        hilo = threading.Thread(target=scrape.download_file, args=(archivos, db),
+                                kwargs={'mode': mode, 'workers': 2, 'min_interval': 0}, daemon=True)
+        hilo.start()
+        hilo.join(timeout=30)
+        assert not hilo.is_alive()
+
+    corre('http')
+    with db.connection() as conn:
+        filas = dict(conn.execute(sqlalchemy.text('SELECT "ID", count(*) FROM "tablaTempFCI" GROUP BY "ID"')).fetchall())
+    assert filas == {'10': 20, '11': 30}
+    # si no arranca ninguno, termina igual sin descargar nada
+    corre('selenium')
+
+
+class Reloj:
+    """
+    Reemplaza al módulo time de scrape: sleep avanza el reloj y hace los pasos (momento, función) que
+    correspondan, como si la descarga avanzara mientras wait_for_download duerme
+    """
+
+    def __init__(self, pasos=()):
+        self.ahora = 0.0
+        self.pasos = sorted(pasos, key=lambda paso: paso[0])
+
+    def monotonic(self):
+        return self.ahora
+
+    def sleep(self, segundos):
+        self.ahora += segundos
+        while self.pasos and self.pasos[0][0] <= self.ahora:
+            self.pasos.pop(0)[1]()
+
+    def __getattr__(self, nombre):
+        return getattr(time, nombre)
+
+
+def escribe(ruta, contenido, modo='wb'):
+    def paso():
+        with open(ruta, modo) as f:
+            f.write(contenido)
+    return paso
+
+
+def test_wait_for_download_ignora_el_crdownload(tmp_path, monkeypatch):
+    escribe(tmp_path / 'Planilla.xlsx.crdownload', b'x' * 100)()
+    reloj = Reloj([(1.0, lambda: os.replace(tmp_path / 'Planilla.xlsx.crdownload', tmp_path / 'Planilla.xlsx'))])
+    monkeypatch.setattr(scrape, 'time', reloj)
+    assert scrape.wait_for_download(str(tmp_path), timeout=10, poll=0.25, stable_checks=2) == ['Planilla.xlsx']
+    # mientras estuvo el parcial no se devolvió nada; después hicieron falta dos chequeos con el mismo tamaño
+    assert reloj.ahora == 1.5
+
+
+def test_wait_for_download_espera_a_que_el_tamanio_no_cambie(tmp_path, monkeypatch):
+    ruta = tmp_path / 'Planilla.xlsx'
+    escribe(ruta, b'x' * 10)()
+    reloj = Reloj([(momento, escribe(ruta, b'x' * 10, 'ab')) for momento in (0.5, 1.0, 1.5)])
+    monkeypatch.setattr(scrape, 'time', reloj)
+    assert scrape.wait_for_download(str(tmp_path), timeout=10, poll=0.25, stable_checks=2) == ['Planilla.xlsx']
+    assert reloj.ahora == 2.0
+    assert os.path.getsize(ruta) == 40
+
+
+def test_wait_for_download_timeout(tmp_path, monkeypatch):
+    # el parcial nunca termina
+    escribe(tmp_path / 'Planilla.xlsx.crdownload', b'x' * 100)()
+    reloj = Reloj()
+    monkeypatch.setattr(scrape, 'time', reloj)
+    with pytest.raises(TimeoutError):
+        scrape.wait_for_download(str(tmp_path), timeout=5, poll=0.25)
+    assert reloj.ahora == 5.0
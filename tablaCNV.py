@@ -0,0 +1,67 @@
+"""
+Extracción de la tabla de archivos de cuotapartes de la página de la CNV.
+Usa lxml directamente (XPath) en lugar de BeautifulSoup, y parsea las fechas con fechas.parseaFecha (vectorizado
+y sin locale.setlocale), porque con la lista completa expandida son miles de filas.
+"""
+
+import pandas as pd
+from lxml import html
+from fechas import parseaFecha
+
+
+def extraeTabla(page_source):
+    """
+    Extrae las filas de la tabla de archivos del html de la página.
+    Devuelve un DataFrame con los textos tal cual vienen (sin parsear fechas) o None si no hay tabla
+    """
+    tree = html.fromstring(page_source)
+
+    # Find the table in the HTML
+    tables = tree.xpath('//table')
+    if not tables:
+        return None
+
+    # salteamos la fila de títulos
+    return _tabla(tables[0].xpath('.//tr')[1:])
+
+
+def extraeFilas(filas_html):
+    """
+    Como extraeTabla, pero de un pedazo de html con filas <tr> sueltas (por ejemplo las que se agregaron a la tabla
+    después de un "VER MÁS"), así no hay que volver a parsear la página entera
+    """
+    return _tabla(html.fromstring(f'<table>{filas_html}</table>').xpath('.//tr'))
+
+
+def _tabla(rows):
+    """
+    DataFrame con los textos de las filas de 4 celdas
+    """
+    rows = [row for row in rows if len(row.xpath('./td')) == 4]
+    cells = [row.xpath('./td') for row in rows]
+    links = [row[0].xpath('.//a') for row in cells]
+
+    # Create DataFrame
+    return pd.DataFrame({
+        'fechaCorresponde': [(a[0] if a else row[0]).text_content().strip() for row, a in zip(cells, links)],
+        'fechaRecepcion': [row[1].text_content().strip() for row in cells],
+        'descripcion': [row[2].text_content().strip() for row in cells],
+        'ID': [row[3].text_content().strip() for row in cells],
+        'href': [a[0].get('href', '').strip() if a else None for a in links],
+        'descargado': False
+    })
+
+
+def parseaFechas(df):
+    """
+    Convierte a fecha las columnas de texto de la tabla y agrega fechaCorrespondeParseada
+    """
+    # Convert first and second column of df into datetime. format is 3 jun 2024 (y 3 jun 2024 14:35)
+    df['fechaCorresponde'] = parseaFecha(df['fechaCorresponde'])
+    df['fechaRecepcion'] = parseaFecha(df['fechaRecepcion'])
+
+    # Add a column with the date parsed from the descripcion column (lo que viene después de " al")
+    df['fechaCorrespondeParseada'] = df['descripcion'].str.split(" al").str[1].str.strip()
+    df['fechaCorrespondeParseada'] = parseaFecha(df['fechaCorrespondeParseada'])
+
+    return df
@@ -0,0 +1,164 @@
+"""
+Validación de las filas parseadas antes de grabarlas, contra el último valor aceptado de cada fondo.
+Se calcula con operaciones vectorizadas sobre todos los fondos a la vez (en un lote con varios días, un paso por día
+de cada fondo); el último valor de cada fondo se lee una sola vez de la base (una consulta por el índice de fecha)
+y después se mantiene en memoria, solo con las filas que no fueron a cuarentena.
+
+Se marcan:
+    salto_vcp          el vcp cambió más de VALIDACION_SALTO_VCP (proporción) respecto del anterior
+    vcp_anterior       el vcpAnterior informado no coincide con nuestro vcp del día hábil anterior (solo CAFCI, y
+                       solo si ese día lo tenemos aceptado: si falta o quedó en cuarentena no se compara)
+    vcp_no_positivo    vcp cero o negativo
+    patrimonio         patrimonio negativo, o que se multiplicó o dividió por más de VALIDACION_FACTOR_PATRIMONIO
+                       (solo para fondos con más de VALIDACION_PATRIMONIO_MINIMO, los chicos varían mucho)
+
+Las filas marcadas van a la tabla de cuarentena (cuarentenaCAFCI / cuarentenaFIMA) con el motivo, en lugar de a la
+tabla diaria.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import sqlalchemy
+import esquema
+
+# con VALIDACION=0 no se valida nada
+VALIDACION = os.environ.get('VALIDACION', '1') == '1'
+SALTO_VCP = float(os.environ.get('VALIDACION_SALTO_VCP', '0.25'))
+TOLERANCIA_VCP_ANTERIOR = float(os.environ.get('VALIDACION_TOLERANCIA_VCP_ANTERIOR', '0.001'))
+FACTOR_PATRIMONIO = float(os.environ.get('VALIDACION_FACTOR_PATRIMONIO', '10'))
+PATRIMONIO_MINIMO = float(os.environ.get('VALIDACION_PATRIMONIO_MINIMO', '1000000'))
+# cuántos días para atrás se busca el valor anterior de un fondo (y hasta dónde se lo compara)
+DIAS_ANTERIOR = int(os.environ.get('VALIDACION_DIAS_ANTERIOR', '10'))
+
+
+class Validador:
+    """
+    Valida lotes de filas de una tabla (por ejemplo 'tablaTempFCI' o 'diariaFIMA') y recuerda el último vcp y
+    patrimonio aceptado de cada fondo. Si el lote después no se graba hay que llamar a reinicia(), así la próxima
+    validación vuelve a leer los últimos valores de la base
+    """
+
+    def __init__(self, tabla, cuarentena):
+        self.tabla = tabla
+        self.cuarentena = cuarentena
+        spec = esquema.TABLAS[tabla]
+        self.clave = spec.clave
+        self.fecha = spec.fecha
+        self.ultimos = None
+
+    def reinicia(self):
+        self.ultimos = None
+
+    def _carga_ultimos(self, conn, desde):
+        """
+        Último vcp y patrimonio de cada fondo en los DIAS_ANTERIOR días antes de desde, en una sola consulta
+        """
+        spec = esquema.TABLAS[self.tabla]
+        self.ultimos = pd.DataFrame({
+            'fecha': pd.Series(dtype='datetime64[ns]'), 'vcp': pd.Series(dtype=float), 'patrimonio': pd.Series(dtype=float),
+        })
+        schema = 'public' if conn.dialect.name == 'postgresql' else None
+        if not sqlalchemy.inspect(conn).has_table(self.tabla, schema=schema):
+            return
+        tipo = next(c.tipo for c in spec.columnas if c.nombre == self.fecha)
+        convierte = (lambda f: f.date()) if tipo == 'fecha' else (lambda f: f.to_pydatetime())
+        tabla = f'public."{self.tabla}"' if schema else f'"{self.tabla}"'
+        query = sqlalchemy.text(
+            f'SELECT t."{self.clave}", t."{self.fecha}", t.vcp, t.patrimonio FROM {tabla} t '
+            f'WHERE t."{self.fecha}" >= :desde AND t."{self.fecha}" < :hasta AND t.vcp IS NOT NULL '
+            f'ORDER BY t."{self.fecha}"'
+        )
+        params = {'desde': convierte(desde - pd.Timedelta(days=DIAS_ANTERIOR)), 'hasta': convierte(desde)}
+        filas = pd.read_sql(query, conn, params=params, parse_dates=[self.fecha])
+        filas = filas.dropna(subset=[self.clave]).drop_duplicates(self.clave, keep='last')
+        self.ultimos = filas.set_index(self.clave).rename(columns={self.fecha: 'fecha'})[['fecha', 'vcp', 'patrimonio']]
+
+    def valida(self, df, conn):
+        """
+        Devuelve (filas buenas, filas en cuarentena con la columna motivo). conn es una conexión de SQLAlchemy,
+        que se usa solo la primera vez para leer los últimos valores
+        """
+        if df.empty:
+            return df, df.iloc[:0].assign(motivo=pd.Series(dtype=object))
+
+        fecha = pd.to_datetime(df[self.fecha]).dt.normalize()
+        if self.ultimos is None:
+            self._carga_ultimos(conn, fecha.min())
+
+        # trabajamos con posiciones, así no importa si el índice de df tiene repetidos
+        filas = pd.DataFrame({
+            'clave': df[self.clave].to_numpy(), 'fecha': fecha.to_numpy(),
+            'vcp': pd.to_numeric(df['vcp'], errors='coerce').to_numpy(dtype=float),
+            'patrimonio': pd.to_numeric(df['patrimonio'], errors='coerce').to_numpy(dtype=float),
+        })
+        if 'vcpAnterior' in df.columns:
+            filas['vcpAnterior'] = pd.to_numeric(df['vcpAnterior'], errors='coerce').to_numpy(dtype=float)
+
+        # el valor anterior de cada fila es el último aceptado del fondo (de la base, de un lote anterior o de este
+        # mismo lote), así que las filas de cada fondo se validan en orden de fecha: en cada paso la k-ésima de
+        # cada fondo, todas juntas. En la carga diaria hay un solo paso
+        orden = filas.sort_values(['clave', 'fecha'], kind='stable')
+        posicion = orden.groupby('clave', sort=False, dropna=False).cumcount().to_numpy()
+        motivo = np.full(len(filas), '', dtype=object)
+        for k in range(int(posicion.max()) + 1):
+            paso = orden[posicion == k]
+            motivo_paso = self._marca(paso)
+            motivo[paso.index] = motivo_paso
+            self._recuerda(paso[motivo_paso == ''])
+
+        mala = motivo != ''
+        buenas = df[~mala]
+        cuarentena = df[mala].assign(motivo=motivo[mala])
+        if mala.any():
+            print(f"{int(mala.sum())} filas van a {self.cuarentena}: {cuarentena['motivo'].value_counts().to_dict()}")
+        return buenas, cuarentena
+
+    def _marca(self, filas):
+        """
+        Motivos (separados por ';', '' si la fila es buena) de filas con a lo sumo una fila por fondo,
+        comparando con el último valor aceptado de cada fondo
+        """
+        previo = self.ultimos.reindex(filas['clave'].to_numpy()).set_axis(filas.index)
+        fecha_previa = pd.to_datetime(previo['fecha'])
+        dias = (filas['fecha'] - fecha_previa).dt.days
+        tiene_previo = previo['vcp'].notna() & filas['clave'].notna() & dias.between(1, DIAS_ANTERIOR)
+        vcp, vcp_previo = filas['vcp'], previo['vcp'].astype(float)
+        patrimonio, patrimonio_previo = filas['patrimonio'], previo['patrimonio'].astype(float)
+
+        marcas = {
+            'salto_vcp': tiene_previo & ((vcp / vcp_previo - 1).abs() > SALTO_VCP),
+            'vcp_no_positivo': vcp <= 0,
+            'patrimonio': (patrimonio < 0) | (
+                tiene_previo & (patrimonio_previo >= PATRIMONIO_MINIMO)
+                & ((patrimonio / patrimonio_previo > FACTOR_PATRIMONIO) | (patrimonio / patrimonio_previo < 1 / FACTOR_PATRIMONIO))
+            ),
+        }
+        if 'vcpAnterior' in filas.columns:
+            # vcpAnterior es el del día hábil anterior: solo se puede comparar si nuestro último valor aceptado es
+            # de ese día. Si falta un archivo, o el día anterior quedó en cuarentena, el anterior que tenemos es
+            # de antes. Con un feriado en el medio tampoco se compara (busday_count no conoce los feriados)
+            hoy = filas['fecha'].to_numpy().astype('datetime64[D]')
+            anterior = fecha_previa.to_numpy().astype('datetime64[D]')
+            anterior = np.where(np.isnat(anterior), hoy, anterior)
+            dia_habil_anterior = tiene_previo & (np.busday_count(anterior, hoy) == 1)
+            marcas['vcp_anterior'] = (
+                dia_habil_anterior & ((filas['vcpAnterior'] / vcp_previo - 1).abs() > TOLERANCIA_VCP_ANTERIOR)
+            )
+
+        motivo = np.full(len(filas), '', dtype=object)
+        for nombre, marca in marcas.items():
+            motivo = motivo + np.where(marca.fillna(False).to_numpy(dtype=bool), nombre + ';', '')
+        return np.array([m.rstrip(';') for m in motivo], dtype=object)
+
+    def _recuerda(self, filas):
+        """
+        Actualiza en memoria el último vcp y patrimonio de cada fondo con las filas aceptadas
+        """
+        filas = filas.dropna(subset=['clave', 'vcp']).sort_values('fecha', kind='stable')
+        if filas.empty:
+            return
+        nuevos = filas.drop_duplicates('clave', keep='last').set_index('clave')[['fecha', 'vcp', 'patrimonio']]
+        ultimos = pd.concat([self.ultimos, nuevos]) if len(self.ultimos) else nuevos
+        self.ultimos = ultimos.sort_values('fecha', kind='stable')
+        self.ultimos = self.ultimos[~self.ultimos.index.duplicated(keep='last')]
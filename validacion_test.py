@@ -0,0 +1,52 @@
+"""
+Pruebas de validacion.Validador con una base SQLite vacía (los últimos valores salen de los lotes anteriores).
+
+    python -m pytest validacion_test.py
+"""
+
+import datetime
+import pandas as pd
+import pytest
+import validacion
+
+# 2024-06-07 es viernes
+VIERNES, LUNES, MARTES = datetime.date(2024, 6, 7), datetime.date(2024, 6, 10), datetime.date(2024, 6, 11)
+
+
+@pytest.fixture
+def valida(db):
+    validador = validacion.Validador('tablaTempFCI', 'cuarentenaCAFCI')
+
+    def valida(*filas):
+        # filas: (fecha, vcp, vcpAnterior) del fondo 1
+        df = pd.DataFrame(filas, columns=['fecha', 'vcp', 'vcpAnterior'])
+        df['codigoCAFCI'] = 1
+        df['patrimonio'] = 1e8
+        with db.connection() as conn:
+            buenas, cuarentena = validador.valida(df, conn)
+        return dict(zip(cuarentena['fecha'], cuarentena['motivo']))
+    return valida
+
+
+def test_vcp_anterior_distinto_del_dia_habil_anterior(valida):
+    assert valida((VIERNES, 100.0, 99.0)) == {}
+    assert valida((LUNES, 100.2, 90.0)) == {LUNES: 'vcp_anterior'}
+
+
+def test_no_compara_vcp_anterior_si_falta_un_dia(valida):
+    # el lunes no llegó: el vcpAnterior del martes es el del lunes, que no tenemos
+    assert valida((VIERNES, 100.0, 99.0)) == {}
+    assert valida((MARTES, 100.4, 100.2)) == {}
+
+
+@pytest.mark.parametrize('mismo_lote', [True, False])
+def test_un_dia_en_cuarentena_no_arrastra_a_los_siguientes(valida, mismo_lote):
+    filas = [(VIERNES, 100.0, 99.9), (LUNES, 150.0, 100.0), (MARTES, 100.3, 150.0)]
+    if mismo_lote:
+        cuarentena = valida(*filas)
+    else:
+        cuarentena = {}
+        for fila in filas:
+            cuarentena.update(valida(fila))
+    # el martes se compara (salto) contra el viernes, pero su vcpAnterior es el del lunes, que quedó en cuarentena
+    assert cuarentena == {LUNES: 'salto_vcp'}